@@ -0,0 +1,139 @@
+""" Compare a generated workflow module with the dynamic ``Workflow``.
+
+Measures the time to obtain a workflow of ``--states`` states (each
+with two transitions) by parsing ZCML, by calling ``add_state`` and
+``add_transition``, and by importing a module generated by
+``repoze.workflow.codegen`` (from its ``.pyc`` file), and the
+throughput of transitions executed by each workflow.
+
+Run it with ``python benchmarks/bench_codegen.py``.
+"""
+import argparse
+import importlib
+import importlib.util
+import os
+import py_compile
+import shutil
+import sys
+import tempfile
+import timeit
+
+from zope.configuration import xmlconfig
+from zope.testing.cleanup import cleanUp
+
+from repoze.workflow.codegen import generate
+from repoze.workflow.codegen import generate_zcml
+from repoze.workflow.workflow import Workflow
+
+DUMMY = 'repoze.workflow.tests.fixtures.dummy'
+CALLBACK = DUMMY + '.callback'
+
+def build(states):
+    from repoze.workflow.tests.fixtures.dummy import callback
+    workflow = Workflow('state', 's0', name='bench')
+    for i in range(states):
+        workflow.add_state('s%d' % i, callback, title='State %d' % i)
+    for i in range(states):
+        workflow.add_transition('next%d' % i, 's%d' % i,
+                                's%d' % ((i + 1) % states), callback)
+        workflow.add_transition('back%d' % i, 's%d' % i,
+                                's%d' % ((i - 1) % states),
+                                guards=['context.allowed'])
+    return workflow
+
+def zcml(states):
+    lines = ['<configure xmlns="http://namespaces.repoze.org/bfg">',
+             '<include package="repoze.workflow" file="meta.zcml"/>',
+             '<workflow type="bench" name="bench" state_attr="state"',
+             '  initial_state="s0"',
+             '  content_types="%s.IContent">' % DUMMY]
+    for i in range(states):
+        lines.append('<state name="s%d" title="State %d" callback="%s"/>'
+                     % (i, i, CALLBACK))
+    for i in range(states):
+        lines.append('<transition name="next%d" from_state="s%d" '
+                     'to_state="s%d" callback="%s"/>'
+                     % (i, i, (i + 1) % states, CALLBACK))
+        lines.append('<transition name="back%d" from_state="s%d" '
+                     'to_state="s%d"><guard expression="context.allowed"/>'
+                     '</transition>' % (i, i, (i - 1) % states))
+    lines.extend(['</workflow>', '</configure>'])
+    return '\n'.join(lines)
+
+def load_zcml(text):
+    cleanUp()
+    xmlconfig.string(text)
+
+def register_generated():
+    cleanUp()
+    import_fresh('bench_generated_zcml').register()
+
+def import_fresh(name):
+    sys.modules.pop(name, None)
+    return importlib.import_module(name)
+
+class Content(object):
+    allowed = True
+
+def throughput(workflow, transitions):
+    content = Content()
+    workflow.initialize(content)
+    states = len(workflow._state_data)
+    def run():
+        for i in range(transitions):
+            workflow.transition(content, None, 'next%d' % (i % states))
+    content.state = 's0'
+    seconds = min(timeit.repeat(run, number=1, repeat=3))
+    return transitions / seconds
+
+def best(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--states', type=int, default=200)
+    parser.add_argument('--transitions', type=int, default=50000)
+    parser.add_argument('--number', type=int, default=10)
+    args = parser.parse_args(argv)
+    directory = tempfile.mkdtemp()
+    sys.path.insert(0, directory)
+    try:
+        text = zcml(args.states)
+        with open(os.path.join(directory, 'bench_from_zcml.zcml'), 'w') as f:
+            f.write(text)
+        with open(os.path.join(directory, 'bench_generated.py'), 'w') as f:
+            f.write(generate(build(args.states)))
+        with open(os.path.join(directory, 'bench_generated_zcml.py'),
+                  'w') as f:
+            f.write(generate_zcml(os.path.join(directory,
+                                               'bench_from_zcml.zcml')))
+        for name in ('bench_generated', 'bench_generated_zcml'):
+            # even if PYTHONDONTWRITEBYTECODE is set
+            py_compile.compile(os.path.join(directory, name + '.py'),
+                               importlib.util.cache_from_source(
+                                   os.path.join(directory, name + '.py')))
+        print('%d states, %d transitions' % (args.states, 2 * args.states))
+        print('startup (ms):')
+        for label, func in [
+            ('parse ZCML and register', lambda: load_zcml(text)),
+            ('import generated module and register',
+             register_generated),
+            ('add_state/add_transition', lambda: build(args.states)),
+            ('import generated module',
+             lambda: import_fresh('bench_generated')),
+            ]:
+            print('  %-40s %10.3f' % (label, best(func, args.number) * 1000))
+        print('transitions per second:')
+        for label, workflow in [
+            ('dynamic Workflow', build(args.states)),
+            ('generated workflow', import_fresh('bench_generated').workflow),
+            ]:
+            print('  %-40s %10.0f' % (label,
+                                      throughput(workflow, args.transitions)))
+    finally:
+        cleanUp()
+        sys.path.remove(directory)
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+""" Measure the memory forked processes share with their parent.
+
+Registers ``--workflows`` workflows of ``--states`` states, forks
+``--children`` processes which each call ``state_info`` and
+``transition`` ``--calls`` times on every workflow and run a garbage
+collection, and reports the mean shared and private memory of the
+children (from ``/proc/self/smaps_rollup``), first without and then
+with ``prepare_for_fork`` called before forking.
+
+Linux only.  Run it with ``python benchmarks/bench_fork.py``.
+"""
+import argparse
+import gc
+import os
+import sys
+
+from zope.interface import Interface
+from zope.interface import alsoProvides
+from zope.testing.cleanup import cleanUp
+
+from repoze.workflow import get_workflow
+from repoze.workflow import prepare_for_fork
+from repoze.workflow.workflow import Workflow
+from repoze.workflow.zcml import register_workflows
+
+class IContent(Interface):
+    pass
+
+class Content(object):
+    allowed = True
+
+def build(index, states):
+    workflow = Workflow('state%d' % index, 's0', name='workflow %d' % index)
+    for i in range(states):
+        workflow.add_state('s%d' % i, title='State %d' % i)
+    for i in range(states):
+        workflow.add_transition('next%d' % i, 's%d' % i,
+                                's%d' % ((i + 1) % states),
+                                guards=['context.allowed'])
+        workflow.add_transition('back%d' % i, 's%d' % i,
+                                's%d' % ((i - 1) % states))
+    return workflow
+
+def register(workflows, states):
+    cleanUp()
+    for w in range(workflows):
+        register_workflows(build(w, states), 'type%d' % w, [IContent], None)
+
+def memory():
+    # kB of shared and private memory of this process
+    shared = private = 0
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            fields = line.split()
+            if fields[0] in ('Shared_Clean:', 'Shared_Dirty:'):
+                shared += int(fields[1])
+            elif fields[0] in ('Private_Clean:', 'Private_Dirty:'):
+                private += int(fields[1])
+    return shared, private
+
+def work(workflows, states, calls):
+    content = Content()
+    alsoProvides(content, IContent)
+    for w in range(workflows):
+        workflow = get_workflow(IContent, 'type%d' % w, content)
+        workflow.initialize(content)
+        for i in range(calls):
+            workflow.state_info(content, None)
+            workflow.transition(content, None,
+                                'next%d' % (i % states))
+    gc.collect()
+
+def child(args, write):
+    work(args.workflows, args.states, args.calls)
+    os.write(write, ('%d %d\n' % memory()).encode('ascii'))
+    os._exit(0)
+
+def measure(args):
+    results = []
+    for i in range(args.children):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            child(args, write)
+        os.close(write)
+        with os.fdopen(read) as f:
+            results.append([int(value) for value in f.read().split()])
+        os.waitpid(pid, 0)
+    count = float(len(results))
+    return (sum([shared for shared, private in results]) / count,
+            sum([private for shared, private in results]) / count)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workflows', type=int, default=50)
+    parser.add_argument('--states', type=int, default=200)
+    parser.add_argument('--children', type=int, default=4)
+    parser.add_argument('--calls', type=int, default=100)
+    args = parser.parse_args(argv)
+    if not os.path.exists('/proc/self/smaps_rollup'):
+        sys.exit('This benchmark needs /proc/self/smaps_rollup (Linux).')
+    print('%d workflows of %d states, %d children, %d calls each'
+          % (args.workflows, args.states, args.children, args.calls))
+    print('%-20s %12s %12s' % ('', 'shared (kB)', 'private (kB)'))
+    try:
+        for label, prepare in [('as configured', False),
+                               ('prepare_for_fork', True)]:
+            register(args.workflows, args.states)
+            gc.collect()
+            if prepare:
+                prepare_for_fork()
+            shared, private = measure(args)
+            print('%-20s %12.0f %12.0f' % (label, shared, private))
+            if hasattr(gc, 'unfreeze'):
+                gc.unfreeze()
+    finally:
+        cleanUp()
+
+if __name__ == '__main__':
+    main()
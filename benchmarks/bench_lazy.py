@@ -0,0 +1,96 @@
+""" Compare eager and lazy registration of ZCML workflows.
+
+Executes a synthetic ZCML file declaring ``--workflows`` workflows of
+``--states`` states each, every one for ``--content-types`` content
+types, with and without ``lazy="true"``, and reports the time taken
+and the memory allocated by the configuration, and the time taken by
+the first and subsequent ``get_workflow`` calls.
+
+Run it with ``python benchmarks/bench_lazy.py``.
+"""
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+import types
+
+from zope.configuration import xmlconfig
+from zope.interface import Interface
+from zope.testing.cleanup import cleanUp
+
+from repoze.workflow.workflow import get_workflow
+
+MODULE = 'bench_lazy_types'
+
+def content_types(count):
+    module = types.ModuleType(MODULE)
+    for i in range(count):
+        name = 'IContent%d' % i
+        setattr(module, name, type(Interface)(name, (Interface,),
+                                              {'__module__': MODULE}))
+    sys.modules[MODULE] = module
+    return [getattr(module, 'IContent%d' % i) for i in range(count)]
+
+def zcml(workflows, states, count, lazy):
+    lines = ['<configure xmlns="http://namespaces.repoze.org/bfg">',
+             '<include package="repoze.workflow" file="meta.zcml"/>']
+    types_attr = ' '.join(['%s.IContent%d' % (MODULE, i)
+                           for i in range(count)])
+    for w in range(workflows):
+        lines.append('<workflow type="type%d" name="workflow %d" '
+                     'state_attr="state%d" initial_state="s0" lazy="%s" '
+                     'content_types="%s">'
+                     % (w, w, w, lazy and 'true' or 'false', types_attr))
+        for i in range(states):
+            lines.append('<state name="s%d"/>' % i)
+        for i in range(states):
+            lines.append('<transition name="t%d" from_state="s%d" '
+                         'to_state="s%d"><guard expression="context.ok"/>'
+                         '</transition>' % (i, i, (i + 1) % states))
+        lines.append('</workflow>')
+    lines.append('</configure>')
+    return '\n'.join(lines)
+
+def measure(text, iface, clock):
+    cleanUp()
+    gc.collect()
+    tracemalloc.start()
+    started = clock()
+    xmlconfig.string(text)
+    configured = clock()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    first = clock()
+    get_workflow(iface, 'type0')
+    second = clock()
+    get_workflow(iface, 'type0')
+    third = clock()
+    return configured - started, memory, second - first, third - second
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workflows', type=int, default=20)
+    parser.add_argument('--states', type=int, default=50)
+    parser.add_argument('--content-types', type=int, default=10)
+    args = parser.parse_args(argv)
+    clock = getattr(time, 'perf_counter', time.time)
+    ifaces = content_types(args.content_types)
+    print('%d workflows of %d states for %d content types'
+          % (args.workflows, args.states, args.content_types))
+    print('%-6s %12s %12s %18s %18s' % ('mode', 'config (ms)', 'memory (kB)',
+                                        'first lookup (ms)',
+                                        'next lookup (ms)'))
+    try:
+        for lazy in (False, True):
+            text = zcml(args.workflows, args.states, args.content_types,
+                        lazy)
+            config, memory, first, second = measure(text, ifaces[0], clock)
+            print('%-6s %12.1f %12.0f %18.3f %18.3f' % (
+                lazy and 'lazy' or 'eager', config * 1000, memory / 1024.0,
+                first * 1000, second * 1000))
+    finally:
+        cleanUp()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+""" Measure workflow lookups and transitions during hot reloads.
+
+Runs ``--threads`` threads which look up a workflow of ``--states``
+states with ``get_workflow`` and execute a transition, in a loop, for
+``--seconds`` seconds, first undisturbed and then while the workflow's
+ZCML file is reloaded by a ``WorkflowReloader`` every ``--every``
+seconds.  Reports the transitions per second, the mean time of a
+reload and the number of errors seen by the threads (there should be
+none).
+
+Run it with ``python benchmarks/bench_reload.py``.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from zope.testing.cleanup import cleanUp
+
+from repoze.workflow import get_workflow
+from repoze.workflow.reload import WorkflowReloader
+from repoze.workflow.tests.fixtures.dummy import Content
+from repoze.workflow.tests.fixtures.dummy import IContent
+
+DUMMY = 'repoze.workflow.tests.fixtures.dummy'
+
+def zcml(states, version):
+    lines = ['<configure xmlns="http://namespaces.repoze.org/bfg">',
+             '<include package="repoze.workflow" file="meta.zcml"/>',
+             '<workflow type="bench" name="version %d" state_attr="state"'
+             % version,
+             '  initial_state="s0"',
+             '  content_types="%s.IContent">' % DUMMY]
+    for i in range(states):
+        lines.append('<state name="s%d"/>' % i)
+    for i in range(states):
+        lines.append('<transition name="next%d" from_state="s%d" '
+                     'to_state="s%d"/>' % (i, i, (i + 1) % states))
+    lines.extend(['</workflow>', '</configure>'])
+    return '\n'.join(lines)
+
+def write(path, text, version):
+    with open(path, 'w') as f:
+        f.write(text)
+    os.utime(path, (version, version))
+
+def run(threads, seconds, states):
+    stop = threading.Event()
+    counts = []
+    errors = []
+    def read():
+        content = Content()
+        count = 0
+        while not stop.is_set():
+            workflow = get_workflow(IContent, 'bench', content)
+            try:
+                workflow.transition(content, None,
+                                    'next%d' % (count % states))
+            except Exception as e:
+                errors.append(e)
+            count += 1
+        counts.append(count)
+    workers = [threading.Thread(target=read) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    return stop, workers, counts, errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--states', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--every', type=float, default=0.1)
+    args = parser.parse_args(argv)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'workflows.zcml')
+    try:
+        cleanUp()
+        write(path, zcml(args.states, 0), 1)
+        reloader = WorkflowReloader(path)
+        reloader.load()
+        print('%d states, %d threads' % (args.states, args.threads))
+        print('%-20s %14s %16s %8s' % ('', 'transitions/s', 'reload (ms)',
+                                       'errors'))
+        for label, reload in [('no reloads', False), ('reloading', True)]:
+            reloads = []
+            stop, workers, counts, errors = run(args.threads, args.seconds,
+                                                args.states)
+            deadline = time.time() + args.seconds
+            while time.time() < deadline:
+                time.sleep(args.every)
+                if reload:
+                    version = reloader.version + 1
+                    write(path, zcml(args.states, version), version + 1)
+                    started = time.time()
+                    reloader.check()
+                    reloads.append(time.time() - started)
+            stop.set()
+            for worker in workers:
+                worker.join()
+            print('%-20s %14.0f %16s %8d' % (
+                label, sum(counts) / args.seconds,
+                reloads and '%.1f' % (sum(reloads) / len(reloads) * 1000)
+                or '-', len(errors)))
+    finally:
+        cleanUp()
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+""" Compare ways of shipping a workflow definition to another process.
+
+Builds a workflow of ``--states`` states (each with two transitions,
+one guarded by an expression) and reports the size of its definition
+and the time taken to encode it and to decode it into a workflow:
+with ``repoze.workflow.serialize``, with ``pickle``, and by rebuilding
+the workflow from scratch.
+
+Run it with ``python benchmarks/bench_serialize.py``.
+"""
+import argparse
+import pickle
+import timeit
+
+from repoze.workflow.serialize import dumps
+from repoze.workflow.serialize import loads
+from repoze.workflow.workflow import Workflow
+
+def build(states):
+    from repoze.workflow.tests.fixtures.dummy import callback
+    workflow = Workflow('state', 's0', name='bench')
+    for i in range(states):
+        workflow.add_state('s%d' % i, callback, title='State %d' % i,
+                           tags=('tag%d' % (i % 7),))
+    for i in range(states):
+        workflow.add_transition('next%d' % i, 's%d' % i,
+                                's%d' % ((i + 1) % states), callback)
+        workflow.add_transition('back%d' % i, 's%d' % i,
+                                's%d' % ((i - 1) % states),
+                                guards=['context.allowed'])
+    return workflow
+
+def best(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--states', type=int, default=1000)
+    parser.add_argument('--number', type=int, default=10)
+    args = parser.parse_args(argv)
+    workflow = build(args.states)
+    data = dumps(workflow)
+    pickled = pickle.dumps(workflow, pickle.HIGHEST_PROTOCOL)
+    assert loads(data)._state_data == workflow._state_data
+    print('%d states, %d transitions' % (args.states, 2 * args.states))
+    print('%-30s %10s %12s %12s' % ('', 'size (kB)', 'encode (ms)',
+                                    'decode (ms)'))
+    for label, size, encode, decode in [
+        ('serialize dumps/loads', len(data), lambda: dumps(workflow),
+         lambda: loads(data)),
+        ('pickle', len(pickled),
+         lambda: pickle.dumps(workflow, pickle.HIGHEST_PROTOCOL),
+         lambda: pickle.loads(pickled)),
+        ('rebuild', 0, None, lambda: build(args.states)),
+        ]:
+        print('%-30s %10.1f %12s %12.2f' % (
+            label, size / 1024.0,
+            encode and '%.2f' % (best(encode, args.number) * 1000) or '-',
+            best(decode, args.number) * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+""" Time the execution of a large synthetic ZCML configuration.
+
+Declares ``--workflows`` workflows of ``--states`` states, each for
+``--content-types`` content types, and reports the number of
+configuration actions and the time taken to execute the configuration
+(the best of ``--repeat`` runs).
+
+Run it with ``python benchmarks/bench_zcml.py``.
+"""
+import argparse
+import sys
+import time
+import types
+
+from zope.configuration import xmlconfig
+from zope.configuration.config import ConfigurationMachine
+from zope.interface import Interface
+from zope.testing.cleanup import cleanUp
+
+MODULE = 'bench_zcml_types'
+
+def content_types(count):
+    module = types.ModuleType(MODULE)
+    for i in range(count):
+        name = 'IContent%d' % i
+        setattr(module, name, type(Interface)(name, (Interface,),
+                                              {'__module__': MODULE}))
+    sys.modules[MODULE] = module
+
+def zcml(workflows, states, count):
+    lines = ['<configure xmlns="http://namespaces.repoze.org/bfg">',
+             '<include package="repoze.workflow" file="meta.zcml"/>']
+    types_attr = ' '.join(['%s.IContent%d' % (MODULE, i)
+                           for i in range(count)])
+    for w in range(workflows):
+        lines.append('<workflow type="type%d" name="workflow %d" '
+                     'state_attr="state" initial_state="s0" '
+                     'content_types="%s">' % (w, w, types_attr))
+        for i in range(states):
+            lines.append('<state name="s%d"/>' % i)
+        for i in range(states):
+            lines.append('<transition name="t%d" from_state="s%d" '
+                         'to_state="s%d"/>' % (i, i, (i + 1) % states))
+        lines.append('</workflow>')
+    lines.append('</configure>')
+    return '\n'.join(lines)
+
+def execute(text):
+    cleanUp()
+    context = ConfigurationMachine()
+    xmlconfig.registerCommonDirectives(context)
+    xmlconfig.string(text, context=context, execute=False)
+    actions = len(context.actions)
+    context.execute_actions()
+    return actions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workflows', type=int, default=20)
+    parser.add_argument('--states', type=int, default=20)
+    parser.add_argument('--content-types', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    clock = getattr(time, 'perf_counter', time.time)
+    content_types(args.content_types)
+    text = zcml(args.workflows, args.states, args.content_types)
+    timings = []
+    try:
+        for i in range(args.repeat):
+            started = clock()
+            actions = execute(text)
+            timings.append(clock() - started)
+    finally:
+        cleanUp()
+    print('%d workflows of %d states for %d content types: %d actions, '
+          '%.1f ms' % (args.workflows, args.states, args.content_types,
+                       actions, min(timings) * 1000))
+
+if __name__ == '__main__':
+    main()
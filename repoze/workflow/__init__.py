@@ -1,7 +1,13 @@
 from repoze.workflow.workflow import Workflow # API
+from repoze.workflow.composite import CompositeWorkflow # API
 from repoze.workflow.workflow import WorkflowError #API
+from repoze.workflow.workflow import TransitionInProgress #API
 from repoze.workflow.workflow import get_workflow #API
+from repoze.workflow.workflow import get_workflows #API
+from repoze.workflow.workflow import get_transitions_many #API
+from repoze.workflow.workflow import prepare_for_fork #API
 from repoze.workflow.interfaces import IWorkflow # API
+from repoze.workflow.interfaces import ICompositeWorkflow # API
 from repoze.workflow.interfaces import IWorkflowFactory # API
 
 
@@ -0,0 +1,5 @@
+import sys
+
+from repoze.workflow.cli import main
+
+sys.exit(main()) # pragma: no cover
@@ -0,0 +1,38 @@
+import importlib
+
+def dotted_name(ob):
+    """ Return the dotted name of the module-level object ``ob``, or
+    raise ``ValueError`` if it can't be imported back by that name. """
+    module = getattr(ob, '__module__', None)
+    name = getattr(ob, '__qualname__', None) or getattr(ob, '__name__', None)
+    if module is None or name is None or '<' in name:
+        raise ValueError('%r has no importable dotted name' % (ob,))
+    dotted = '%s.%s' % (module, name)
+    try:
+        found = resolve(dotted)
+    except (ImportError, AttributeError):
+        found = None
+    if found is not ob:
+        raise ValueError('%r has no importable dotted name' % (ob,))
+    return dotted
+
+def resolve(dotted):
+    """ Return the object named by ``dotted``, either of the form
+    ``package.module.name`` or ``package.module:name``. """
+    if ':' in dotted:
+        module, name = dotted.split(':', 1)
+        ob = importlib.import_module(module)
+        for part in name.split('.'):
+            ob = getattr(ob, part)
+        return ob
+    parts = dotted.split('.')
+    for i in range(len(parts), 0, -1):
+        try:
+            ob = importlib.import_module('.'.join(parts[:i]))
+        except ImportError:
+            if i == 1:
+                raise
+            continue
+        for part in parts[i:]:
+            ob = getattr(ob, part)
+        return ob
@@ -0,0 +1,72 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+_marker = object()
+
+class LRUCache(object):
+    """ A bounded, thread-safe mapping which discards the least
+    recently used entry when full.  If ``ttl`` is not None, entries
+    older than ``ttl`` seconds (as measured by ``clock``) are treated
+    as absent. """
+
+    def __init__(self, maxsize, ttl=None, clock=time.time):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _marker) is not _marker
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _marker)
+            if entry is _marker:
+                return default
+            value, expires = entry
+            if expires is not None and expires <= self.clock():
+                return default
+            self._data[key] = entry
+            return value
+
+    def set(self, key, value):
+        if self.ttl is None:
+            expires = None
+        else:
+            expires = self.clock() + self.ttl
+        with self._lock:
+            data = self._data
+            data.pop(key, None)
+            data[key] = (value, expires)
+            while len(data) > self.maxsize:
+                data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _marker)
+        if entry is _marker:
+            return default
+        return entry[0]
+
+    def items(self):
+        """ Return a list of the ``(key, value)`` pairs which have not
+        expired, least recently used first, without using them. """
+        now = self.clock()
+        with self._lock:
+            return [(key, value)
+                    for key, (value, expires) in self._data.items()
+                    if expires is None or expires > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
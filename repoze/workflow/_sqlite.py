@@ -0,0 +1,40 @@
+""" SQLite helpers shared by the durable queues. """
+import sqlite3
+from contextlib import contextmanager
+
+def connect(path):
+    # a connection to the database at ``path`` in WAL mode, which may
+    # be used by several threads; it is in autocommit mode, so that
+    # transactions are managed explicitly (see ``immediate``)
+    connection = sqlite3.connect(path, isolation_level=None,
+                                 check_same_thread=False, timeout=30)
+    connection.execute('PRAGMA journal_mode=WAL')
+    return connection
+
+@contextmanager
+def immediate(connection):
+    # a transaction which takes the write lock of the database at once
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+    except:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+def claim(connection, table, columns, available, params, limit, lease,
+          lease_params):
+    """ Lease rows of ``table``: in one transaction, select the ``id``
+    and ``columns`` of up to ``limit`` rows, in ``id`` order, which
+    match the condition ``available`` (with ``params``), apply the
+    assignments ``lease`` (with ``lease_params``) to them and return
+    the selected rows. """
+    with immediate(connection):
+        rows = connection.execute(
+            'SELECT id, %s FROM %s WHERE %s ORDER BY id LIMIT ?'
+            % (columns, table, available),
+            tuple(params) + (limit,)).fetchall()
+        connection.executemany(
+            'UPDATE %s SET %s WHERE id = ?' % (table, lease),
+            [tuple(lease_params) + (row[0],) for row in rows])
+    return rows
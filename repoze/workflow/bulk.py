@@ -0,0 +1,178 @@
+""" Bulk execution of a transition over many content objects. """
+
+from repoze.workflow.storage import _identity
+from repoze.workflow.workflow import CallbackInfo
+from repoze.workflow.workflow import PermissionGuard
+
+def _run_callbacks(tasks):
+    # Run in a worker process: ``tasks`` is a sequence of
+    # ``(payload, transition, callbacks)`` tuples.  Return a list
+    # holding None for each task which succeeded and the exception
+    # raised for each task which failed.
+    results = []
+    for payload, transition, callbacks in tasks:
+        info = CallbackInfo(None, transition)
+        try:
+            for callback in callbacks:
+                callback(payload, info)
+        except Exception as e:
+            results.append(e)
+        else:
+            results.append(None)
+    return results
+
+def _portable(transition):
+    # the transition dictionary passed to callbacks run in a worker
+    # process, without the (possibly unpicklable) callables it holds
+    transition = dict(transition)
+    transition.pop('callback', None)
+    transition.pop('guards', None)
+    return transition
+
+class BulkResult(object):
+    """ The outcome of ``BulkTransitionRunner.run``.
+
+    ``succeeded`` is the list of content objects which were
+    transitioned; ``failed`` is a list of ``(content, exception)``
+    pairs for content objects which were not, in the order of the
+    contents passed to ``run``. """
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = []
+
+class BulkTransitionRunner(object):
+    """ Execute a transition of ``workflow`` over many content objects.
+
+    Transitions are resolved and their guards (and permission) checked
+    in the calling process.  The transition and state callbacks are
+    then run in chunks of ``chunksize`` items on a process pool of
+    ``max_workers`` processes (a ``ProcessPoolExecutor`` created for
+    each run unless ``executor`` is supplied), and the new states are
+    finally written in the calling process with a single
+    ``set_many`` call to the workflow's state store.
+
+    Callbacks run in a worker process receive ``key(content)`` (the
+    content object itself if ``key`` is None) instead of the content
+    object, and an ``info`` object whose ``workflow`` and ``request``
+    are None and whose ``transition`` lacks the ``callback`` and
+    ``guards`` keys; the callbacks and the keys must be picklable.  If
+    ``max_workers`` is 0, the callbacks are run in the calling process
+    with the content objects, as ``transition`` would run them.  As by
+    ``transition``, the callbacks of states and transitions marked
+    ``deferred`` are not run but handed to the workflow's deferred
+    queue, if it has one, once the new states are written.
+    """
+
+    def __init__(self, workflow, chunksize=100, max_workers=None,
+                 executor=None, key=None):
+        if chunksize < 1:
+            raise ValueError('chunksize must be at least 1')
+        if key is None:
+            key = _identity
+        self.workflow = workflow
+        self.chunksize = chunksize
+        self.max_workers = max_workers
+        self.executor = executor
+        self.key = key
+
+    def _prepare(self, contents, request, transition_name, guards, result):
+        workflow = self.workflow
+        states = workflow.states_of(contents, request)
+        if workflow.permission_checker:
+            guards = list(guards)
+            guards.append(PermissionGuard(request, transition_name,
+                                          workflow.permission_checker))
+        prepared = []
+        for content, state in zip(contents, states):
+            try:
+                transition = workflow._find_transition(state, transition_name)
+                info = CallbackInfo(workflow, transition, request=request)
+                workflow._check_guards(transition, guards, content, info)
+            except Exception as e:
+                # not only vetoes: a guard or permission checker which
+                # fails fails its content object alone
+                result.failed.append((content, e))
+            else:
+                prepared.append((content, transition, info))
+        return prepared
+
+    # _run_inline and _run_pooled return an ``(exception, deferred)``
+    # pair for each prepared item: the exception raised by a callback
+    # (None if none was), and the deferred callbacks to queue
+
+    def _run_inline(self, prepared):
+        workflow = self.workflow
+        outcomes = []
+        for content, transition, info in prepared:
+            try:
+                deferred = workflow._run_callbacks(transition, content, info)
+            except Exception as e:
+                outcomes.append((e, ()))
+            else:
+                outcomes.append((None, deferred))
+        return outcomes
+
+    def _run_pooled(self, prepared):
+        tasks = []
+        deferred = []
+        for content, transition, info in prepared:
+            callbacks = self.workflow._callbacks(transition)
+            tasks.append((self.key(content), _portable(transition),
+                          [callback for callback, defer in callbacks
+                           if not defer]))
+            deferred.append([callback for callback, defer in callbacks
+                             if defer])
+        if not tasks:
+            return []
+        executor = self.executor
+        if executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            executor = ProcessPoolExecutor(self.max_workers)
+        try:
+            chunks = [tasks[start:start + self.chunksize]
+                      for start in range(0, len(tasks), self.chunksize)]
+            futures = [executor.submit(_run_callbacks, chunk)
+                       for chunk in chunks]
+            errors = []
+            for chunk, future in zip(chunks, futures):
+                try:
+                    errors.extend(future.result())
+                except Exception as e:
+                    errors.extend([e] * len(chunk))
+            return list(zip(errors, deferred))
+        finally:
+            if executor is not self.executor:
+                executor.shutdown()
+
+    def run(self, contents, request, transition_name, guards=()):
+        """ Execute the transition named ``transition_name`` for each
+        of the ``contents`` and return a ``BulkResult``.  ``guards``
+        are called for each content object, in addition to the guards
+        of the transition (see ``IWorkflow.transition``). """
+        contents = list(contents)
+        result = BulkResult()
+        prepared = self._prepare(contents, request, transition_name,
+                                 guards, result)
+        if self.max_workers == 0:
+            outcomes = self._run_inline(prepared)
+        else:
+            outcomes = self._run_pooled(prepared)
+        writes = []
+        queued = []
+        for (content, transition, info), (error, deferred) in zip(prepared,
+                                                                   outcomes):
+            if error is None:
+                writes.append((content, transition['to_state']))
+                result.succeeded.append(content)
+                queued.extend([(callback, content, info)
+                               for callback in deferred])
+            else:
+                result.failed.append((content, error))
+        if writes:
+            self.workflow.state_store.set_many(writes)
+        for callback, content, info in queued:
+            self.workflow.deferred_queue.put(callback, content, info)
+        index = dict([(id(content), i) for i, content in enumerate(contents)])
+        result.failed.sort(key=lambda failure: index[id(failure[0])])
+        return result
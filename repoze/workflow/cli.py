@@ -0,0 +1,267 @@
+""" The ``python -m repoze.workflow`` command.
+
+Usage::
+
+  python -m repoze.workflow list FILE [--package PACKAGE]
+  python -m repoze.workflow check FILE [--package PACKAGE] [--final STATE]
+  python -m repoze.workflow bench FILE [--package PACKAGE] [--number N]
+
+Each command executes the ZCML file ``FILE`` (relative to the package
+``PACKAGE``, if supplied) and then:
+
+``list``
+  lists the registered workflows per content type and workflow type,
+  with their numbers of states and transitions;
+
+``check``
+  reports the states of each workflow which cannot be reached from its
+  initial state, and the *dead ends*: reachable states which no
+  transition leaves, other than those named by ``--final``; it exits
+  with status 1 if it finds any;
+
+``bench``
+  times ``get_workflow``, ``state_info`` and ``transition`` for each
+  registered workflow, using a dummy content object providing the
+  content type and no request (so permissions are not checked; guards
+  are called).  ``state_info`` and ``transition`` are timed on a copy
+  of the workflow which keeps states in a dictionary of its own, has no
+  deferred queue and calls no callbacks, so that nothing outside it is
+  changed; a workflow which cannot be measured is reported and makes
+  the command exit with status 1.
+"""
+from __future__ import print_function
+
+import argparse
+import importlib
+import sys
+import time
+
+from zope.component import getSiteManager
+from zope.interface import alsoProvides
+from zope.interface.interfaces import IInterface
+
+from repoze.workflow._dotted import dotted_name
+from repoze.workflow.interfaces import IWorkflowList
+from repoze.workflow.storage import DictStateStore
+from repoze.workflow.workflow import Workflow
+from repoze.workflow.workflow import get_workflow
+from repoze.workflow.workflow import _materialized
+
+def load(filename, package=None):
+    """ Execute the ZCML file ``filename``, relative to ``package`` (a
+    package or its dotted name) if supplied. """
+    from zope.configuration import xmlconfig
+    if isinstance(package, str):
+        package = importlib.import_module(package)
+    xmlconfig.file(filename, package, execute=True)
+
+def registrations():
+    """ Return a list of ``(content_type, type, elector, workflow)``
+    tuples for the workflows registered in the current site manager,
+    sorted by content type and type.  Lazily registered workflows are
+    built. """
+    found = []
+    for registration in getSiteManager().registeredAdapters():
+        if registration.provided is not IWorkflowList:
+            continue
+        content_type, = registration.required
+        for wf_def in registration.factory:
+            found.append((content_type, registration.name,
+                          wf_def['elector'], _materialized(wf_def)))
+    found.sort(key=lambda item: (_describe(item[0]), item[1]))
+    return found
+
+def _describe(content_type):
+    return getattr(content_type, '__identifier__', None) or repr(content_type)
+
+def _name(ob):
+    try:
+        return dotted_name(ob)
+    except ValueError:
+        return repr(ob)
+
+def reachable_states(workflow):
+    """ Return the set of the states of ``workflow`` which can be reached
+    from its initial state.  A parent state is reached when any of its
+    sub-states is. """
+    ancestors = workflow._ancestors
+    initial = workflow.initial_state
+    seen = set(ancestors.get(initial, (initial,)))
+    pending = [initial]
+    while pending:
+        state = pending.pop()
+        for transition in workflow._leaving(state):
+            to_state = transition['to_state']
+            if to_state not in seen:
+                pending.append(to_state)
+            # the transitions leaving a sub-state include those leaving
+            # its ancestors, so these need not be visited themselves
+            seen.update(ancestors.get(to_state, (to_state,)))
+    return seen
+
+def check_workflow(workflow, final=()):
+    """ Return a list of problems found in ``workflow``: unreachable
+    states, and dead ends not named in ``final``. """
+    problems = []
+    reachable = reachable_states(workflow)
+    for state in workflow._state_data:
+        if state not in reachable:
+            problems.append('state %r is unreachable' % state)
+        elif not workflow._leaving(state) and state not in final:
+            problems.append('state %r is a dead end' % state)
+    return problems
+
+def _per_call(func, number, clock):
+    started = clock()
+    for i in range(number):
+        func()
+    return (clock() - started) / number
+
+class _Content(object):
+    pass
+
+def _scratch(workflow):
+    # a copy of ``workflow`` which keeps states in a dictionary of its
+    # own, has no deferred queue and calls no callbacks
+    copy = Workflow(workflow.state_attr, workflow.initial_state,
+                    workflow.permission_checker, workflow.name,
+                    workflow.description, state_store=DictStateStore(),
+                    adaptive_guards=workflow.guard_stats is not None,
+                    deterministic=workflow.deterministic)
+    for name in ('_state_aliases', '_state_parents', '_ancestors',
+                 '_descendants'):
+        setattr(copy, name, getattr(workflow, name))
+    for name in ('_state_data', '_transition_data'):
+        setattr(copy, name, dict([(key, dict(data, callback=None))
+                                  for key, data
+                                  in getattr(workflow, name).items()]))
+    return copy
+
+def _benchmarked_transition(workflow, content):
+    # return the name of a transition which succeeds on ``content``
+    store = workflow.state_store
+    for name, transition in workflow._transition_data.items():
+        store.set(content, transition['from_state'])
+        try:
+            workflow.transition(content, None, name)
+        except Exception:
+            continue
+        return name, transition['from_state']
+    return None, None
+
+def bench_workflow(content_type, type, workflow, number=1000, clock=None):
+    """ Return a dictionary of the mean times, in seconds, of
+    ``get_workflow``, ``state_info`` and ``transition`` for
+    ``workflow``; a time is None if it could not be measured.
+    ``state_info`` and ``transition`` are timed on a copy of
+    ``workflow`` which keeps states in a ``DictStateStore``, has no
+    deferred queue and calls no callbacks. """
+    if clock is None:
+        clock = getattr(time, 'perf_counter', time.time)
+    content = _Content()
+    if IInterface.providedBy(content_type):
+        alsoProvides(content, content_type)
+    results = {}
+    results['get_workflow'] = _per_call(
+        lambda: get_workflow(content_type, type, content), number, clock)
+    workflow = _scratch(workflow)
+    workflow.initialize(content)
+    results['state_info'] = _per_call(
+        lambda: workflow.state_info(content, None), number, clock)
+    name, from_state = _benchmarked_transition(workflow, content)
+    results['transition'] = None
+    if name is not None:
+        set_state = workflow.state_store.set
+        def transition():
+            set_state(content, from_state)
+            workflow.transition(content, None, name)
+        results['transition'] = _per_call(transition, number, clock)
+    return results
+
+def _list(args, out):
+    last = None
+    for content_type, type, elector, workflow in registrations():
+        if content_type is not last:
+            print(_describe(content_type), file=out)
+            last = content_type
+        line = '  %s: %r' % (type, workflow.name)
+        if elector is not None:
+            line += ' (elector %s)' % _name(elector)
+        if isinstance(workflow, Workflow):
+            line += ', %d states, %d transitions' % (
+                len(workflow._state_data), len(workflow._transition_data))
+        print(line, file=out)
+    return 0
+
+def _workflows():
+    # each registered Workflow once, with its first registration
+    seen = set()
+    for content_type, type, elector, workflow in registrations():
+        if isinstance(workflow, Workflow) and id(workflow) not in seen:
+            seen.add(id(workflow))
+            yield content_type, type, workflow
+
+def _check(args, out):
+    status = 0
+    for content_type, type, workflow in _workflows():
+        problems = check_workflow(workflow, args.final)
+        if problems:
+            status = 1
+        print('%s %s %r: %s' % (_describe(content_type), type, workflow.name,
+                                problems and 'FAILED' or 'OK'), file=out)
+        for problem in problems:
+            print('  %s' % problem, file=out)
+    return status
+
+def _bench(args, out):
+    status = 0
+    for content_type, type, workflow in _workflows():
+        print('%s %s %r' % (_describe(content_type), type, workflow.name),
+              file=out)
+        try:
+            results = bench_workflow(content_type, type, workflow,
+                                     args.number)
+        except Exception as e:
+            status = 1
+            print('  FAILED: %s: %s' % (e.__class__.__name__, e), file=out)
+            continue
+        for name in ('get_workflow', 'state_info', 'transition'):
+            seconds = results[name]
+            if seconds is None:
+                timing = 'no transition succeeded'
+            else:
+                timing = '%.2f us' % (seconds * 1e6)
+            print('  %-14s %s' % (name, timing), file=out)
+    return status
+
+def main(argv=None, out=None):
+    """ Run the command line ``argv`` (by default ``sys.argv[1:]``),
+    writing to ``out`` (by default standard output), and return the
+    exit status. """
+    if out is None:
+        out = sys.stdout
+    parser = argparse.ArgumentParser(
+        prog='python -m repoze.workflow',
+        description='Inspect the workflows configured by a ZCML file.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    for name, func, help in [
+        ('list', _list, 'list the registered workflows'),
+        ('check', _check, 'find unreachable states and dead ends'),
+        ('bench', _bench, 'time get_workflow, state_info and transition'),
+        ]:
+        command = commands.add_parser(name, help=help)
+        command.set_defaults(func=func)
+        command.add_argument('file', help='the ZCML file')
+        command.add_argument('--package',
+                             help='the package the file is relative to')
+        if name == 'check':
+            command.add_argument('--final', action='append', default=[],
+                                 metavar='STATE',
+                                 help='a state which may be a dead end')
+        if name == 'bench':
+            command.add_argument('--number', type=int, default=1000,
+                                 help='calls per measurement')
+    args = parser.parse_args(argv)
+    load(args.file, args.package)
+    return args.func(args, out)
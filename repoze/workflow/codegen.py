@@ -0,0 +1,268 @@
+""" Ahead-of-time code generation of workflows.
+
+``generate`` turns a configured ``Workflow`` into the source of a
+Python module which defines an equivalent workflow, and
+``generate_zcml`` does the same for the workflows declared in a ZCML
+file.  The state and transition tables of a generated workflow,
+including the per-state transition index normally built on first use,
+are written out as literals, and the callables it refers to (callbacks,
+guards, permission checkers, electors and content types) are imported
+by their dotted names.  Importing a generated module therefore involves
+no ZCML parsing and no ``add_state`` or ``add_transition`` calls, and
+its compiled form is cached in a ``.pyc`` file like that of any other
+module.
+
+Each generated workflow has its own in-memory idempotency cache;
+assign the ``idempotency_cache`` of a generated workflow to share
+one.  A state store other than the default ``AttributeStateStore``,
+and a deferred callback queue, are generated only if they are
+importable by their dotted names.
+"""
+import pprint
+
+from repoze.workflow._dotted import dotted_name
+from repoze.workflow.guards import ExpressionGuard
+from repoze.workflow.guards import _OrderIndependent
+from repoze.workflow.storage import AttributeStateStore
+from repoze.workflow.workflow import Workflow
+from repoze.workflow.workflow import WorkflowError
+
+_LITERALS = (type(None), bool, int, float, str, bytes)
+
+try:
+    _LITERALS += (unicode, long) # noqa
+except NameError: # pragma: no cover (Python 3)
+    pass
+
+class _Module(object):
+    # the imports and assignments of a generated module
+
+    def __init__(self):
+        self.imports = {} # dotted name -> local name
+        self.guards = {} # guard expression -> local name
+        self.import_lines = []
+        self.lines = []
+        self.counters = {}
+
+    def _local(self, prefix):
+        count = self.counters.get(prefix, 0)
+        self.counters[prefix] = count + 1
+        return '_%s%d' % (prefix, count)
+
+    def import_(self, module, name):
+        dotted = '%s.%s' % (module, name)
+        local = self.imports.get(dotted)
+        if local is None:
+            local = self.imports[dotted] = self._local('r')
+            self.import_lines.append('from %s import %s as %s'
+                                     % (module, name, local))
+        return local
+
+    def reference(self, ob):
+        try:
+            dotted = dotted_name(ob)
+        except ValueError:
+            raise WorkflowError('Cannot generate code for %r: it is not '
+                                'importable by a dotted name' % (ob,))
+        module = ob.__module__
+        path = dotted[len(module) + 1:].split('.')
+        return '.'.join([self.import_(module, path[0])] + path[1:])
+
+    def value(self, ob):
+        if isinstance(ob, _LITERALS):
+            return repr(ob)
+        if isinstance(ob, ExpressionGuard):
+            # one guard per expression, compiled once at import time
+            local = self.guards.get(ob.expression)
+            if local is None:
+                local = self.guards[ob.expression] = self._local('g')
+                self.assign(local, '%s(%r)' % (self.import_(
+                    'repoze.workflow.guards', 'ExpressionGuard'),
+                                               ob.expression))
+            return local
+        if isinstance(ob, _OrderIndependent):
+            return '%s(%s)' % (self.import_(
+                'repoze.workflow.guards', '_OrderIndependent'),
+                               self.value(ob.guard))
+        if isinstance(ob, tuple):
+            items = [self.value(item) for item in ob]
+            if len(items) == 1:
+                return '(%s,)' % items[0]
+            return '(%s)' % ', '.join(items)
+        if isinstance(ob, list):
+            return '[%s]' % ', '.join([self.value(item) for item in ob])
+        if isinstance(ob, (set, frozenset)):
+            items = sorted([self.value(item) for item in ob])
+            return '%s([%s])' % (type(ob).__name__, ', '.join(items))
+        if isinstance(ob, dict):
+            return self.mapping([(key, self.value(value))
+                                 for key, value in ob.items()])
+        return self.reference(ob)
+
+    def mapping(self, items):
+        # items is a sequence of (key, source) pairs
+        if not items:
+            return '{}'
+        return '{\n%s,\n}' % ',\n'.join(
+            ['    %s: %s' % (self.value(key),
+                            source.replace('\n', '\n    '))
+             for key, source in items])
+
+    def assign(self, name, source):
+        self.lines.append('%s = %s' % (name, source))
+
+    def source(self, origin):
+        header = ['# Generated by repoze.workflow.codegen from %s.' % origin,
+                  '# Do not edit: regenerate it instead.']
+        return '\n'.join(header + [''] + self.import_lines + [''] +
+                         self.lines) + '\n'
+
+def _options(workflow):
+    if not isinstance(workflow, Workflow):
+        raise WorkflowError('Cannot generate code for %r: only Workflow '
+                            'objects are supported' % (workflow,))
+    options = [('state_attr', workflow.state_attr),
+               ('initial_state', workflow.initial_state),
+               ('name', workflow.name),
+               ('description', workflow.description)]
+    if workflow.permission_checker is not None:
+        options.append(('permission_checker', workflow.permission_checker))
+    store = workflow.state_store
+    if not (type(store) is AttributeStateStore
+            and store.state_attr == workflow.state_attr):
+        options.append(('state_store', store))
+    if workflow.deferred_queue is not None:
+        options.append(('deferred_queue', workflow.deferred_queue))
+    if workflow.guard_stats is not None:
+        options.append(('adaptive_guards', True))
+    if workflow.deterministic:
+        options.append(('deterministic', True))
+    return options
+
+def _write_workflow(module, name, workflow):
+    options = _options(workflow)
+    states = []
+    for state_name, data in workflow._state_data.items():
+        local = module._local('s')
+        module.assign(local, module.value(data))
+        states.append((state_name, local))
+    transitions = {}
+    for transition_name, data in workflow._transition_data.items():
+        local = module._local('t')
+        module.assign(local, module.value(data))
+        transitions[transition_name] = local
+    def transition_list(L):
+        return '[%s]' % ', '.join([transitions[t['name']] for t in L])
+    by_state = {}
+    for data in workflow._transition_data.values():
+        by_state.setdefault(data['from_state'], []).append(data)
+    module.assign(name, '%s(\n    %s,\n    %s)' % (
+        module.import_('repoze.workflow.codegen', 'build_workflow'),
+        module.mapping([(key, module.value(value))
+                        for key, value in options]).replace('\n', '\n    '),
+        module.mapping([
+            ('states', module.mapping(states)),
+            ('aliases', module.value(workflow._state_aliases)),
+            ('parents', module.value(workflow._state_parents)),
+            ('ancestors', module.value(workflow._ancestors)),
+            ('descendants', module.value(workflow._descendants)),
+            ('transitions', module.mapping(
+                [(transition_name, transitions[transition_name])
+                 for transition_name in workflow._transition_data])),
+            ('by_state', module.mapping(
+                [(state, transition_list(L))
+                 for state, L in by_state.items()])),
+            ('leaving', module.mapping(
+                [(state, transition_list(workflow._leaving(state)))
+                 for state in workflow._state_data])),
+            ]).replace('\n', '\n    ')))
+
+def generate(workflow, name='workflow'):
+    """ Return the source of a Python module which defines a workflow
+    equivalent to ``workflow`` under the name ``name``. """
+    module = _Module()
+    _write_workflow(module, name, workflow)
+    return module.source(pprint.saferepr(workflow.name or name))
+
+def zcml_workflows(filename, package=None):
+    """ Return a list of ``(type, content_type, elector, workflow)``
+    tuples for the workflows declared in the ZCML file ``filename``,
+    without registering them.  A workflow declared for several content
+    types appears once per content type.  Conflicts and overrides are
+    resolved as when the file is loaded. """
+    return _zcml_workflows(filename, package)[0]
+
+def _zcml_workflows(filename, package):
+    # return the list of zcml_workflows and the configuration machine
+    from zope.configuration import xmlconfig
+    from zope.configuration.config import ConfigurationMachine
+    from zope.configuration.config import resolveConflicts
+    context = ConfigurationMachine()
+    xmlconfig.registerCommonDirectives(context)
+    context.package = package
+    xmlconfig.file(filename, package, context=context, execute=False)
+    found = []
+    workflows = {}
+    # as when executing the actions: conflicting declarations raise a
+    # ConfigurationConflictError, overrides replace what they override
+    for action in resolveConflicts(context.actions):
+        # the actions of workflow directives refer to their directive
+        directive = getattr(action['callable'], 'directive', None)
+        if directive is not None:
+            workflow = workflows.get(id(directive))
+            if workflow is None:
+                workflow = directive.make_workflow()
+                workflows[id(directive)] = workflow
+            content_type, = action['args']
+            found.append((directive.type, content_type, directive.elector,
+                          workflow))
+    return found, context
+
+def generate_zcml(filename, package=None):
+    """ Return the source of a Python module which defines the
+    workflows declared in the ZCML file ``filename`` (a path relative
+    to ``package``, if supplied) as ``workflow0``, ``workflow1``, ...,
+    and a ``register()`` function which registers them as the ZCML file
+    would. """
+    module = _Module()
+    names = {}
+    registrations = []
+    for type, content_type, elector, workflow in zcml_workflows(filename,
+                                                                package):
+        name = names.get(id(workflow))
+        if name is None:
+            name = names[id(workflow)] = 'workflow%d' % len(names)
+            _write_workflow(module, name, workflow)
+        registrations.append('(%s, %s, %s, %s)' % (
+            module.value(type), module.value(content_type),
+            module.value(elector), name))
+    module.lines.append('registrations = [')
+    for registration in registrations:
+        module.lines.append('    %s,' % registration)
+    module.lines.extend([']', '', 'def register():',
+                         '    %s(registrations)' % module.import_(
+                             'repoze.workflow.codegen',
+                             'register_workflows')])
+    return module.source(pprint.saferepr(filename))
+
+def build_workflow(options, tables):
+    """ Return a workflow made from ``options`` (keyword arguments of
+    ``Workflow``) and ``tables`` (its state and transition tables, as
+    written by ``generate``).  Used by generated modules. """
+    workflow = Workflow(**options)
+    workflow._state_data = tables['states']
+    workflow._state_aliases = tables['aliases']
+    workflow._state_parents = tables['parents']
+    workflow._ancestors = tables['ancestors']
+    workflow._descendants = tables['descendants']
+    transitions = workflow._transition_data = tables['transitions']
+    workflow._index = (len(transitions), tables['by_state'],
+                       tables['leaving'])
+    return workflow
+
+def register_workflows(registrations):
+    """ Register workflows given as ``(type, content_type, elector,
+    workflow)`` tuples.  Used by generated modules. """
+    from repoze.workflow.zcml import register_workflow
+    for type, content_type, elector, workflow in registrations:
+        register_workflow(workflow, type, content_type, elector)
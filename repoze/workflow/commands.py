@@ -0,0 +1,307 @@
+""" A consumer of transition commands read from a local queue.
+
+A *command* asks for the transition named ``transition_name`` of the
+workflow of type ``workflow_type`` to be executed for the content
+object whose key is ``content_key``.  A ``CommandConsumer`` reads
+commands from a command queue in batches, loads the content objects of
+a batch with a single call to a bulk loader, and executes the
+commands of a batch which share a workflow and a transition together
+with a ``BulkTransitionRunner``.
+
+Command queues provide ``put(command, block=True, timeout=None)``,
+``get_batch(limit, timeout)``, which returns a list of ``(receipt,
+command)`` pairs, and ``ack(batch)``, which is called with such a list
+once its commands have been executed.  Queues are bounded: ``put``
+blocks while the queue is full, which pushes back on producers when
+consumers fall behind.
+"""
+import collections
+import threading
+import time
+
+try:
+    from queue import Empty
+    from queue import Full
+except ImportError: # pragma: no cover (Python 2)
+    from Queue import Empty
+    from Queue import Full
+
+from repoze.workflow import _sqlite
+from repoze.workflow.bulk import BulkTransitionRunner
+from repoze.workflow.workflow import Workflow
+from repoze.workflow.workflow import WorkflowError
+from repoze.workflow.workflow import get_workflows
+
+Command = collections.namedtuple(
+    'Command', 'content_key workflow_type transition_name')
+
+class MultiprocessingCommandQueue(object):
+    """ A command queue on top of a ``multiprocessing.Queue`` holding at
+    most ``maxsize`` commands (unbounded if ``maxsize`` is 0), which
+    may be shared with producer processes. """
+
+    def __init__(self, maxsize=0, queue=None):
+        if queue is None:
+            import multiprocessing
+            queue = multiprocessing.Queue(maxsize)
+        self.queue = queue
+
+    def put(self, command, block=True, timeout=None):
+        self.queue.put(tuple(command), block, timeout)
+
+    def get_batch(self, limit, timeout=None):
+        """ Wait up to ``timeout`` seconds for a first command, then
+        return it along with the commands immediately available, up to
+        ``limit`` commands in all. """
+        try:
+            items = [self.queue.get(True, timeout)]
+        except Empty:
+            return []
+        while len(items) < limit:
+            try:
+                items.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return [(None, Command(*item)) for item in items]
+
+    def ack(self, batch):
+        pass
+
+class SQLiteCommandQueue(object):
+    """ A command queue stored in a SQLite table of the database at
+    ``path`` (in WAL mode), holding at most ``maxsize`` commands
+    (unbounded if ``maxsize`` is None).
+
+    Commands returned by ``get_batch`` are leased for ``lease``
+    seconds: they are deleted by ``ack``, and returned again by
+    ``get_batch`` if they have not been acknowledged when the lease
+    expires (e.g. because their consumer died).  The threads using the
+    queue take turns on its connection.
+    """
+
+    poll_interval = 0.05
+
+    def __init__(self, path, table='workflow_commands', maxsize=None,
+                 lease=60, clock=time.time):
+        self.path = path
+        self.table = table
+        self.maxsize = maxsize
+        self.lease = lease
+        self.clock = clock
+        self._lock = threading.Lock() # serializes uses of the connection
+        self.connection = _sqlite.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS %s ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'content_key NOT NULL, '
+            'workflow_type TEXT NOT NULL, '
+            'transition_name TEXT NOT NULL, '
+            'lease_expires REAL)' % table)
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM %s' % self.table).fetchone()[0]
+
+    def put(self, command, block=True, timeout=None):
+        """ Add ``command`` to the queue.  If the queue is full, wait
+        (if ``block`` is true) up to ``timeout`` seconds for room,
+        then raise ``queue.Full``. """
+        if self.maxsize is not None:
+            deadline = None
+            if timeout is not None:
+                deadline = time.time() + timeout
+            while len(self) >= self.maxsize:
+                if not block or (deadline is not None
+                                 and time.time() >= deadline):
+                    raise Full
+                time.sleep(self.poll_interval)
+        with self._lock:
+            self.connection.execute(
+                'INSERT INTO %s (content_key, workflow_type, '
+                'transition_name) VALUES (?, ?, ?)' % self.table,
+                tuple(command))
+
+    def _claim(self, limit):
+        now = self.clock()
+        with self._lock:
+            rows = _sqlite.claim(
+                self.connection, self.table,
+                'content_key, workflow_type, transition_name',
+                'lease_expires IS NULL OR lease_expires <= ?', (now,), limit,
+                'lease_expires = ?', (now + self.lease,))
+        return [(row[0], Command(*row[1:])) for row in rows]
+
+    def get_batch(self, limit, timeout=None):
+        """ Lease and return up to ``limit`` commands, polling for up to
+        ``timeout`` seconds (indefinitely if ``timeout`` is None) until
+        at least one is available. """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            batch = self._claim(limit)
+            if batch or (deadline is not None and time.time() >= deadline):
+                return batch
+            time.sleep(self.poll_interval)
+
+    def ack(self, batch):
+        with self._lock:
+            self.connection.executemany(
+                'DELETE FROM %s WHERE id = ?' % self.table,
+                [(receipt,) for receipt, command in batch])
+
+class BatchMetrics(object):
+    """ Metrics about one batch of commands executed by a
+    ``CommandConsumer``.
+
+    ``commands`` is the number of commands in the batch, ``duplicates``
+    the number of commands dropped because they repeated the previous
+    command of the batch for the same content object, and ``groups``
+    the number of bulk runs (one per workflow and transition).
+    ``succeeded`` and ``failed`` are counts; ``failures`` is a list of
+    ``(command, exception)`` pairs.
+    ``load_time``, ``apply_time`` and ``total_time`` are durations in
+    seconds.
+    """
+
+    def __init__(self):
+        self.commands = 0
+        self.duplicates = 0
+        self.groups = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.failures = []
+        self.load_time = 0.0
+        self.apply_time = 0.0
+        self.total_time = 0.0
+
+class CommandConsumer(object):
+    """ Execute the commands read from ``queue`` in batches of up to
+    ``batch_size`` commands.
+
+    ``loader`` is a callable which takes a list of content keys and
+    returns a list of the corresponding content objects, in the same
+    order (None for a key with no content object).  ``request`` is
+    passed to guards and permission checks.  ``on_batch``, if
+    supplied, is called with the ``BatchMetrics`` of each batch.
+
+    Commands for the same content object are executed in queue order;
+    other commands of a batch are grouped by workflow and transition.
+    A command which repeats the previous command of the batch for the
+    same content object (e.g. a redelivery) is dropped; commands
+    repeated with other commands in between are all executed.  A batch
+    is acknowledged once all of its commands have been executed (or
+    have failed).
+    """
+
+    def __init__(self, queue, loader, request=None, batch_size=100,
+                 on_batch=None, clock=time.time):
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
+        self.queue = queue
+        self.loader = loader
+        self.request = request
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.clock = clock
+
+    def _rounds(self, commands, metrics):
+        # split the commands into rounds in which each content key
+        # appears at most once, preserving per-content order; drop
+        # immediate repeats of a command for the same content key
+        last = {}
+        depth = {}
+        rounds = []
+        for command in commands:
+            if last.get(command.content_key) == command:
+                metrics.duplicates += 1
+                continue
+            last[command.content_key] = command
+            level = depth.get(command.content_key, 0)
+            depth[command.content_key] = level + 1
+            if level == len(rounds):
+                rounds.append([])
+            rounds[level].append(command)
+        return rounds
+
+    def _apply(self, commands, contents, metrics):
+        groups = collections.OrderedDict()
+        for command in commands:
+            content = contents[command.content_key]
+            if content is None:
+                metrics.failures.append(
+                    (command, KeyError(command.content_key)))
+                continue
+            groups.setdefault(command[1:], []).append((command, content))
+        for (workflow_type, transition_name), items in groups.items():
+            targets = [content for command, content in items]
+            workflows = get_workflows(targets, workflow_type, targets)
+            by_workflow = collections.OrderedDict()
+            for item, workflow in zip(items, workflows):
+                if workflow is None:
+                    metrics.failures.append((item[0], WorkflowError(
+                        'No %r workflow for %r' % (workflow_type,
+                                                   item[0].content_key))))
+                    continue
+                by_workflow.setdefault(workflow, []).append(item)
+            for workflow, items in by_workflow.items():
+                metrics.groups += 1
+                self._run(workflow, transition_name, items, metrics)
+
+    def _run(self, workflow, transition_name, items, metrics):
+        if not isinstance(workflow, Workflow):
+            for command, content in items:
+                try:
+                    workflow.transition(content, self.request,
+                                        transition_name)
+                except Exception as e:
+                    metrics.failures.append((command, e))
+                else:
+                    metrics.succeeded += 1
+            return
+        runner = BulkTransitionRunner(workflow, max_workers=0)
+        result = runner.run([content for command, content in items],
+                            self.request, transition_name)
+        metrics.succeeded += len(result.succeeded)
+        commands = dict([(id(content), command)
+                         for command, content in items])
+        for content, error in result.failed:
+            metrics.failures.append((commands[id(content)], error))
+
+    def run_once(self, timeout=None):
+        """ Read one batch of commands, waiting up to ``timeout``
+        seconds for one, and execute it.  Return its ``BatchMetrics``,
+        or None if no command was available. """
+        batch = self.queue.get_batch(self.batch_size, timeout)
+        if not batch:
+            return None
+        clock = self.clock
+        started = clock()
+        metrics = BatchMetrics()
+        commands = [command for receipt, command in batch]
+        metrics.commands = len(commands)
+        keys = list(collections.OrderedDict.fromkeys(
+            [command.content_key for command in commands]))
+        contents = dict(zip(keys, self.loader(keys)))
+        loaded = clock()
+        metrics.load_time = loaded - started
+        for commands in self._rounds(commands, metrics):
+            self._apply(commands, contents, metrics)
+        self.queue.ack(batch)
+        finished = clock()
+        metrics.apply_time = finished - loaded
+        metrics.total_time = finished - started
+        metrics.failed = len(metrics.failures)
+        if self.on_batch is not None:
+            self.on_batch(metrics)
+        return metrics
+
+    def run(self, stop=None, timeout=0.5):
+        """ Execute batches until ``stop`` (an object with an
+        ``is_set`` method, such as a ``threading.Event``) is set,
+        waiting up to ``timeout`` seconds at a time for commands.  If
+        ``stop`` is None, return as soon as no command is available. """
+        while stop is None or not stop.is_set():
+            if self.run_once(timeout) is None and stop is None:
+                return
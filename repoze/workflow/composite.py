@@ -0,0 +1,152 @@
+""" Composite workflows: several workflows (*regions*) run in parallel
+on the same content object. """
+from collections import OrderedDict
+
+from zope.interface import implementer
+
+from repoze.workflow.interfaces import ICompositeWorkflow
+from repoze.workflow.storage import AttributeStateStore
+from repoze.workflow.workflow import WorkflowError
+
+@implementer(ICompositeWorkflow)
+class CompositeWorkflow(object):
+    """ Orthogonal regions over one content object.
+
+    ``regions`` is a sequence of ``(region_name, workflow)`` pairs (or
+    a mapping); each region is an independent workflow which must
+    store its state separately from the others (e.g. under a distinct
+    ``state_attr``).
+
+    ``guards`` are *joint* guards, checked for every transition of
+    every region as ``guard(context, region_name, transition,
+    states)``, where ``states`` maps each region name to the current
+    state of the content object in that region (its initial state if
+    the content object has none there yet; calling joint guards
+    initializes no region); a joint guard vetoes the transition by
+    raising ``WorkflowError``.  Like the guards passed to
+    ``transition``, joint guards are called after the guards of the
+    transition itself, and before the guards passed by the caller.
+    """
+
+    def __init__(self, regions, name='', description='', guards=()):
+        self.regions = OrderedDict(regions)
+        if not self.regions:
+            raise WorkflowError('A composite workflow needs a region')
+        state_attrs = {}
+        for region, workflow in self.regions.items():
+            store = getattr(workflow, 'state_store', None)
+            if isinstance(store, AttributeStateStore):
+                other = state_attrs.setdefault(store.state_attr, region)
+                if other != region:
+                    raise WorkflowError(
+                        'Regions %r and %r share the state attribute %r'
+                        % (other, region, store.state_attr))
+        self.name = name
+        self.description = description
+        self.guards = list(guards)
+
+    def __call__(self, context):
+        return self # allow ourselves to act as an adapter
+
+    def check(self):
+        for workflow in self.regions.values():
+            workflow.check()
+
+    def freeze(self):
+        """ Freeze the workflows of the regions which can be frozen (see
+        ``Workflow.freeze``). """
+        for workflow in self.regions.values():
+            freeze = getattr(workflow, 'freeze', None)
+            if freeze is not None:
+                freeze()
+
+    def _region(self, region):
+        try:
+            return self.regions[region]
+        except KeyError:
+            raise WorkflowError('No such region %r' % region)
+
+    def state_of(self, content, peek=False):
+        return OrderedDict([(region, workflow.state_of(content, peek))
+                            for region, workflow in self.regions.items()])
+
+    def has_state(self, content):
+        for workflow in self.regions.values():
+            if not workflow.has_state(content):
+                return False
+        return True
+
+    def initialize(self, content, request=None):
+        states = OrderedDict()
+        messages = OrderedDict()
+        for region, workflow in self.regions.items():
+            states[region], messages[region] = workflow.initialize(content,
+                                                                   request)
+        return states, messages
+
+    def state_info(self, content, request, context=None, peek=False,
+                   executor=None):
+        L = []
+        for region, workflow in self.regions.items():
+            for info in workflow.state_info(content, request, context,
+                                            peek=peek, executor=executor):
+                info['region'] = region
+                L.append(info)
+        return L
+
+    def get_transitions(self, content, request, context=None, peek=False,
+                        executor=None):
+        L = []
+        for region, workflow in self.regions.items():
+            for transition in workflow.get_transitions(
+                content, request, context, peek=peek, executor=executor):
+                transition = dict(transition)
+                transition['region'] = region
+                L.append(transition)
+        return L
+
+    def _find_region(self, transition_name):
+        found = [region for region, workflow in self.regions.items()
+                 if transition_name in getattr(workflow, '_transition_data',
+                                               ())]
+        if len(found) != 1:
+            raise WorkflowError(
+                'Cannot find a single region with a transition named %r; '
+                'pass a region name' % transition_name)
+        return found[0]
+
+    def _guards(self, content, region, guards):
+        if not self.guards:
+            return guards
+        joint_guards = self.guards
+        def joint(context, info):
+            # peek: evaluating a guard must not initialize other regions
+            states = self.state_of(content, peek=True)
+            for guard in joint_guards:
+                guard(context, region, info.transition, states)
+        guards = list(guards)
+        guards.insert(0, joint)
+        return guards
+
+    def transition(self, content, request, transition_name, context=None,
+                   guards=(), region=None, idempotency_key=None):
+        """ Execute the transition named ``transition_name`` of the
+        region named ``region``.  If ``region`` is None, the region is
+        the only one which has a transition of that name. """
+        if region is None:
+            region = self._find_region(transition_name)
+        workflow = self._region(region)
+        guards = self._guards(content, region, guards)
+        workflow.transition(content, request, transition_name, context,
+                            guards, idempotency_key=idempotency_key)
+
+    def transition_to_state(self, content, request, to_state, region,
+                            context=None, guards=(), skip_same=True,
+                            idempotency_key=None):
+        """ Execute a transition to the state ``to_state`` of the region
+        named ``region``. """
+        workflow = self._region(region)
+        guards = self._guards(content, region, guards)
+        workflow.transition_to_state(content, request, to_state, context,
+                                     guards, skip_same,
+                                     idempotency_key=idempotency_key)
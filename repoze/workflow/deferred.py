@@ -0,0 +1,105 @@
+""" Deferred execution of workflow callbacks. """
+import collections
+import threading
+
+class DeferredCallbackQueue(object):
+    """ A queue of callbacks which a workflow defers until the caller
+    has committed its work.
+
+    A workflow whose ``deferred_queue`` is set calls ``put`` with each
+    deferred callback, and the content object and ``info`` object it
+    would have been called with, instead of calling the callback.
+    Queued callbacks are *pending* until the thread which queued them
+    calls ``commit`` (after committing its own transaction); ``abort``
+    discards them instead.  Committed callbacks are run either by a
+    call to ``drain`` or by a background worker thread started with
+    ``start``.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._ready = collections.deque()
+        self._condition = threading.Condition()
+        self._worker = None
+        self._stopping = False
+        self.failures = []
+
+    def _pending(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = []
+        return pending
+
+    def put(self, callback, content, info):
+        """ Queue ``callback(content, info)`` as pending in the current
+        thread. """
+        self._pending().append((callback, content, info))
+
+    def pending(self):
+        """ Return the number of callbacks pending in the current
+        thread. """
+        return len(self._pending())
+
+    def commit(self):
+        """ Make the callbacks pending in the current thread ready to
+        run. """
+        pending = self._pending()
+        self._local.pending = []
+        with self._condition:
+            self._ready.extend(pending)
+            self._condition.notify()
+
+    def abort(self):
+        """ Discard the callbacks pending in the current thread. """
+        self._local.pending = []
+
+    def drain(self):
+        """ Run the callbacks which are ready, in the order in which
+        they were queued, in the current thread.  Return a list of
+        ``(callback, content, exception)`` tuples for the callbacks
+        which raised an exception; these are also appended to
+        ``failures``. """
+        failures = []
+        while True:
+            try:
+                callback, content, info = self._ready.popleft()
+            except IndexError:
+                break
+            try:
+                callback(content, info)
+            except Exception as e:
+                failures.append((callback, content, e))
+        self.failures.extend(failures)
+        return failures
+
+    def start(self):
+        """ Start a daemon thread which runs callbacks as soon as they
+        are committed. """
+        with self._condition:
+            if self._worker is not None:
+                return
+            self._stopping = False
+            self._worker = threading.Thread(target=self._work)
+            self._worker.daemon = True
+            self._worker.start()
+
+    def stop(self, timeout=None):
+        """ Stop the worker thread started by ``start`` once it has run
+        the callbacks which are ready. """
+        with self._condition:
+            worker = self._worker
+            if worker is None:
+                return
+            self._stopping = True
+            self._condition.notify()
+        worker.join(timeout)
+        self._worker = None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._ready and not self._stopping:
+                    self._condition.wait()
+                if not self._ready and self._stopping:
+                    return
+            self.drain()
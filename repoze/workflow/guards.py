@@ -0,0 +1,280 @@
+""" Declarative guard expressions.
+
+A guard expression is a Python expression restricted to comparisons,
+boolean operators, attribute and item access, and literals, over the
+names ``context``, ``request``, ``transition`` and ``workflow`` (the
+transition dictionary and the workflow of the transition underway),
+e.g.::
+
+  context.locked == False and request.user in context.editors
+
+An expression is compiled once into a guard callable.  Its top-level
+``and`` operands (its *conditions*) are compiled separately and
+interned, so a condition written in the guards of several transitions
+is a single object (the ``CONDITIONS`` most recently compiled ones are
+kept); while the guards of the candidates tried by
+``transition_to_state`` are checked, the value of a condition which
+does not depend on the transition is computed once per context and
+request.
+"""
+import ast
+import threading
+import time
+from contextlib import contextmanager
+
+from repoze.workflow.workflow import WorkflowError
+from repoze.workflow._lru import LRUCache
+from repoze.workflow._compat import text_type
+
+NAMES = ('context', 'request', 'transition', 'workflow')
+CONDITIONS = 4096 # the number of interned conditions
+
+_ALLOWED = tuple(filter(None, [
+    getattr(ast, name, None) for name in (
+        'Expression', 'BoolOp', 'And', 'Or', 'UnaryOp', 'Not', 'USub',
+        'Compare', 'Eq', 'NotEq', 'Lt', 'LtE', 'Gt', 'GtE', 'In', 'NotIn',
+        'Is', 'IsNot', 'Name', 'Load', 'Attribute', 'Subscript', 'Index',
+        'Constant', 'Str', 'Num', 'NameConstant', 'Tuple', 'List')]))
+
+_LITERAL_NAMES = ('True', 'False', 'None') # Python 2
+
+_marker = object()
+_conditions = LRUCache(CONDITIONS)
+_local = threading.local()
+
+def _validate(tree, expression):
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED):
+            raise WorkflowError('Unsupported syntax %s in guard %r'
+                                % (node.__class__.__name__, expression))
+        if isinstance(node, ast.Name):
+            if node.id not in NAMES and node.id not in _LITERAL_NAMES:
+                raise WorkflowError('Unknown name %r in guard %r'
+                                    % (node.id, expression))
+        elif isinstance(node, ast.Attribute) and node.attr.startswith('_'):
+            raise WorkflowError('Private attribute %r in guard %r'
+                                % (node.attr, expression))
+
+class Condition(object):
+    """ One compiled condition of a guard expression. """
+
+    def __init__(self, node):
+        self.uses_transition = False
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and child.id == 'transition':
+                self.uses_transition = True
+        template = ast.parse('lambda %s: None' % ', '.join(NAMES),
+                             mode='eval')
+        template.body.body = node
+        ast.fix_missing_locations(template)
+        code = compile(template, '<guard>', 'eval')
+        self.function = eval(code, {'__builtins__': {}})
+
+    def __call__(self, context, info):
+        request = info.request
+        memo = getattr(_local, 'memo', None)
+        if memo is None or self.uses_transition:
+            return self.function(context, request, info.transition,
+                                 info.workflow)
+        key = (self, id(context), id(request))
+        value = memo.get(key, _marker)
+        if value is _marker:
+            value = memo[key] = self.function(context, request,
+                                              info.transition, info.workflow)
+        return value
+
+def _intern(node):
+    # a condition dropped from the table still works for its guards;
+    # it is merely no longer shared with the ones compiled afterwards
+    key = ast.dump(node)
+    condition = _conditions.get(key)
+    if condition is None:
+        condition = Condition(node)
+        _conditions.set(key, condition)
+    return condition
+
+class ExpressionGuard(object):
+    """ A guard which vetoes a transition (by raising ``WorkflowError``)
+    unless its expression is true. """
+
+    order_independent = True
+
+    def __init__(self, expression):
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise WorkflowError('Invalid guard %r: %s' % (expression, e))
+        _validate(tree, expression)
+        body = tree.body
+        if isinstance(body, ast.BoolOp) and isinstance(body.op, ast.And):
+            nodes = body.values
+        else:
+            nodes = [body]
+        self.expression = expression
+        self.conditions = tuple([_intern(node) for node in nodes])
+
+    def __call__(self, context, info):
+        for condition in self.conditions:
+            if not condition(context, info):
+                raise WorkflowError('Guard %r vetoed transition %r' % (
+                    self.expression, info.transition.get('name')))
+
+    def __reduce__(self):
+        # compiled conditions cannot be pickled: compile them again
+        return (ExpressionGuard, (self.expression,))
+
+    def __repr__(self):
+        return '<ExpressionGuard %r>' % self.expression
+
+def compile_guard(guard):
+    """ Return ``guard`` compiled into an ``ExpressionGuard`` if it is a
+    string, otherwise return it unchanged. """
+    if isinstance(guard, (str, text_type)):
+        return ExpressionGuard(guard)
+    return guard
+
+@contextmanager
+def shared_conditions(memo=None):
+    """ Within this context manager, the value of a condition which
+    does not depend on the transition is computed once per context and
+    request in the current thread.  The values are kept in the
+    dictionary ``memo`` if it is given, so that several scopes may
+    share them, otherwise in the enclosing scope if any. """
+    outer = getattr(_local, 'memo', None)
+    if memo is None:
+        memo = {} if outer is None else outer
+    _local.memo = memo
+    try:
+        yield
+    finally:
+        _local.memo = outer
+
+def order_independent(guard):
+    """ Mark ``guard`` as independent of the order in which guards are
+    called (it neither depends on nor affects other guards), so that a
+    workflow with adaptive guard ordering may reorder it; return the
+    marked guard, a wrapper which leaves ``guard`` itself unchanged (it
+    may be used unmarked elsewhere).  Guard expressions are always
+    order-independent. """
+    if isinstance(guard, _OrderIndependent):
+        return guard
+    return _OrderIndependent(guard)
+
+class _OrderIndependent(object):
+    order_independent = True
+
+    def __init__(self, guard):
+        self.guard = guard
+
+    def __call__(self, context, info):
+        return self.guard(context, info)
+
+    def __repr__(self):
+        return '<order independent %r>' % (self.guard,)
+
+def _score(entry):
+    # the expected cost of finding a veto: the mean time over the
+    # (smoothed) veto probability; unobserved guards go first
+    calls, vetoes, elapsed = entry
+    if not calls:
+        return 0.0
+    return (elapsed / calls) / ((vetoes + 1.0) / (calls + 2.0))
+
+class GuardStats(object):
+    """ Observed cost and veto rate of the order-independent guards of a
+    workflow, used to call them cheapest-to-veto first.
+
+    Guards not marked order-independent are called after the
+    order-independent ones, in their original order.  Statistics are
+    kept for the ``maxsize`` most recently used guards.
+    """
+
+    def __init__(self, maxsize=1024, clock=None):
+        if clock is None:
+            clock = getattr(time, 'perf_counter', time.time)
+        self.clock = clock
+        self._stats = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self._frozen = None # guard -> score, see freeze
+
+    def _entry(self, guard):
+        entry = self._stats.get(guard)
+        if entry is None:
+            entry = [0, 0, 0.0] # calls, vetoes, total time
+            self._stats.set(guard, entry)
+        return entry
+
+    def _score(self, guard):
+        return _score(self._entry(guard))
+
+    def _call(self, guard, context, info):
+        clock = self.clock
+        started = clock()
+        vetoed = False
+        try:
+            guard(context, info)
+        except WorkflowError:
+            vetoed = True
+            raise
+        finally:
+            elapsed = clock() - started
+            with self._lock:
+                entry = self._entry(guard)
+                entry[0] += 1
+                entry[1] += vetoed
+                entry[2] += elapsed
+
+    def run(self, guards, context, info):
+        """ Call ``guards`` with ``context`` and ``info``. """
+        independent = []
+        dependent = []
+        for guard in guards:
+            if getattr(guard, 'order_independent', False):
+                independent.append(guard)
+            else:
+                dependent.append(guard)
+        frozen = self._frozen
+        if frozen is not None:
+            if len(independent) > 1:
+                independent.sort(key=lambda guard: frozen.get(guard, 0.0))
+            for guard in independent + dependent:
+                guard(context, info)
+            return
+        if len(independent) > 1:
+            independent.sort(key=self._score)
+        for guard in independent:
+            self._call(guard, context, info)
+        for guard in dependent:
+            guard(context, info)
+
+    def freeze(self):
+        """ Stop observing guards: from now on, order-independent guards
+        are called untimed, in the order of their current scores, and
+        the statistics no longer change. """
+        self._frozen = dict([(guard, _score(entry))
+                             for guard, entry in self._stats.items()])
+
+    def stats(self):
+        """ Return a list of dictionaries describing the guards observed
+        so far, in the order in which they would now be called. """
+        L = []
+        for guard, entry in self._stats.items():
+            calls, vetoes, elapsed = entry
+            if calls:
+                veto_rate = float(vetoes) / calls
+                mean_time = elapsed / calls
+            else:
+                veto_rate = mean_time = 0.0
+            L.append({'guard': guard,
+                      'calls': calls,
+                      'vetoes': vetoes,
+                      'veto_rate': veto_rate,
+                      'mean_time': mean_time,
+                      'score': _score(entry),
+                     })
+        L.sort(key=lambda item: item['score'])
+        return L
+
+    def reset(self):
+        """ Forget all the statistics. """
+        self._stats.clear()
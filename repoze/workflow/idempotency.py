@@ -0,0 +1,117 @@
+""" Idempotency keys for workflow transitions.
+
+Transitions delivered by an at-least-once message queue may arrive
+more than once.  A workflow remembers the idempotency keys of the
+transitions it has executed in an ``IdempotencyCache``, so that a
+duplicate is detected and skipped before any guard or callback runs.
+A key is recorded once its transition has written the new state; a
+duplicate arriving while the transition is still under way raises
+``TransitionInProgress``, so that it is delivered again later rather
+than acknowledged as done.
+"""
+import sqlite3
+import threading
+import time
+
+from repoze.workflow._lru import LRUCache
+from repoze.workflow.workflow import TransitionInProgress
+
+class IdempotencyCache(object):
+    """ The idempotency keys seen by a workflow.
+
+    At most ``maxsize`` keys are kept in memory; if ``ttl`` is not
+    None, keys are forgotten after ``ttl`` seconds.  ``backend``, if
+    supplied, is a persistent key store (such as a
+    ``SQLiteIdempotencyBackend``) consulted for keys which are not in
+    memory, so that duplicates are also detected after the in-memory
+    keys have been evicted, or by other processes.  Keys are written to
+    the backend when their transition is done, so a transition under
+    way in another process is not detected.
+    """
+
+    def __init__(self, maxsize=10000, ttl=None, backend=None,
+                 clock=time.time):
+        self.cache = LRUCache(maxsize, ttl, clock)
+        self.backend = backend
+        self.duplicates = 0
+        self._pending = set() # keys of transitions under way
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        if key in self.cache:
+            return True
+        return self.backend is not None and key in self.backend
+
+    def claim(self, key):
+        """ Claim ``key`` for a transition about to be executed and
+        return True, or return False if the transition of ``key`` is
+        done.  Raise ``TransitionInProgress`` if ``key`` is claimed by a
+        transition under way.  A claimed key must be passed to ``done``
+        or ``release``. """
+        with self._lock:
+            if key in self._pending:
+                raise TransitionInProgress(
+                    'A transition with idempotency key %r is under way'
+                    % (key,))
+            if key in self.cache:
+                self.duplicates += 1
+                return False
+            if self.backend is not None and key in self.backend:
+                self.cache.set(key, True)
+                self.duplicates += 1
+                return False
+            self._pending.add(key)
+            return True
+
+    def done(self, key):
+        """ Record that the transition which claimed ``key`` is done. """
+        with self._lock:
+            self._pending.discard(key)
+            self.cache.set(key, True)
+            if self.backend is not None:
+                self.backend.add(key)
+
+    def release(self, key):
+        """ Forget ``key``, claimed by a transition which failed, so
+        that it may be retried. """
+        with self._lock:
+            self._pending.discard(key)
+
+class SQLiteIdempotencyBackend(object):
+    """ Keep idempotency keys in a SQLite table.
+
+    ``connection`` is either a ``sqlite3`` connection or a database
+    path.  Each write is committed immediately.  The threads using the
+    backend take turns on the connection.
+    """
+
+    def __init__(self, connection, table='workflow_idempotency'):
+        if not isinstance(connection, sqlite3.Connection):
+            connection = sqlite3.connect(connection, check_same_thread=False)
+        self.connection = connection
+        self.table = table
+        self._lock = threading.Lock() # serializes uses of the connection
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS %s (key PRIMARY KEY)' % table)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self.connection.execute(
+                'SELECT 1 FROM %s WHERE key = ?' % self.table,
+                (key,)).fetchone() is not None
+
+    def add(self, key):
+        """ Record ``key``; return False if it was already recorded. """
+        with self._lock:
+            with self.connection:
+                cursor = self.connection.execute(
+                    'INSERT OR IGNORE INTO %s (key) VALUES (?)' % self.table,
+                    (key,))
+            return cursor.rowcount == 1
+
+    def discard(self, key):
+        with self._lock:
+            with self.connection:
+                self.connection.execute(
+                    'DELETE FROM %s WHERE key = ?' % self.table, (key,))
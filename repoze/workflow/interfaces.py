@@ -19,16 +19,41 @@ class IWorkflow(Interface):
         """ Check the consistency of the workflow state machine. Raise
         an error if it's inconsistent."""
 
-    def state_of(content):
+    def state_of(content, peek=False):
         """ Return the current state of the content object ``content``
         or None if the content object has not particpated yet in this
-        workflow.  """
+        workflow.  If ``peek`` is true, a content object which has no
+        state is reported to be in the initial state without being
+        initialized: no callback is called and nothing is written."""
 
     def has_state(content):
         """ Return true if the content has any state, false if not. """
 
-    def state_info(content, request, context=None, from_state=None):
-        """ Return a sequence of state info dictionaries """
+    def in_state(content, state_name, peek=False):
+        """ Return true if the current state of ``content`` is the
+        state named ``state_name`` or one of its sub-states.  ``peek``
+        is handled as by ``state_of``."""
+
+    def states_of(contents, request=None, initialize=True):
+        """ Return a list of the current states of each of the content
+        objects in ``contents``, in the same order, reading the states
+        in one batch.  If ``initialize`` is true, content objects which
+        have no state are initialized into the initial state (see
+        ``initialize``); otherwise their state is reported as None and
+        they are left untouched."""
+
+    def group_by_state(contents, request=None, initialize=True):
+        """ Return a dictionary mapping each state name to the list of
+        the content objects in ``contents`` which are in that state
+        (see ``states_of``)."""
+
+    def state_info(content, request, context=None, from_state=None,
+                   peek=False, executor=None):
+        """ Return a sequence of state info dictionaries.  If ``peek``
+        is true, ``content`` is never initialized (see ``state_of``).
+        If ``executor`` (a ``concurrent.futures`` executor) is
+        supplied, the permissions of the transitions are checked
+        concurrently on it."""
 
     def initialize(content, request=None):
         """ Initialize the content object to the initial state of this
@@ -41,17 +66,106 @@ class IWorkflow(Interface):
         for this workflow (see ``initialize``). Return a tuple of
         (state, msg)"""
 
-    def transition(content, request, transition_name, context=None, guards=()):
-        """ Execute a transition using a transition name.
+    def transition(content, request, transition_name, context=None, guards=(),
+                   idempotency_key=None):
+        """ Execute a transition using a transition name.  If
+        ``idempotency_key`` is not None and a transition (or transition
+        to state) with the same key has already been executed by this
+        workflow, do nothing: neither guards nor callbacks are run.
+        If a transition with the same key is still under way, raise
+        ``TransitionInProgress`` (a ``WorkflowError``).
         """
     def transition_to_state(content, request, to_state, context=None,
-                            guards=(), skip_same=True):
+                            guards=(), skip_same=True, idempotency_key=None):
         """ Execute a transition to another state using a state name
         (``to_state``).  If ``skip_same`` is True, and the
-        ``to_state`` is the same as the content state, do nothing."""
+        ``to_state`` is the same as the content state, do nothing.
+        ``idempotency_key`` is handled as by ``transition``."""
+
+    def get_transitions(content, request, context=None, from_state=None,
+                        peek=False, executor=None):
+        """ Return a sequence of transition dictionaries.  If ``peek``
+        is true, ``content`` is never initialized (see ``state_of``).
+        If ``executor`` (a ``concurrent.futures`` executor) is
+        supplied, the permissions of the transitions are checked
+        concurrently on it."""
+
+class ICompositeWorkflow(Interface):
+    """ Several workflows (*regions*) run in parallel on the same
+    content object.  States are reported as mappings of region names to
+    states, and transitions and state information dictionaries carry
+    the name of their region under the ``region`` key."""
+
+    def check():
+        """ Check the consistency of each region."""
+
+    def state_of(content, peek=False):
+        """ Return a mapping of each region name to the current state of
+        ``content`` in that region (see ``IWorkflow.state_of``)."""
 
-    def get_transitions(content, request, context=None, from_state=None):
-        """ Return a sequence of transition dictionaries """
+    def has_state(content):
+        """ Return true if the content has a state in every region."""
+
+    def initialize(content, request=None):
+        """ Initialize the content in every region; return a tuple of
+        two mappings of region names to states and to callback
+        messages."""
+
+    def state_info(content, request, context=None, peek=False,
+                   executor=None):
+        """ Return the state information dictionaries of every region
+        (see ``IWorkflow.state_info``)."""
+
+    def get_transitions(content, request, context=None, peek=False,
+                        executor=None):
+        """ Return the transition dictionaries permitted in every region
+        (see ``IWorkflow.get_transitions``)."""
+
+    def transition(content, request, transition_name, context=None,
+                   guards=(), region=None, idempotency_key=None):
+        """ Execute a transition of a region using a transition name.
+        If ``region`` is None, the transition name must be unique
+        amongst all regions."""
+
+    def transition_to_state(content, request, to_state, region,
+                            context=None, guards=(), skip_same=True,
+                            idempotency_key=None):
+        """ Execute a transition to another state of a region."""
+
+class IStateStore(Interface):
+    """ An object which reads and writes the workflow state of content
+    objects on behalf of a workflow. """
+
+    def get(content):
+        """ Return the raw state stored for ``content`` or None if it
+        has no state. """
+
+    def set(content, state):
+        """ Store ``state`` as the state of ``content``. """
+
+    def get_many(contents):
+        """ Return a list of the raw states stored for each of the
+        ``contents`` (None for content with no state), in the same
+        order as ``contents``. """
+
+    def set_many(items):
+        """ Store the states in ``items``, a sequence of ``(content,
+        state)`` pairs. """
+
+class IBatchPermissionChecker(Interface):
+    """ A permission checker which can check several permissions in
+    one call.  Workflows use ``allowed`` in preference to calling the
+    checker once per transition when their ``permission_checker``
+    provides this interface. """
+
+    def __call__(permission, context, request):
+        """ Return true if ``permission`` is allowed for ``request`` in
+        ``context``. """
+
+    def allowed(permissions, context, request):
+        """ Return the subset of the set of permission names
+        ``permissions`` which are allowed for ``request`` in
+        ``context``. """
 
 class IWorkflowList(Interface):
     """ Marker interface used internally by get_workflow and the ZCML
@@ -0,0 +1,290 @@
+""" A durable outbox for deferred workflow callbacks.
+
+An ``SQLiteOutbox`` can be used as the ``deferred_queue`` of a
+workflow: instead of keeping deferred callbacks in memory, it records a
+*job* for each of them in a SQLite database (in WAL mode).  A job is
+written as soon as it is queued, before the workflow writes the new
+state, but *staged*: like a ``DeferredCallbackQueue``, the outbox
+keeps the jobs of each thread from running until the thread calls
+``commit`` (once its own transaction has committed) and deletes them
+on ``abort``.  Jobs left staged by a thread which died in between are
+committed by ``recover``.  A job records the workflow
+name, the transition name, the content key and the dotted name of the
+callback.  Jobs are run by ``OutboxConsumer`` objects, possibly in
+several processes, which claim jobs in batches under a lease and retry
+failed jobs.
+"""
+import collections
+import os
+import threading
+import time
+import traceback
+import uuid
+
+from repoze.workflow import _sqlite
+from repoze.workflow._dotted import dotted_name
+from repoze.workflow._dotted import resolve
+from repoze.workflow.storage import _identity
+from repoze.workflow.workflow import CallbackInfo
+
+Job = collections.namedtuple(
+    'Job', 'id workflow transition content_key callback attempts')
+
+class SQLiteOutbox(object):
+    """ Jobs stored in the SQLite database at ``path``.
+
+    ``key`` is a callable which returns the key (a string or an
+    integer) of a content object, used by consumers to load it again;
+    by default the content object itself is used as the key.  The
+    threads using the outbox take turns on its connection.
+    """
+
+    def __init__(self, path, key=None, table='workflow_outbox',
+                 clock=time.time):
+        if key is None:
+            key = _identity
+        self.path = path
+        self.key = key
+        self.table = table
+        self.clock = clock
+        self._local = threading.local()
+        self._names = {} # callback -> dotted name
+        self._lock = threading.Lock() # serializes uses of the connection
+        self.connection = _sqlite.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS %s ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'workflow TEXT, '
+            'transition TEXT, '
+            'content_key NOT NULL, '
+            'callback TEXT NOT NULL, '
+            'attempts INTEGER NOT NULL DEFAULT 0, '
+            'available_at REAL NOT NULL, '
+            'lease_owner TEXT, '
+            'lease_expires REAL, '
+            'dead INTEGER NOT NULL DEFAULT 0, '
+            'error TEXT, '
+            'staged TEXT)' % table)
+
+    def validate(self, callback):
+        """ Return the dotted name of ``callback``, or raise
+        ``ValueError`` if it can't be imported back by that name.  A
+        workflow calls this before it writes the new state of a
+        transition whose callback is deferred. """
+        name = self._names.get(callback)
+        if name is None:
+            name = self._names[callback] = dotted_name(callback)
+        return name
+
+    def _stage(self):
+        # the stage of the current thread: the jobs it has staged since
+        # it last called ``commit`` or ``abort``
+        stage = getattr(self._local, 'stage', None)
+        if stage is None:
+            stage = self._local.stage = [
+                '%s-%s' % (os.getpid(), uuid.uuid4().hex), 0]
+        return stage
+
+    def put(self, callback, content, info):
+        """ Write a job for ``callback(content, info)``, staged by the
+        current thread.  ``callback`` must be importable by its dotted
+        name. """
+        workflow = getattr(info, 'workflow', None)
+        transition = getattr(info, 'transition', None) or {}
+        job = (getattr(workflow, 'name', None), transition.get('name'),
+               self.key(content), self.validate(callback))
+        stage = self._stage()
+        with self._lock:
+            self.connection.execute(
+                'INSERT INTO %s (workflow, transition, content_key, '
+                'callback, available_at, staged) VALUES (?, ?, ?, ?, ?, ?)'
+                % self.table, job + (self.clock(), stage[0]))
+        stage[1] += 1
+
+    def pending(self):
+        """ Return the number of jobs staged by the current thread. """
+        stage = getattr(self._local, 'stage', None)
+        if stage is None:
+            return 0
+        return stage[1]
+
+    def commit(self):
+        """ Make the jobs staged by the current thread available to
+        consumers. """
+        stage = getattr(self._local, 'stage', None)
+        if stage is None:
+            return
+        with self._lock:
+            self.connection.execute(
+                'UPDATE %s SET staged = NULL, available_at = ? '
+                'WHERE staged = ?' % self.table, (self.clock(), stage[0]))
+        self._local.stage = None
+
+    def abort(self):
+        """ Delete the jobs staged by the current thread. """
+        stage = getattr(self._local, 'stage', None)
+        if stage is None:
+            return
+        with self._lock:
+            self.connection.execute(
+                'DELETE FROM %s WHERE staged = ?' % self.table, (stage[0],))
+        self._local.stage = None
+
+    def recover(self, older_than):
+        """ Commit the jobs staged more than ``older_than`` seconds ago
+        (by threads which died before calling ``commit`` or ``abort``)
+        and return their number.  ``older_than`` should exceed the
+        duration of the longest transaction. """
+        now = self.clock()
+        with self._lock:
+            return self.connection.execute(
+                'UPDATE %s SET staged = NULL, available_at = ? '
+                'WHERE staged IS NOT NULL AND available_at <= ?'
+                % self.table, (now, now - older_than)).rowcount
+
+    def __len__(self):
+        """ Return the number of committed jobs which are not dead. """
+        with self._lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM %s WHERE dead = 0 AND staged IS NULL'
+                % self.table).fetchone()[0]
+
+    def claim(self, owner, limit, lease):
+        """ Claim up to ``limit`` available jobs for ``owner`` for
+        ``lease`` seconds, and return them as a list of ``Job``
+        tuples.  A job is available if it is not dead, is not due for
+        a later retry, is not staged and is not leased (or its lease
+        has expired). """
+        now = self.clock()
+        with self._lock:
+            rows = _sqlite.claim(
+                self.connection, self.table,
+                'workflow, transition, content_key, callback, attempts',
+                'dead = 0 AND staged IS NULL AND available_at <= ? '
+                'AND (lease_expires IS NULL OR lease_expires <= ?)',
+                (now, now), limit,
+                'lease_owner = ?, lease_expires = ?, attempts = attempts + 1',
+                (owner, now + lease))
+        return [Job(row[0], row[1], row[2], row[3], row[4], row[5] + 1)
+                for row in rows]
+
+    def complete(self, owner, job_ids):
+        """ Remove the jobs ``job_ids`` leased by ``owner``. """
+        with_lease = [(job_id, owner) for job_id in job_ids]
+        with self._lock:
+            self.connection.executemany(
+                'DELETE FROM %s WHERE id = ? AND lease_owner = ?'
+                % self.table, with_lease)
+
+    def fail(self, owner, job, error, retry_delay, max_attempts):
+        """ Record that ``job`` failed with ``error`` (a string).  The
+        job is retried after ``retry_delay`` seconds, unless it has
+        been attempted ``max_attempts`` times already, in which case it
+        is marked dead. """
+        dead = int(job.attempts >= max_attempts)
+        available_at = self.clock() + retry_delay
+        with self._lock:
+            self.connection.execute(
+                'UPDATE %s SET lease_owner = NULL, lease_expires = NULL, '
+                'available_at = ?, dead = ?, error = ? '
+                'WHERE id = ? AND lease_owner = ?' % self.table,
+                (available_at, dead, error, job.id, owner))
+
+    def dead_jobs(self):
+        """ Return a list of ``(job, error)`` pairs for the dead jobs. """
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT id, workflow, transition, content_key, callback, '
+                'attempts, error FROM %s WHERE dead = 1 ORDER BY id'
+                % self.table).fetchall()
+        return [(Job(*row[:6]), row[6]) for row in rows]
+
+class OutboxConsumer(object):
+    """ Run the jobs of the outbox stored in the SQLite database at
+    ``path``.
+
+    ``loader`` is a callable which returns the content object for a
+    content key.  ``workflows``, if supplied, is a mapping of workflow
+    names to workflows; it is used to supply the ``workflow`` and
+    ``transition`` of the ``info`` object passed to callbacks (which
+    are otherwise None and ``{'name': transition_name}``).  The
+    ``request`` of the ``info`` object is always None.
+
+    Jobs are claimed ``batch_size`` at a time under a lease of
+    ``lease`` seconds; a job whose consumer died is claimed again when
+    its lease expires.  A failed job is retried after ``retry_delay``
+    seconds, up to ``max_attempts`` attempts in all.
+    """
+
+    def __init__(self, path, loader, workflows=None, batch_size=100,
+                 lease=60, max_attempts=5, retry_delay=30, owner=None,
+                 clock=time.time):
+        if workflows is None:
+            workflows = {}
+        if owner is None:
+            owner = '%s-%s' % (os.getpid(), uuid.uuid4().hex)
+        self.outbox = SQLiteOutbox(path, clock=clock)
+        self.loader = loader
+        self.workflows = workflows
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.owner = owner
+
+    def _info(self, job):
+        workflow = self.workflows.get(job.workflow)
+        transition = None
+        if workflow is not None:
+            transition = workflow._transition_data.get(job.transition)
+        if transition is None:
+            transition = {'name': job.transition}
+        return CallbackInfo(workflow, transition)
+
+    def run_once(self):
+        """ Claim one batch of jobs and run them.  Return the number
+        of jobs claimed. """
+        jobs = self.outbox.claim(self.owner, self.batch_size, self.lease)
+        done = []
+        for job in jobs:
+            try:
+                callback = resolve(job.callback)
+                content = self.loader(job.content_key)
+                callback(content, self._info(job))
+            except Exception:
+                self.outbox.fail(self.owner, job, traceback.format_exc(),
+                                 self.retry_delay, self.max_attempts)
+            else:
+                done.append(job.id)
+        self.outbox.complete(self.owner, done)
+        return len(jobs)
+
+    def run(self, stop=None, idle=0.5):
+        """ Run jobs until ``stop`` (an object with an ``is_set``
+        method, such as a ``threading.Event``) is set, sleeping
+        ``idle`` seconds whenever no job is available.  If ``stop`` is
+        None, return as soon as no job is available. """
+        while stop is None or not stop.is_set():
+            if not self.run_once():
+                if stop is None:
+                    return
+                time.sleep(idle)
+
+def _consume(factory, stop):
+    factory().run(stop)
+
+def run_consumers(factory, processes, stop=None):
+    """ Run ``processes`` consumer processes, each running the
+    ``OutboxConsumer`` returned by calling ``factory`` (a picklable
+    callable, e.g. a module-level function) until ``stop`` (a
+    ``multiprocessing.Event``) is set or, if ``stop`` is None, until no
+    job is available.  Wait for the processes to exit and return their
+    exit codes. """
+    import multiprocessing
+    workers = [multiprocessing.Process(target=_consume, args=(factory, stop))
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return [worker.exitcode for worker in workers]
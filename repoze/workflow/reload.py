@@ -0,0 +1,179 @@
+""" Hot reloading of the workflows declared in a ZCML file. """
+import os
+import threading
+
+from zope.component import getSiteManager
+from zope.interface import providedBy
+from zope.interface.interfaces import IInterface
+
+from repoze.workflow.interfaces import IDefaultWorkflow
+from repoze.workflow.interfaces import IWorkflowList
+from repoze.workflow.workflow import Workflow
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def _inherit(workflow, old):
+    # let ``workflow`` share the idempotency cache (unless it has its
+    # own) and the transition statistics of the workflow it replaces
+    if isinstance(workflow, Workflow) and isinstance(old, Workflow):
+        if workflow.idempotency_cache is None:
+            workflow.idempotency_cache = old._idempotency()
+        workflow.transition_stats = old.transition_stats
+
+class WorkflowReloader(object):
+    """ Registers the workflows declared in a ZCML file, and registers
+    them again whenever the file, or a file it includes, changes.
+
+    ``load`` builds the workflows declared in the ZCML file
+    ``filename`` (relative to ``package``, if supplied) and *publishes*
+    them in ``registry`` (by default the current site manager): for
+    each content type and workflow type, a new workflow list replaces
+    the registered one, which is never changed once registered.  A
+    ``get_workflow`` call therefore finds either all the old workflows
+    or all the new ones, readers take no lock, and the old workflows
+    remain intact for the calls (e.g. ``transition``) using them.  The
+    workflows registered for the same content type and workflow type by
+    other means (e.g. another ZCML file) are kept, before those of the
+    reloaded file.
+
+    A reloaded workflow shares the idempotency cache (unless it is
+    given its own) and the transition statistics of the workflow it
+    replaces: the one at the same position among the workflows of the
+    file for the same content type and workflow type.  Keys executed by
+    the old workflow are therefore not executed again by the new one.
+
+    ``check`` loads the file again if it or one of the files it
+    includes was modified since it was loaded, and ``start`` starts a
+    daemon thread which calls ``check`` every ``interval`` seconds.
+    When loading fails, the workflows published last stay registered,
+    the exception is kept as ``error`` and passed to ``on_error`` (if
+    supplied), and the files are not loaded again until they change.
+    """
+
+    def __init__(self, filename, package=None, registry=None, interval=1.0,
+                 on_error=None):
+        self.filename = filename
+        self.package = package
+        self.registry = registry
+        self.interval = interval
+        self.on_error = on_error
+        self.error = None
+        self.version = 0 # the number of successful loads
+        self._files = {} # path -> modification time when loaded
+        self._published = {} # (content_type, type) -> published wf_defs
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._worker = None
+
+    def load(self):
+        """ Build and publish the workflows of the ZCML file.  Return
+        True if they were published, False if loading failed. """
+        from repoze.workflow.codegen import _zcml_workflows
+        with self._lock:
+            files = dict([(path, _mtime(path)) for path in self._files])
+            try:
+                found, context = _zcml_workflows(self.filename, self.package)
+            except Exception as e:
+                if not files:
+                    files[self._path()] = _mtime(self._path())
+                self._files = files
+                self.error = e
+                if self.on_error is not None:
+                    self.on_error(e)
+                return False
+            for path in getattr(context, '_seen_files', ()):
+                if path not in files:
+                    files[path] = _mtime(path)
+            self._files = files
+            self._publish(found)
+            self.error = None
+            self.version += 1
+            return True
+
+    def _path(self):
+        from zope.configuration.config import ConfigurationMachine
+        context = ConfigurationMachine()
+        context.package = self.package
+        return context.path(self.filename)
+
+    def _publish(self, found):
+        registry = self.registry
+        if registry is None:
+            registry = getSiteManager()
+        grouped = {}
+        for type, content_type, elector, workflow in found:
+            if content_type is None:
+                content_type = IDefaultWorkflow
+            if not IInterface.providedBy(content_type):
+                content_type = providedBy(content_type)
+            grouped.setdefault((content_type, type), []).append(
+                {'workflow': workflow, 'elector': elector})
+        inherited = set()
+        for key, wf_defs in grouped.items():
+            old_defs = self._published.get(key, ())
+            for wf_def, old_def in zip(wf_defs, old_defs):
+                workflow = wf_def['workflow']
+                if id(workflow) not in inherited: # once per workflow
+                    inherited.add(id(workflow))
+                    _inherit(workflow, old_def['workflow'])
+        for key in set(self._published) | set(grouped):
+            content_type, type = key
+            current = registry.adapters.registered(
+                (content_type,), IWorkflowList, type)
+            owned = set([id(wf_def)
+                         for wf_def in self._published.get(key, ())])
+            wf_list = [wf_def for wf_def in current or ()
+                       if id(wf_def) not in owned]
+            wf_list.extend(grouped.get(key, ()))
+            if wf_list:
+                registry.registerAdapter(wf_list, (content_type,),
+                                         IWorkflowList, type)
+            elif current is not None:
+                registry.unregisterAdapter(current, (content_type,),
+                                           IWorkflowList, type)
+        self._published = grouped
+
+    def changed(self):
+        """ Return True if the ZCML file, or a file it includes, was
+        modified since it was last loaded, or was never loaded. """
+        if not self._files:
+            return True
+        for path, mtime in list(self._files.items()):
+            if _mtime(path) != mtime:
+                return True
+        return False
+
+    def check(self):
+        """ Load the ZCML file if it changed (see ``changed``).  Return
+        True if workflows were published. """
+        if self.changed():
+            return self.load()
+        return False
+
+    def start(self):
+        """ Start a daemon thread which calls ``check`` every
+        ``interval`` seconds. """
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._work)
+            self._worker.daemon = True
+            self._worker.start()
+
+    def stop(self, timeout=None):
+        """ Stop the thread started by ``start``. """
+        worker = self._worker
+        if worker is None:
+            return
+        self._stopping.set()
+        worker.join(timeout)
+        self._worker = None
+
+    def _work(self):
+        while not self._stopping.wait(self.interval):
+            self.check()
@@ -0,0 +1,206 @@
+""" Compact serialization of workflow definitions.
+
+``dumps`` encodes the definition of a ``Workflow`` (its options,
+states, aliases, sub-states, transitions and their extra data) as
+UTF-8 JSON, and ``loads`` builds an equivalent workflow from it, e.g.
+in another process.  Callables (callbacks, guards, permission
+checkers) are encoded as indexes in a table of their dotted names,
+each of which is imported once, and guard expressions as their
+source.  JSON values other than lists and dictionaries with
+string keys are encoded as single-key objects tagged with a ``$``
+name, so that tuples and sets survive the round trip.
+
+The encoding is versioned by ``SCHEMA``; ``loads`` refuses data of
+another version.  The idempotency cache of a workflow is not part of
+its definition, nor are its state store and deferred callback queue
+unless they are importable by their dotted names; ``loads`` requires
+those to be passed to it instead.
+"""
+import json
+
+from repoze.workflow._compat import text_type
+from repoze.workflow._dotted import dotted_name
+from repoze.workflow._dotted import resolve
+from repoze.workflow.codegen import _options
+from repoze.workflow.guards import ExpressionGuard
+from repoze.workflow.guards import _OrderIndependent
+from repoze.workflow.workflow import Workflow
+from repoze.workflow.workflow import WorkflowError
+
+SCHEMA = 1
+
+_SCALARS = (type(None), bool, int, float, text_type)
+_RUNTIME = ('state_store', 'deferred_queue')
+
+class _Encoder(object):
+
+    def __init__(self):
+        self.refs = [] # dotted names
+        self.indexes = {} # id(ob) -> index in refs
+
+    def ref(self, ob):
+        index = self.indexes.get(id(ob))
+        if index is None:
+            try:
+                dotted = dotted_name(ob)
+            except ValueError:
+                raise WorkflowError('Cannot serialize %r: it is not '
+                                    'importable by a dotted name' % (ob,))
+            index = self.indexes[id(ob)] = len(self.refs)
+            self.refs.append(dotted)
+        return index
+
+    def __call__(self, ob):
+        if isinstance(ob, _SCALARS):
+            return ob
+        if isinstance(ob, str): # pragma: no cover (Python 2)
+            return ob.decode('utf-8')
+        if isinstance(ob, list):
+            return [self(item) for item in ob]
+        if isinstance(ob, dict):
+            if all(isinstance(key, (str, text_type))
+                   and not key.startswith('$') for key in ob):
+                return dict([(key, self(value))
+                             for key, value in ob.items()])
+            return {'$dict': [[self(key), self(value)]
+                              for key, value in ob.items()]}
+        if isinstance(ob, tuple):
+            return {'$tuple': [self(item) for item in ob]}
+        if isinstance(ob, (set, frozenset)):
+            return {'$set': sorted([self(item) for item in ob], key=repr)}
+        if isinstance(ob, ExpressionGuard):
+            return {'$expr': ob.expression}
+        if isinstance(ob, _OrderIndependent):
+            return {'$independent': self(ob.guard)}
+        return {'$ref': self.ref(ob)}
+
+class _Decoder(object):
+
+    def __init__(self, refs):
+        self.refs = refs # dotted names
+        self.resolved = {} # index in refs -> object
+        self.guards = {} # guard expression -> ExpressionGuard
+
+    def ref(self, index):
+        ob = self.resolved.get(index)
+        if ob is None:
+            try:
+                dotted = self.refs[index]
+                ob = self.resolved[index] = resolve(dotted)
+            except (IndexError, TypeError):
+                raise WorkflowError('Invalid reference %r' % (index,))
+            except (ImportError, AttributeError) as e:
+                raise WorkflowError('Cannot resolve %r: %s' % (dotted, e))
+        return ob
+
+    def __call__(self, ob):
+        if isinstance(ob, list):
+            return [self(item) for item in ob]
+        if not isinstance(ob, dict):
+            return ob
+        if len(ob) == 1:
+            tag, = ob
+            if tag.startswith('$'):
+                value = ob[tag]
+                if tag == '$ref':
+                    return self.ref(value)
+                if tag == '$expr':
+                    guard = self.guards.get(value)
+                    if guard is None:
+                        guard = self.guards[value] = ExpressionGuard(value)
+                    return guard
+                if tag == '$tuple':
+                    return tuple([self(item) for item in value])
+                if tag == '$set':
+                    return set([self(item) for item in value])
+                if tag == '$dict':
+                    return dict([(self(key), self(item))
+                                 for key, item in value])
+                if tag == '$independent':
+                    return _OrderIndependent(self(value))
+                raise WorkflowError('Unknown tag %r' % tag)
+        return dict([(key, self(value)) for key, value in ob.items()])
+
+def dumps(workflow):
+    """ Return the definition of ``workflow`` as bytes. """
+    encode = _Encoder()
+    options = {}
+    runtime = []
+    for key, value in _options(workflow):
+        try:
+            options[key] = encode(value)
+        except WorkflowError:
+            if key not in _RUNTIME:
+                raise
+            runtime.append(key)
+    parents = workflow._state_parents
+    aliases = {}
+    for alias, state in workflow._state_aliases.items():
+        aliases.setdefault(state, []).append(alias)
+    states = []
+    # parents first, as loads adds each state under its parent (the
+    # order of _state_data is arbitrary before Python 3.6)
+    ancestors = workflow._ancestors
+    for name, data in sorted(workflow._state_data.items(),
+                             key=lambda item: len(ancestors.get(item[0], ()))):
+        extras = dict(data)
+        callback = extras.pop('callback')
+        title = extras.pop('title')
+        states.append([name, encode(callback), title, parents.get(name),
+                       aliases.get(name, []), encode(extras)])
+    transitions = []
+    for name, data in workflow._transition_data.items():
+        extras = dict(data)
+        for key in ('name', 'from_state', 'to_state'):
+            del extras[key]
+        callback = extras.pop('callback')
+        permission = extras.pop('permission')
+        title = extras.pop('title')
+        transitions.append([name, data['from_state'], data['to_state'],
+                            encode(callback), permission, title,
+                            encode(extras)])
+    definition = {'schema': SCHEMA,
+                  'options': options,
+                  'runtime': runtime,
+                  'refs': encode.refs,
+                  'states': states,
+                  'transitions': transitions}
+    return json.dumps(definition, separators=(',', ':')).encode('utf-8')
+
+def loads(data, **kw):
+    """ Return a new workflow built from the definition ``data`` (bytes
+    or text returned by ``dumps``).  ``kw`` are additional keyword
+    arguments of ``Workflow``, such as ``state_store``. """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    try:
+        definition = json.loads(data)
+    except ValueError as e:
+        raise WorkflowError('Invalid workflow definition: %s' % e)
+    schema = definition.get('schema')
+    if schema != SCHEMA:
+        raise WorkflowError('Unsupported workflow definition schema %r'
+                            % (schema,))
+    missing = [key for key in definition['runtime'] if key not in kw]
+    if missing:
+        raise WorkflowError('The workflow definition needs %s'
+                            % ', '.join(missing))
+    decode = _Decoder(definition['refs'])
+    options = dict([(str(key), decode(value))
+                    for key, value in definition['options'].items()])
+    options.update(kw)
+    workflow = Workflow(**options)
+    for name, callback, title, parent, aliases, extras in \
+            definition['states']:
+        workflow.add_state(name, decode(callback), aliases, title, parent,
+                           **_keywords(decode(extras)))
+    for (name, from_state, to_state, callback, permission, title,
+         extras) in definition['transitions']:
+        workflow.add_transition(name, from_state, to_state,
+                                decode(callback), permission, title,
+                                **_keywords(decode(extras)))
+    return workflow
+
+def _keywords(extras):
+    # keyword argument names must be native strings on Python 2
+    return dict([(str(key), value) for key, value in extras.items()])
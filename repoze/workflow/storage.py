@@ -0,0 +1,301 @@
+""" State storage for workflows.
+
+A state store is responsible for reading and writing the workflow
+state of content objects on behalf of a ``Workflow``.  The default
+store keeps the state on an attribute of the content object itself;
+the other stores keep it outside of the content object, keyed by a
+content key, so that states may be read (and written) in bulk without
+loading the content objects at all.
+"""
+import sqlite3
+import threading
+import time
+
+from zope.interface import implementer
+
+from repoze.workflow.interfaces import IStateStore
+from repoze.workflow._lru import LRUCache
+
+_marker = object()
+
+def _identity(content):
+    return content
+
+@implementer(IStateStore)
+class AttributeStateStore(object):
+    """ Keep the state on the ``state_attr`` attribute of the content
+    object (the historical behavior). """
+
+    def __init__(self, state_attr):
+        self.state_attr = state_attr
+
+    def get(self, content):
+        return getattr(content, self.state_attr, None)
+
+    def set(self, content, state):
+        setattr(content, self.state_attr, state)
+
+    def get_many(self, contents):
+        state_attr = self.state_attr
+        return [getattr(content, state_attr, None) for content in contents]
+
+    def set_many(self, items):
+        state_attr = self.state_attr
+        for content, state in items:
+            setattr(content, state_attr, state)
+
+@implementer(IStateStore)
+class DictStateStore(object):
+    """ Keep states in a dictionary keyed by content key.
+
+    ``key`` is a callable which returns a hashable key for a content
+    object; by default the content object itself is used as the key,
+    so callers may pass content keys wherever content is expected.
+    """
+
+    def __init__(self, data=None, key=None):
+        if data is None:
+            data = {}
+        if key is None:
+            key = _identity
+        self.data = data
+        self.key = key
+
+    def get(self, content):
+        return self.data.get(self.key(content))
+
+    def set(self, content, state):
+        self.data[self.key(content)] = state
+
+    def get_many(self, contents):
+        get = self.data.get
+        key = self.key
+        return [get(key(content)) for content in contents]
+
+    def set_many(self, items):
+        key = self.key
+        self.data.update([(key(content), state) for content, state in items])
+
+@implementer(IStateStore)
+class SQLiteStateStore(object):
+    """ Keep states in a SQLite table of ``(key, state)`` rows.
+
+    ``connection`` is either a ``sqlite3`` connection or a database
+    path.  ``key`` is a callable which returns a key (a string or an
+    integer) for a content object; by default the content object
+    itself is used as the key.  Each write is committed immediately.
+    The threads using the store take turns on the connection.
+    """
+
+    # SQLite limits the number of host parameters in one statement
+    batch_size = 500
+
+    def __init__(self, connection, table='workflow_state', key=None):
+        if not isinstance(connection, sqlite3.Connection):
+            connection = sqlite3.connect(connection, check_same_thread=False)
+        if key is None:
+            key = _identity
+        self.connection = connection
+        self.table = table
+        self.key = key
+        self._lock = threading.Lock() # serializes uses of the connection
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS %s '
+                '(key PRIMARY KEY, state TEXT NOT NULL)' % table)
+
+    def get(self, content):
+        key = self.key(content)
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT state FROM %s WHERE key = ?' % self.table,
+                (key,)).fetchone()
+        if row is not None:
+            return row[0]
+
+    def set(self, content, state):
+        key = self.key(content)
+        with self._lock:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO %s (key, state) VALUES (?, ?)'
+                    % self.table, (key, state))
+
+    def get_many(self, contents):
+        keys = [self.key(content) for content in contents]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), self.batch_size):
+                chunk = keys[start:start + self.batch_size]
+                found.update(self.connection.execute(
+                    'SELECT key, state FROM %s WHERE key IN (%s)'
+                    % (self.table, ', '.join(['?'] * len(chunk))), chunk))
+        return [found.get(key) for key in keys]
+
+    def set_many(self, items):
+        key = self.key
+        rows = [(key(content), state) for content, state in items]
+        with self._lock:
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO %s (key, state) VALUES (?, ?)'
+                    % self.table, rows)
+
+@implementer(IStateStore)
+class CachingStateStore(object):
+    """ A read-through, write-through LRU cache in front of another
+    state store.
+
+    ``store`` is the state store being cached.  At most ``maxsize``
+    states are cached; if ``ttl`` is not None, cached states expire
+    after ``ttl`` seconds.  ``key`` is a callable which returns a
+    hashable cache key for a content object; it defaults to the
+    ``key`` of ``store`` if it has one, otherwise the content object
+    itself is used.
+
+    Writes made through this store update the cache.  Writes made
+    elsewhere (e.g. by another process) must be announced by calling
+    ``invalidate`` or ``clear``.  A state read from ``store`` is not
+    cached if the content object was written, invalidated or cleared
+    while it was being read.
+    """
+
+    def __init__(self, store, maxsize=1024, ttl=None, key=None,
+                 clock=time.time):
+        if key is None:
+            key = getattr(store, 'key', _identity)
+        self.store = store
+        self.key = key
+        self.cache = LRUCache(maxsize, ttl, clock)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._reads = {} # key -> [reads under way, version]
+        self._generation = 0 # bumped by clear
+
+    def _begin(self, keys):
+        # note that ``keys`` are being read from the store; return the
+        # versions to compare in ``_fill``
+        with self._lock:
+            versions = []
+            for key in keys:
+                entry = self._reads.get(key)
+                if entry is None:
+                    entry = self._reads[key] = [0, 0]
+                entry[0] += 1
+                versions.append((self._generation, entry[1]))
+            return versions
+
+    def _fill(self, keys, versions, states):
+        # cache the states read from the store (if any: a read may
+        # fail), unless their key was written since its read began
+        with self._lock:
+            for key, version, state in zip(keys, versions, states):
+                entry = self._reads[key]
+                entry[0] -= 1
+                if not entry[0]:
+                    del self._reads[key]
+                if (state is not _marker and
+                    version == (self._generation, entry[1])):
+                    self.cache.set(key, state)
+
+    def _written(self, keys, states=None):
+        # update the cache after a write and outdate the reads under way
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._reads.get(key)
+                if entry is not None:
+                    entry[1] += 1
+                if states is None:
+                    self.cache.pop(key)
+                else:
+                    self.cache.set(key, states[i])
+
+    def _count(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def get(self, content):
+        key = self.key(content)
+        state = self.cache.get(key, _marker)
+        if state is not _marker:
+            self._count(1, 0)
+            return state
+        self._count(0, 1)
+        versions = self._begin([key])
+        try:
+            state = self.store.get(content)
+        except:
+            self._fill([key], versions, [_marker])
+            raise
+        self._fill([key], versions, [state])
+        return state
+
+    def set(self, content, state):
+        self.store.set(content, state)
+        self._written([self.key(content)], [state])
+
+    def get_many(self, contents):
+        contents = list(contents)
+        keys = [self.key(content) for content in contents]
+        get = self.cache.get
+        states = [get(key, _marker) for key in keys]
+        missing = [i for i, state in enumerate(states) if state is _marker]
+        self._count(len(keys) - len(missing), len(missing))
+        if missing:
+            missing_keys = [keys[i] for i in missing]
+            versions = self._begin(missing_keys)
+            try:
+                fetched = list(
+                    self.store.get_many([contents[i] for i in missing]))
+            except:
+                self._fill(missing_keys, versions, [_marker] * len(missing))
+                raise
+            for i, state in zip(missing, fetched):
+                states[i] = state
+            self._fill(missing_keys, versions, fetched)
+        return states
+
+    def set_many(self, items):
+        items = list(items)
+        self.store.set_many(items)
+        self._written([self.key(content) for content, state in items],
+                      [state for content, state in items])
+
+    def prefetch(self, contents):
+        """ Warm the cache with the states of ``contents`` using a
+        single ``get_many`` call against the underlying store for
+        those which are not already cached. """
+        self.get_many(contents)
+
+    def invalidate(self, content):
+        """ Forget the cached state of ``content``. """
+        self._written([self.key(content)])
+
+    def invalidate_many(self, contents):
+        for content in contents:
+            self.invalidate(content)
+
+    def clear(self):
+        """ Forget all cached states. """
+        with self._lock:
+            self._generation += 1
+            self.cache.clear()
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def stats(self):
+        """ Return a dictionary of cache metrics. """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hit_ratio,
+                'evictions': self.cache.evictions,
+                'size': len(self.cache),
+                'maxsize': self.cache.maxsize,
+               }
@@ -41,13 +41,26 @@ class DummyWorkflow:
     def check(self):
         return True
 
-    def state_of(self, content):
+    def state_of(self, content, peek=False):
         return getattr(content, self.state_attr, None)
 
     def has_state(self, content):
         return hasattr(content, self.state_attr)
 
-    def state_info(self, content, request, context=None, from_state=None):
+    def in_state(self, content, state_name, peek=False):
+        return self.state_of(content, peek) == state_name
+
+    def states_of(self, contents, request=None, initialize=True):
+        return [self.state_of(content) for content in contents]
+
+    def group_by_state(self, contents, request=None, initialize=True):
+        groups = {}
+        for content in contents:
+            groups.setdefault(self.state_of(content), []).append(content)
+        return groups
+
+    def state_info(self, content, request, context=None, from_state=None,
+                   peek=False, executor=None):
         return self._state_info
 
     def initialize(self, content, request=None):
@@ -59,18 +72,24 @@ class DummyWorkflow:
         return self.initial_state, None
 
     def transition(self, content, request, transition_name, context=None,
-                   guards=()):
-        self.executed.append({'content':content, 'name':transition_name,
-                              'guards':guards, 'request':request,
-                              'context':context})
+                   guards=(), idempotency_key=None):
+        executed = {'content':content, 'name':transition_name,
+                    'guards':guards, 'request':request, 'context':context}
+        if idempotency_key is not None:
+            executed['idempotency_key'] = idempotency_key
+        self.executed.append(executed)
 
     def transition_to_state(self, content, request, to_state, context=None,
-                            guards=(), skip_same=True):
-        self.transitioned.append({'to_state':to_state, 'content':content,
-                                  'request':request, 'guards':guards,
-                                  'context':context, 'skip_same':skip_same})
-
-    def get_transitions(self, content, request, context=None, from_state=None):
+                            guards=(), skip_same=True, idempotency_key=None):
+        transitioned = {'to_state':to_state, 'content':content,
+                        'request':request, 'guards':guards,
+                        'context':context, 'skip_same':skip_same}
+        if idempotency_key is not None:
+            transitioned['idempotency_key'] = idempotency_key
+        self.transitioned.append(transitioned)
+
+    def get_transitions(self, content, request, context=None, from_state=None,
+                        peek=False, executor=None):
         return self._transitions
 
 
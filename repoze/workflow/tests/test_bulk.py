@@ -0,0 +1,229 @@
+import unittest
+
+class TestBulkTransitionRunner(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow.bulk import BulkTransitionRunner
+        return BulkTransitionRunner
+
+    def _makeOne(self, workflow, chunksize=100, max_workers=None,
+                 executor=None, key=None):
+        return self._getTargetClass()(workflow, chunksize, max_workers,
+                                      executor, key)
+
+    def _makeWorkflow(self, transition_callback=None, state_callback=None,
+                      permission_checker=None, **kw):
+        from repoze.workflow import Workflow
+        workflow = Workflow('state', 'private', permission_checker)
+        workflow.add_state('private')
+        workflow.add_state('public', state_callback)
+        workflow.add_transition('publish', 'private', 'public',
+                                transition_callback, **kw)
+        return workflow
+
+    def test_ctor_bad_chunksize(self):
+        self.assertRaises(ValueError, self._makeOne, None, 0)
+
+    def test_run_inline(self):
+        called = []
+        def callback(content, info):
+            called.append((content, info.workflow, info.request))
+        workflow = self._makeWorkflow(callback, callback)
+        runner = self._makeOne(workflow, max_workers=0)
+        ob1, ob2 = DummyContent(), DummyContent()
+        request = object()
+        result = runner.run(iter([ob1, ob2]), request, 'publish')
+        self.assertEqual(result.succeeded, [ob1, ob2])
+        self.assertEqual(result.failed, [])
+        self.assertEqual(ob1.state, 'public')
+        self.assertEqual(ob2.state, 'public')
+        self.assertEqual(called, [(ob1, workflow, request)] * 2 +
+                                 [(ob2, workflow, request)] * 2)
+
+    def test_run_inline_failures(self):
+        from repoze.workflow import WorkflowError
+        def callback(content, info):
+            if content.bad:
+                raise ValueError('bad')
+        def guard(content, info):
+            if content.vetoed:
+                raise WorkflowError('vetoed')
+        workflow = self._makeWorkflow(callback)
+        runner = self._makeOne(workflow, max_workers=0)
+        obs = [DummyContent(bad=False, vetoed=False),
+               DummyContent(bad=True, vetoed=False),
+               DummyContent(bad=False, vetoed=True),
+               DummyContent(bad=False, vetoed=False, state='public')]
+        result = runner.run(obs, None, 'publish', guards=[guard])
+        self.assertEqual(result.succeeded, [obs[0]])
+        self.assertEqual([content for content, e in result.failed], obs[1:])
+        errors = [e.__class__ for content, e in result.failed]
+        self.assertEqual(errors, [ValueError, WorkflowError, WorkflowError])
+        self.assertEqual(obs[1].state, 'private')
+
+    def test_run_guard_error(self):
+        def guard(content, info):
+            if content.broken:
+                raise RuntimeError('broken')
+        workflow = self._makeWorkflow()
+        runner = self._makeOne(workflow, max_workers=0)
+        obs = [DummyContent(broken=True), DummyContent(broken=False)]
+        result = runner.run(obs, None, 'publish', guards=[guard])
+        self.assertEqual(result.succeeded, [obs[1]])
+        (content, error), = result.failed
+        self.assertTrue(content is obs[0])
+        self.assertTrue(isinstance(error, RuntimeError))
+        self.assertEqual(obs[0].state, 'private')
+        self.assertEqual(obs[1].state, 'public')
+
+    def test_run_inline_deferred(self):
+        called = []
+        def callback(content, info):
+            if content.bad:
+                raise ValueError('bad')
+            called.append(content)
+        def deferred(content, info): # pragma: no cover
+            pass
+        workflow = self._makeWorkflow(deferred, callback, deferred=True)
+        workflow.deferred_queue = queue = DummyQueue(workflow)
+        runner = self._makeOne(workflow, max_workers=0)
+        obs = [DummyContent(bad=False), DummyContent(bad=True)]
+        result = runner.run(obs, None, 'publish')
+        self.assertEqual(result.succeeded, [obs[0]])
+        self.assertEqual(called, [obs[0]])
+        self.assertEqual(queue.items, [(deferred, obs[0], 'public')])
+
+    def test_run_checks_transition_guards_and_permission(self):
+        from repoze.workflow import WorkflowError
+        def checker(permission, context, request):
+            return context.allowed
+        def never(content, info):
+            if content.never:
+                raise WorkflowError('never')
+        workflow = self._makeWorkflow(permission_checker=checker,
+                                      permission='edit', guards=[never])
+        runner = self._makeOne(workflow, max_workers=0)
+        obs = [DummyContent(allowed=True, never=False),
+               DummyContent(allowed=False, never=False),
+               DummyContent(allowed=True, never=True)]
+        result = runner.run(obs, object(), 'publish')
+        self.assertEqual(result.succeeded, [obs[0]])
+        self.assertEqual(len(result.failed), 2)
+
+    def test_run_with_executor_uses_keys_and_chunks(self):
+        workflow = self._makeWorkflow(record_callback, record_callback)
+        executor = DummyExecutor()
+        runner = self._makeOne(workflow, chunksize=2, executor=executor,
+                               key=lambda content: content.id)
+        obs = [DummyContent(id=i) for i in range(5)]
+        obs[3].id = 'bad'
+        del RECORDED[:]
+        result = runner.run(obs, None, 'publish')
+        self.assertEqual(executor.chunks, [2, 2, 1])
+        self.assertFalse(executor.shutdown_called)
+        self.assertEqual(result.succeeded, [obs[0], obs[1], obs[2], obs[4]])
+        self.assertEqual(len(result.failed), 1)
+        self.assertTrue(result.failed[0][0] is obs[3])
+        self.assertEqual(obs[4].state, 'public')
+        self.assertEqual(obs[3].state, 'private')
+        keys = [key for key, info in RECORDED]
+        self.assertEqual(keys, [0, 0, 1, 1, 2, 2, 'bad', 4, 4])
+        key, info = RECORDED[0]
+        self.assertEqual(info.workflow, None)
+        self.assertEqual(info.transition['name'], 'publish')
+        self.assertFalse('callback' in info.transition)
+
+    def test_run_with_executor_deferred(self):
+        workflow = self._makeWorkflow(record_callback, record_callback,
+                                      deferred=True)
+        workflow.deferred_queue = queue = DummyQueue(workflow)
+        runner = self._makeOne(workflow, executor=DummyExecutor())
+        ob = DummyContent(id=1)
+        del RECORDED[:]
+        result = runner.run([ob], None, 'publish')
+        self.assertEqual(result.succeeded, [ob])
+        # the state callback runs in the pool, the transition's is queued
+        self.assertEqual([key for key, info in RECORDED], [ob])
+        self.assertEqual(queue.items, [(record_callback, ob, 'public')])
+
+    def test_run_with_executor_chunk_fails(self):
+        workflow = self._makeWorkflow(record_callback)
+        executor = DummyExecutor(fail=True)
+        runner = self._makeOne(workflow, chunksize=2, executor=executor)
+        obs = [DummyContent(id=i) for i in range(3)]
+        result = runner.run(obs, None, 'publish')
+        self.assertEqual(result.succeeded, [])
+        self.assertEqual(len(result.failed), 3)
+        self.assertEqual(obs[0].state, 'private')
+
+    def test_run_nothing_to_dispatch(self):
+        workflow = self._makeWorkflow()
+        runner = self._makeOne(workflow, executor=DummyExecutor())
+        ob = DummyContent(state='public')
+        result = runner.run([ob], None, 'publish')
+        self.assertEqual(result.succeeded, [])
+        self.assertEqual(runner.executor.chunks, [])
+
+    def test_run_process_pool(self):
+        from repoze.workflow.storage import DictStateStore
+        from repoze.workflow import Workflow
+        workflow = Workflow('state', 'private',
+                            state_store=DictStateStore())
+        workflow.add_state('private')
+        workflow.add_state('public', failing_callback)
+        workflow.add_transition('publish', 'private', 'public')
+        runner = self._makeOne(workflow, chunksize=2, max_workers=2)
+        result = runner.run(['a', 'bad', 'c'], None, 'publish')
+        self.assertEqual(result.succeeded, ['a', 'c'])
+        self.assertEqual(result.failed[0][0], 'bad')
+        self.assertEqual(result.failed[0][1].__class__, ValueError)
+        self.assertEqual(workflow.state_store.data,
+                         {'a': 'public', 'bad': 'private', 'c': 'public'})
+
+RECORDED = []
+
+def record_callback(key, info):
+    RECORDED.append((key, info))
+    if key == 'bad':
+        raise ValueError(key)
+
+def failing_callback(key, info):
+    if key == 'bad':
+        raise ValueError(key)
+
+class DummyContent:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class DummyQueue:
+    def __init__(self, workflow):
+        self.workflow = workflow
+        self.items = []
+
+    def put(self, callback, content, info):
+        # the state is written before callbacks are queued
+        self.items.append((callback, content,
+                           self.workflow.state_of(content)))
+
+class DummyFuture:
+    def __init__(self, fn, args, fail):
+        self.fn = fn
+        self.args = args
+        self.fail = fail
+
+    def result(self):
+        if self.fail:
+            raise RuntimeError('broken pool')
+        return self.fn(*self.args)
+
+class DummyExecutor:
+    shutdown_called = False
+    def __init__(self, fail=False):
+        self.chunks = []
+        self.fail = fail
+
+    def submit(self, fn, *args):
+        self.chunks.append(len(args[0]))
+        return DummyFuture(fn, args, self.fail)
+
+    def shutdown(self): # pragma: no cover
+        self.shutdown_called = True
@@ -0,0 +1,223 @@
+import unittest
+
+from zope.testing.cleanup import cleanUp
+
+PACKAGE = 'repoze.workflow.tests.fixtures'
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        cleanUp()
+
+    def tearDown(self):
+        cleanUp()
+
+    def _callFUT(self, *argv):
+        from repoze.workflow.cli import main
+        out = DummyOut()
+        status = main(list(argv), out)
+        return status, ''.join(out.written)
+
+    def test_list(self):
+        status, output = self._callFUT('list', 'configure.zcml',
+                                       '--package', PACKAGE)
+        self.assertEqual(status, 0)
+        self.assertEqual(output.splitlines(), [
+            'repoze.workflow.tests.fixtures.dummy.IContent',
+            "  security: 'the workflow' (elector "
+            "repoze.workflow.tests.fixtures.dummy.elector), "
+            "2 states, 3 transitions",
+            'repoze.workflow.tests.fixtures.dummy.IContent2',
+            "  security: 'the workflow' (elector "
+            "repoze.workflow.tests.fixtures.dummy.elector), "
+            "2 states, 3 transitions",
+            ])
+
+    def test_list_without_elector(self):
+        status, output = self._callFUT('list', 'graph.zcml',
+                                       '--package', PACKAGE)
+        self.assertEqual(output.splitlines()[1],
+                         "  publication: 'publication', "
+                         "4 states, 4 transitions")
+
+    def test_list_other_registrations(self):
+        from repoze.workflow.testing import DummyWorkflow
+        from repoze.workflow.zcml import register_workflow
+        from repoze.workflow.tests.fixtures.dummy import IContent2
+        register_workflow(DummyWorkflow(), 'custom', IContent2,
+                          lambda context: True)
+        status, output = self._callFUT('list', 'graph.zcml',
+                                       '--package', PACKAGE)
+        lines = output.splitlines()
+        self.assertEqual(lines[2],
+                         'repoze.workflow.tests.fixtures.dummy.IContent2')
+        self.assertTrue(lines[3].startswith("  custom: 'the workflow' (elector <"))
+
+    def test_stdout(self):
+        import sys
+        out = DummyOut()
+        stdout = sys.stdout
+        sys.stdout = out
+        try:
+            from repoze.workflow.cli import main
+            status = main(['list', 'graph.zcml', '--package', PACKAGE])
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(status, 0)
+        self.assertEqual(len(''.join(out.written).splitlines()), 2)
+
+    def test_check_ok(self):
+        status, output = self._callFUT('check', 'configure.zcml',
+                                       '--package', PACKAGE)
+        self.assertEqual(status, 0)
+        self.assertEqual(output.splitlines(), [
+            "repoze.workflow.tests.fixtures.dummy.IContent security "
+            "'the workflow': OK",
+            ])
+
+    def test_check_problems(self):
+        status, output = self._callFUT('check', 'graph.zcml',
+                                       '--package', PACKAGE)
+        self.assertEqual(status, 1)
+        self.assertEqual(output.splitlines(), [
+            "repoze.workflow.tests.fixtures.dummy.IContent publication "
+            "'publication': FAILED",
+            "  state 'archived' is a dead end",
+            "  state 'orphaned' is unreachable",
+            ])
+
+    def test_check_final(self):
+        status, output = self._callFUT('check', 'graph.zcml',
+                                       '--package', PACKAGE,
+                                       '--final', 'archived')
+        self.assertEqual(status, 1)
+        self.assertFalse('dead end' in output)
+
+    def test_bench(self):
+        status, output = self._callFUT('bench', 'graph.zcml',
+                                       '--package', PACKAGE,
+                                       '--number', '3')
+        self.assertEqual(status, 0)
+        lines = output.splitlines()
+        self.assertEqual(lines[0], "repoze.workflow.tests.fixtures.dummy."
+                         "IContent publication 'publication'")
+        self.assertEqual([line.split()[0] for line in lines[1:]],
+                         ['get_workflow', 'state_info', 'transition'])
+        self.assertTrue(lines[3].endswith(' us'))
+
+    def test_bench_failed(self):
+        from repoze.workflow.tests.fixtures.dummy import IContent2
+        from repoze.workflow.workflow import Workflow
+        from repoze.workflow.zcml import register_workflows
+        def checker(permission, context, request):
+            raise KeyError(permission)
+        workflow = Workflow('state', 'draft', checker, name='broken')
+        workflow.add_state('draft')
+        workflow.add_transition('edit', 'draft', 'draft', permission='edit')
+        register_workflows(workflow, 'security', [IContent2], None)
+        status, output = self._callFUT('bench', 'graph.zcml',
+                                       '--package', PACKAGE,
+                                       '--number', '3')
+        self.assertEqual(status, 1)
+        lines = output.splitlines()
+        self.assertEqual(lines[4:], [
+            "repoze.workflow.tests.fixtures.dummy.IContent2 security "
+            "'broken'",
+            "  FAILED: KeyError: 'edit'"])
+
+class TestCheckWorkflow(unittest.TestCase):
+    def _callFUT(self, workflow, final=()):
+        from repoze.workflow.cli import check_workflow
+        return check_workflow(workflow, final)
+
+    def test_nested_states(self):
+        from repoze.workflow.workflow import Workflow
+        workflow = Workflow('state', 'draft')
+        workflow.add_state('draft')
+        workflow.add_state('review')
+        workflow.add_state('review.legal', parent='review')
+        workflow.add_transition('submit', 'draft', 'review')
+        workflow.add_transition('escalate', 'review', 'review.legal')
+        workflow.add_transition('reject', 'review', 'draft')
+        self.assertEqual(self._callFUT(workflow), [])
+
+    def test_parent_entered_through_sub_state(self):
+        from repoze.workflow.workflow import Workflow
+        workflow = Workflow('state', 'draft')
+        workflow.add_state('draft')
+        workflow.add_state('review')
+        workflow.add_state('review.legal', parent='review')
+        workflow.add_state('published')
+        workflow.add_state('archived')
+        workflow.add_transition('submit', 'draft', 'review.legal')
+        workflow.add_transition('approve', 'review', 'published')
+        self.assertEqual(self._callFUT(workflow, final=('published',)),
+                         ["state 'archived' is unreachable"])
+
+class TestBenchWorkflow(unittest.TestCase):
+    def setUp(self):
+        cleanUp()
+
+    def tearDown(self):
+        cleanUp()
+
+    def _callFUT(self, content_type, workflow):
+        from repoze.workflow.cli import bench_workflow
+        return bench_workflow(content_type, 'security', workflow, 2,
+                              clock=DummyClock())
+
+    def test_no_successful_transition(self):
+        from repoze.workflow.workflow import Workflow
+        workflow = Workflow('state', 'draft')
+        workflow.add_state('draft')
+        workflow.add_transition('never', 'draft', 'draft',
+                                guards=['context.never'])
+        results = self._callFUT(DummyContent, workflow)
+        self.assertEqual(results, {'get_workflow': 0.5,
+                                   'state_info': 0.5,
+                                   'transition': None})
+
+    def test_leaves_workflow_alone(self):
+        from repoze.workflow.storage import DictStateStore
+        from repoze.workflow.workflow import Workflow
+        called = []
+        def callback(content, info):
+            called.append(content)
+        store = DictStateStore(key=lambda content: content.key)
+        queue = DummyQueue()
+        workflow = Workflow('state', 'draft', state_store=store,
+                            deferred_queue=queue)
+        workflow.add_state('draft', callback)
+        workflow.add_state('published', callback)
+        workflow.add_transition('publish', 'draft', 'published', callback,
+                                deferred=True)
+        results = self._callFUT(DummyContent, workflow)
+        self.assertEqual(results['transition'], 0.5)
+        self.assertEqual(called, [])
+        self.assertEqual(store.data, {})
+        self.assertEqual(queue.items, [])
+        self.assertEqual(workflow.transition_stats, {})
+
+class DummyOut:
+    def __init__(self):
+        self.written = []
+
+    def write(self, text):
+        self.written.append(text)
+
+class DummyQueue:
+    def __init__(self):
+        self.items = []
+
+    def put(self, callback, content, info): # pragma: no cover
+        self.items.append(callback)
+
+class DummyClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return self.now
+
+class DummyContent:
+    pass
@@ -0,0 +1,245 @@
+import unittest
+
+from zope.testing.cleanup import cleanUp
+
+def _load(source):
+    namespace = {}
+    exec(compile(source, '<generated>', 'exec'), namespace)
+    return namespace
+
+class TestGenerate(unittest.TestCase):
+    def _callFUT(self, workflow, name='workflow'):
+        from repoze.workflow.codegen import generate
+        return generate(workflow, name)
+
+    def _makeWorkflow(self, **kw):
+        from repoze.workflow.guards import _OrderIndependent
+        from repoze.workflow.guards import order_independent
+        from repoze.workflow.workflow import Workflow
+        workflow = Workflow('state', 'draft', checker, name='articles',
+                            **kw)
+        workflow.add_state('draft', callback, aliases=('new',))
+        workflow.add_state('review', title='In review', tags=('a',))
+        workflow.add_state('review.legal', parent='review',
+                           reviewers=set(['bob', 'alice']))
+        workflow.add_state('published')
+        workflow.add_transition('submit', 'draft', 'review',
+                                permission='edit',
+                                guards=['context.ready', guard])
+        workflow.add_transition('escalate', 'review', 'review.legal',
+                                guards=[order_independent(independent_guard)])
+        workflow.add_transition('publish', 'review', 'published',
+                                callback, deferred=True,
+                                guards=[_OrderIndependent(other_guard),
+                                        'context.ready'])
+        return workflow
+
+    def test_equivalent_workflow(self):
+        from repoze.workflow.interfaces import IWorkflow
+        from repoze.workflow.workflow import Workflow
+        from zope.interface.verify import verifyObject
+        original = self._makeWorkflow()
+        source = self._callFUT(original)
+        workflow = _load(source)['workflow']
+        self.assertTrue(isinstance(workflow, Workflow))
+        verifyObject(IWorkflow, workflow)
+        self.assertEqual(workflow.name, 'articles')
+        self.assertEqual(workflow.permission_checker, checker)
+        self.assertEqual(workflow._state_aliases, {'new': 'draft'})
+        self.assertEqual(workflow._state_parents, {'review.legal': 'review'})
+        self.assertEqual(workflow._descendants,
+                         {'review': set(['review.legal'])})
+        self.assertEqual(workflow._state_data['review']['tags'], ('a',))
+        self.assertEqual(workflow._state_data['review.legal']['reviewers'],
+                         set(['bob', 'alice']))
+        self.assertEqual(workflow._state_data['draft']['callback'], callback)
+        self.assertEqual(list(workflow._transition_data),
+                         list(original._transition_data))
+        for state in original._state_data:
+            self.assertEqual(
+                [t['name'] for t in workflow._leaving(state)],
+                [t['name'] for t in original._leaving(state)])
+        # the index is generated, not rebuilt
+        self.assertTrue(workflow._leaving('review.legal')[0]
+                        is workflow._transition_data['escalate'])
+        submit = workflow._transition_data['submit']
+        self.assertEqual(submit['guards'][0].expression, 'context.ready')
+        self.assertTrue(submit['guards'][1] is guard)
+        publish = workflow._transition_data['publish']
+        self.assertTrue(publish['deferred'])
+        self.assertTrue(publish['guards'][0].order_independent)
+        self.assertTrue(publish['guards'][0].guard is other_guard)
+        self.assertTrue(publish['guards'][1] is submit['guards'][0])
+        escalate = workflow._transition_data['escalate']
+        self.assertTrue(escalate['guards'][0].guard is independent_guard)
+        self.assertFalse(hasattr(independent_guard, 'order_independent'))
+
+    def test_generated_workflow_transitions(self):
+        workflow = _load(self._callFUT(self._makeWorkflow()))['workflow']
+        content = DummyContent()
+        content.ready = True
+        workflow.transition(content, None, 'submit')
+        self.assertEqual(content.state, 'review')
+        self.assertEqual(content.guarded, 1)
+        workflow.transition_to_state(content, None, 'review.legal')
+        self.assertTrue(workflow.in_state(content, 'review'))
+
+    def test_name_and_options(self):
+        original = self._makeWorkflow(adaptive_guards=True,
+                                      deterministic=True)
+        source = self._callFUT(original, 'articles')
+        self.assertTrue(source.startswith(
+            "# Generated by repoze.workflow.codegen from 'articles'."))
+        workflow = _load(source)['articles']
+        self.assertTrue(workflow.guard_stats is not None)
+        self.assertTrue(workflow.deterministic)
+        # not shared: each workflow creates its own on first use
+        self.assertEqual(workflow.idempotency_cache, None)
+
+    def test_state_store(self):
+        from repoze.workflow.storage import AttributeStateStore
+        workflow = self._makeWorkflow(
+            state_store=AttributeStateStore('other'))
+        self.assertRaises(WorkflowError, self._callFUT, workflow)
+        workflow = self._makeWorkflow(state_store=DummyStore)
+        self.assertEqual(_load(self._callFUT(workflow))
+                         ['workflow'].state_store, DummyStore)
+
+    def test_deferred_queue(self):
+        workflow = self._makeWorkflow(deferred_queue=DummyStore)
+        self.assertEqual(_load(self._callFUT(workflow))
+                         ['workflow'].deferred_queue, DummyStore)
+
+    def test_not_importable(self):
+        workflow = self._makeWorkflow()
+        workflow.add_transition('retract', 'review', 'draft',
+                                lambda content, info: None)
+        self.assertRaises(WorkflowError, self._callFUT, workflow)
+
+    def test_not_a_workflow(self):
+        self.assertRaises(WorkflowError, self._callFUT, object())
+
+class TestZCML(unittest.TestCase):
+    def setUp(self):
+        cleanUp()
+
+    def tearDown(self):
+        cleanUp()
+
+    def test_zcml_workflows(self):
+        from repoze.workflow.codegen import zcml_workflows
+        from repoze.workflow.tests.fixtures import dummy
+        import repoze.workflow.tests.fixtures as package
+        found = zcml_workflows('configure.zcml', package)
+        self.assertEqual([item[:3] for item in found],
+                         [('security', dummy.IContent, dummy.elector),
+                          ('security', dummy.IContent2, dummy.elector)])
+        self.assertTrue(found[0][3] is found[1][3])
+        self.assertEqual(found[0][3].name, 'the workflow')
+
+    def _writeZCML(self, directory, name, body):
+        import os
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write('<configure xmlns="http://namespaces.repoze.org/bfg">\n'
+                    '<include package="repoze.workflow" file="meta.zcml"/>\n'
+                    '%s\n</configure>\n' % body)
+
+    def _workflowZCML(self, name):
+        return ('<workflow type="publication" name="%s" state_attr="state"'
+                ' initial_state="draft"'
+                ' content_types='
+                '"repoze.workflow.tests.fixtures.dummy.IContent">'
+                '<state name="draft"/></workflow>' % name)
+
+    def test_zcml_workflows_conflict(self):
+        import os
+        import shutil
+        import tempfile
+        from zope.configuration.config import ConfigurationConflictError
+        from repoze.workflow.codegen import zcml_workflows
+        directory = tempfile.mkdtemp()
+        try:
+            self._writeZCML(directory, 'configure.zcml',
+                            self._workflowZCML('one') +
+                            self._workflowZCML('two'))
+            self.assertRaises(ConfigurationConflictError, zcml_workflows,
+                              os.path.join(directory, 'configure.zcml'))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_zcml_workflows_overrides(self):
+        import os
+        import shutil
+        import tempfile
+        from repoze.workflow.codegen import zcml_workflows
+        directory = tempfile.mkdtemp()
+        try:
+            self._writeZCML(directory, 'overrides.zcml',
+                            self._workflowZCML('overriding'))
+            self._writeZCML(directory, 'workflows.zcml',
+                            self._workflowZCML('overridden'))
+            self._writeZCML(directory, 'configure.zcml',
+                            '<include file="workflows.zcml"/>'
+                            '<includeOverrides file="overrides.zcml"/>')
+            found = zcml_workflows(os.path.join(directory, 'configure.zcml'))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual([item[3].name for item in found], ['overriding'])
+
+    def test_generate_zcml(self):
+        from repoze.workflow.codegen import generate_zcml
+        from repoze.workflow.workflow import get_workflow
+        from repoze.workflow.tests.fixtures import dummy
+        import repoze.workflow.tests.fixtures as package
+        namespace = _load(generate_zcml('configure.zcml', package))
+        workflow = namespace['workflow0']
+        content = dummy.Content()
+        self.assertEqual(get_workflow(dummy.IContent, 'security', content),
+                         None)
+        namespace['register']()
+        self.assertTrue(get_workflow(dummy.IContent, 'security', content)
+                        is workflow)
+        self.assertTrue(get_workflow(dummy.IContent2, 'security', content)
+                        is workflow)
+        self.assertEqual(workflow._state_aliases, {'supersecret': 'private'})
+        self.assertEqual(
+            sorted(workflow._transition_data),
+            ['private_to_public', 'public_to_private',
+             'unavailable_public_to_private'])
+
+class TestBuildWorkflow(unittest.TestCase):
+    def test_it(self):
+        from repoze.workflow.codegen import build_workflow
+        transition = {'name': 'go', 'from_state': 'a', 'to_state': 'a'}
+        workflow = build_workflow(
+            {'state_attr': 'state', 'initial_state': 'a'},
+            {'states': {'a': {'callback': None, 'title': 'a'}},
+             'aliases': {}, 'parents': {}, 'ancestors': {},
+             'descendants': {}, 'transitions': {'go': transition},
+             'by_state': {'a': [transition]},
+             'leaving': {'a': [transition]}})
+        self.assertEqual(workflow._leaving('a'), [transition])
+        self.assertEqual(workflow._index[0], 1)
+
+from repoze.workflow.workflow import WorkflowError
+
+def callback(content, info):
+    pass
+
+def checker(permission, context, request):
+    return True
+
+def guard(context, info):
+    context.guarded = getattr(context, 'guarded', 0) + 1
+
+def independent_guard(context, info):
+    pass
+
+def other_guard(context, info):
+    pass
+
+class DummyStore(object):
+    pass
+
+class DummyContent:
+    pass
@@ -0,0 +1,380 @@
+import unittest
+
+from zope.testing.cleanup import cleanUp
+
+class TestMultiprocessingCommandQueue(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow.commands import MultiprocessingCommandQueue
+        return MultiprocessingCommandQueue
+
+    def _makeOne(self, maxsize=0, queue=None):
+        return self._getTargetClass()(maxsize, queue)
+
+    def test_default_queue(self):
+        queue = self._makeOne(2)
+        queue.put(('a', 'security', 'publish'))
+        queue.put(('b', 'security', 'publish'))
+        from repoze.workflow.commands import Full
+        self.assertRaises(Full, queue.put, ('c', 'security', 'publish'),
+                          False)
+        batch = queue.get_batch(10, 5)
+        if len(batch) == 1: # the feeder thread may not have flushed 'b'
+            batch += queue.get_batch(10, 5)
+        self.assertEqual([command.content_key for receipt, command in batch],
+                         ['a', 'b'])
+
+    def test_get_batch(self):
+        from repoze.workflow.commands import Command
+        queue = self._makeOne(queue=DummyQueue())
+        for key in 'abc':
+            queue.put(Command(key, 'security', 'publish'))
+        batch = queue.get_batch(2, 0)
+        self.assertEqual(batch, [(None, Command('a', 'security', 'publish')),
+                                 (None, Command('b', 'security', 'publish'))])
+        queue.ack(batch)
+        self.assertEqual(len(queue.get_batch(2, 0)), 1)
+        self.assertEqual(queue.get_batch(2, 0), [])
+
+class TestSQLiteCommandQueue(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.now = [1000.0]
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _getTargetClass(self):
+        from repoze.workflow.commands import SQLiteCommandQueue
+        return SQLiteCommandQueue
+
+    def _makeOne(self, maxsize=None, lease=60):
+        import os
+        queue = self._getTargetClass()(os.path.join(self.tmpdir, 'q.db'),
+                                       maxsize=maxsize, lease=lease,
+                                       clock=lambda: self.now[0])
+        queue.poll_interval = 0.001
+        return queue
+
+    def test_put_get_ack(self):
+        from repoze.workflow.commands import Command
+        queue = self._makeOne()
+        queue.put(('a', 'security', 'publish'))
+        queue.put(Command(2, 'security', 'retract'))
+        batch = queue.get_batch(10, 0)
+        self.assertEqual([command for receipt, command in batch],
+                         [Command('a', 'security', 'publish'),
+                          Command(2, 'security', 'retract')])
+        self.assertEqual(queue.get_batch(10, 0), [])
+        queue.ack(batch[:1])
+        self.assertEqual(len(queue), 1)
+
+    def test_lease_expiry(self):
+        queue = self._makeOne(lease=10)
+        queue.put(('a', 'security', 'publish'))
+        queue.get_batch(10, 0)
+        self.now[0] += 10
+        self.assertEqual(len(queue.get_batch(10, 0)), 1)
+
+    def test_get_batch_polls(self):
+        queue = self._makeOne()
+        calls = []
+        def claim(limit):
+            calls.append(limit)
+            if len(calls) == 2:
+                return ['command']
+            return []
+        queue._claim = claim
+        self.assertEqual(queue.get_batch(5), ['command'])
+        self.assertEqual(calls, [5, 5])
+
+    def test_claim_rolls_back_on_error(self):
+        queue = self._makeOne()
+        self.assertRaises(Exception, queue._claim, 'bad')
+        self.assertFalse(queue.connection.in_transaction)
+
+    def test_put_full(self):
+        from repoze.workflow.commands import Full
+        queue = self._makeOne(maxsize=1)
+        queue.put(('a', 'security', 'publish'))
+        self.assertRaises(Full, queue.put, ('b', 'security', 'publish'),
+                          False)
+        self.assertRaises(Full, queue.put, ('b', 'security', 'publish'),
+                          True, 0.01)
+
+    def test_put_waits_for_room(self):
+        import threading
+        queue = self._makeOne(maxsize=1)
+        queue.put(('a', 'security', 'publish'))
+        def consume():
+            queue.ack(queue.get_batch(1, 5))
+        thread = threading.Thread(target=consume)
+        thread.start()
+        queue.put(('b', 'security', 'publish'), timeout=5)
+        thread.join()
+        self.assertEqual(len(queue), 1)
+
+class TestCommandConsumer(unittest.TestCase):
+    def setUp(self):
+        cleanUp()
+
+    def tearDown(self):
+        cleanUp()
+
+    def _getTargetClass(self):
+        from repoze.workflow.commands import CommandConsumer
+        return CommandConsumer
+
+    def _makeOne(self, queue, contents, **kw):
+        self.loads = []
+        def loader(keys):
+            self.loads.append(keys)
+            return [contents.get(key) for key in keys]
+        ticks = iter(range(100))
+        kw.setdefault('clock', lambda: next(ticks))
+        return self._getTargetClass()(queue, loader, **kw)
+
+    def _registerWorkflow(self, workflow, type='security', elector=None):
+        from zope.component import getSiteManager
+        from repoze.workflow.interfaces import IWorkflowList
+        sm = getSiteManager()
+        wf_list = sm.adapters.lookup((IDummyContent,), IWorkflowList,
+                                     name=type, default=None)
+        if wf_list is None:
+            wf_list = []
+            sm.registerAdapter(wf_list, (IDummyContent,), IWorkflowList,
+                               name=type)
+        wf_list.append({'workflow': workflow, 'elector': elector})
+
+    def _makeWorkflow(self, name='wf', callbacks=None):
+        from repoze.workflow import Workflow
+        workflow = Workflow('state', 'private', name=name)
+        def callback(content, info):
+            if callbacks is not None:
+                callbacks.append((content.key, info.transition['name']))
+        workflow.add_state('private')
+        workflow.add_state('pending')
+        workflow.add_state('public')
+        workflow.add_transition('submit', 'private', 'pending',
+                                callback=callback)
+        workflow.add_transition('publish', 'pending', 'public',
+                                callback=callback)
+        return workflow
+
+    def test_ctor_bad_batch_size(self):
+        self.assertRaises(ValueError, self._makeOne, DummyCommandQueue(), {},
+                          batch_size=0)
+
+    def test_run_once_empty(self):
+        consumer = self._makeOne(DummyCommandQueue(), {})
+        self.assertEqual(consumer.run_once(), None)
+        self.assertEqual(self.loads, [])
+
+    def test_run_once_coalesces(self):
+        callbacks = []
+        self._registerWorkflow(self._makeWorkflow(callbacks=callbacks))
+        contents = dict([(key, DummyContent(key)) for key in 'abc'])
+        queue = DummyCommandQueue([
+            ('a', 'security', 'submit'),
+            ('b', 'security', 'submit'),
+            ('a', 'security', 'publish'),
+            ('b', 'security', 'submit'),
+            ('c', 'security', 'submit'),
+            ])
+        recorded = []
+        consumer = self._makeOne(queue, contents, on_batch=recorded.append)
+        metrics = consumer.run_once()
+        self.assertEqual(recorded, [metrics])
+        self.assertEqual(self.loads, [['a', 'b', 'c']])
+        self.assertEqual(callbacks, [('a', 'submit'), ('b', 'submit'),
+                                     ('c', 'submit'), ('a', 'publish')])
+        self.assertEqual([contents[key].state for key in 'abc'],
+                         ['public', 'pending', 'pending'])
+        self.assertEqual(queue.acked, [queue.batches[0]])
+        self.assertEqual(metrics.commands, 5)
+        self.assertEqual(metrics.duplicates, 1)
+        self.assertEqual(metrics.groups, 2)
+        self.assertEqual((metrics.succeeded, metrics.failed), (4, 0))
+        self.assertEqual(metrics.load_time, 1)
+        self.assertEqual(metrics.apply_time, 1)
+        self.assertEqual(metrics.total_time, 2)
+
+    def test_run_once_guard_error(self):
+        def guard(content, info):
+            if content.key == 'a':
+                raise RuntimeError('broken')
+        workflow = self._makeWorkflow()
+        workflow.add_transition('check', 'private', 'private',
+                                guards=[guard])
+        self._registerWorkflow(workflow)
+        contents = dict([(key, DummyContent(key)) for key in 'ab'])
+        queue = DummyCommandQueue([('a', 'security', 'check'),
+                                   ('b', 'security', 'check')])
+        metrics = self._makeOne(queue, contents).run_once()
+        self.assertEqual(queue.acked, [queue.batches[0]])
+        self.assertEqual((metrics.succeeded, metrics.failed), (1, 1))
+        (command, error), = metrics.failures
+        self.assertEqual(command.content_key, 'a')
+        self.assertTrue(isinstance(error, RuntimeError))
+
+    def test_run_once_repeated_with_others_between(self):
+        workflow = self._makeWorkflow()
+        workflow.add_transition('retract', 'public', 'pending')
+        self._registerWorkflow(workflow)
+        contents = {'a': DummyContent('a')}
+        contents['a'].state = 'pending'
+        queue = DummyCommandQueue([
+            ('a', 'security', 'publish'),
+            ('a', 'security', 'retract'),
+            ('a', 'security', 'publish'),
+            ])
+        metrics = self._makeOne(queue, contents).run_once()
+        self.assertEqual(contents['a'].state, 'public')
+        self.assertEqual(metrics.duplicates, 0)
+        self.assertEqual((metrics.succeeded, metrics.failed), (3, 0))
+
+    def test_run_once_failures(self):
+        from repoze.workflow import WorkflowError
+        self._registerWorkflow(self._makeWorkflow())
+        contents = {'a': DummyContent('a'), 'x': object()}
+        queue = DummyCommandQueue([
+            ('a', 'security', 'publish'),
+            ('missing', 'security', 'submit'),
+            ('x', 'security', 'submit'),
+            ('a', 'other', 'submit'),
+            ])
+        metrics = self._makeOne(queue, contents).run_once()
+        self.assertEqual(metrics.failed, 4)
+        self.assertEqual(metrics.succeeded, 0)
+        failures = dict([(tuple(command), error)
+                         for command, error in metrics.failures])
+        self.assertTrue(isinstance(failures[('a', 'security', 'publish')],
+                                   WorkflowError))
+        self.assertTrue(isinstance(failures[('missing', 'security',
+                                             'submit')], KeyError))
+        self.assertTrue(isinstance(failures[('x', 'security', 'submit')],
+                                   WorkflowError))
+        self.assertTrue(isinstance(failures[('a', 'other', 'submit')],
+                                   WorkflowError))
+        self.assertEqual(len(queue.acked), 1)
+
+    def test_run_once_groups_by_elected_workflow(self):
+        first_calls, second_calls = [], []
+        first = self._makeWorkflow('first', first_calls)
+        second = self._makeWorkflow('second', second_calls)
+        self._registerWorkflow(first, elector=lambda content:
+                               content.key == 'b')
+        self._registerWorkflow(second)
+        contents = dict([(key, DummyContent(key)) for key in 'abc'])
+        queue = DummyCommandQueue([(key, 'security', 'submit')
+                                   for key in 'abc'])
+        metrics = self._makeOne(queue, contents).run_once()
+        self.assertEqual(metrics.groups, 2)
+        self.assertEqual(first_calls, [('b', 'submit')])
+        self.assertEqual(second_calls, [('a', 'submit'), ('c', 'submit')])
+
+    def test_run_once_non_bulk_workflow(self):
+        from repoze.workflow.testing import DummyWorkflow
+        workflow = DummyWorkflow()
+        self._registerWorkflow(workflow)
+        failing = DummyWorkflow()
+        def transition(*arg):
+            raise ValueError('broken')
+        failing.transition = transition
+        self._registerWorkflow(failing, type='other')
+        contents = {'a': DummyContent('a')}
+        request = object()
+        queue = DummyCommandQueue([('a', 'security', 'publish'),
+                                   ('a', 'other', 'publish')])
+        metrics = self._makeOne(queue, contents, request=request).run_once()
+        self.assertEqual(workflow.executed, [
+            {'content': contents['a'], 'request': request, 'name': 'publish',
+             'guards': (), 'context': None}])
+        self.assertEqual(metrics.succeeded, 1)
+        (command, error), = metrics.failures
+        self.assertEqual(command.workflow_type, 'other')
+
+    def test_run(self):
+        self._registerWorkflow(self._makeWorkflow())
+        contents = dict([(key, DummyContent(key)) for key in 'abc'])
+        queue = DummyCommandQueue([(key, 'security', 'submit')
+                                   for key in 'abc'])
+        self._makeOne(queue, contents, batch_size=2,
+                      clock=lambda: 0).run()
+        self.assertEqual([len(batch) for batch in queue.acked], [2, 1])
+        self.assertEqual(self.loads, [['a', 'b'], ['c']])
+
+    def test_run_until_stopped(self):
+        import threading
+        stop = threading.Event()
+        consumer = self._makeOne(DummyCommandQueue(), {})
+        timeouts = []
+        def run_once(timeout):
+            timeouts.append(timeout)
+            if len(timeouts) == 2:
+                stop.set()
+        consumer.run_once = run_once
+        consumer.run(stop, 0.1)
+        self.assertEqual(timeouts, [0.1, 0.1])
+
+    def test_with_sqlite_queue(self):
+        import os
+        import shutil
+        import tempfile
+        from repoze.workflow.commands import SQLiteCommandQueue
+        self._registerWorkflow(self._makeWorkflow())
+        tmpdir = tempfile.mkdtemp()
+        try:
+            queue = SQLiteCommandQueue(os.path.join(tmpdir, 'q.db'))
+            for key in 'ab':
+                queue.put((key, 'security', 'submit'))
+            contents = dict([(key, DummyContent(key)) for key in 'ab'])
+            metrics = self._makeOne(queue, contents).run_once(0)
+            self.assertEqual(metrics.succeeded, 2)
+            self.assertEqual(len(queue), 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+from zope.interface import Interface
+from zope.interface import implementer
+
+class IDummyContent(Interface):
+    pass
+
+@implementer(IDummyContent)
+class DummyContent:
+    def __init__(self, key):
+        self.key = key
+
+class DummyQueue:
+    def __init__(self):
+        self.items = []
+
+    def put(self, item, block, timeout):
+        self.items.append(item)
+
+    def get(self, block, timeout):
+        from repoze.workflow.commands import Empty
+        if not self.items:
+            raise Empty
+        return self.items.pop(0)
+
+    def get_nowait(self):
+        return self.get(False, None)
+
+class DummyCommandQueue:
+    def __init__(self, commands=()):
+        from repoze.workflow.commands import Command
+        self.commands = [Command(*command) for command in commands]
+        self.batches = []
+        self.acked = []
+
+    def get_batch(self, limit, timeout):
+        batch = [(None, command) for command in self.commands[:limit]]
+        del self.commands[:limit]
+        self.batches.append(batch)
+        return batch
+
+    def ack(self, batch):
+        self.acked.append(batch)
@@ -0,0 +1,213 @@
+import unittest
+
+from zope.testing.cleanup import cleanUp
+
+class TestCompositeWorkflow(unittest.TestCase):
+    def setUp(self):
+        cleanUp()
+
+    def tearDown(self):
+        cleanUp()
+
+    def _getTargetClass(self):
+        from repoze.workflow.composite import CompositeWorkflow
+        return CompositeWorkflow
+
+    def _makeOne(self, regions=None, guards=()):
+        if regions is None:
+            regions = [('editorial', self._makeEditorial()),
+                       ('legal', self._makeLegal())]
+        return self._getTargetClass()(regions, 'doc', 'Document', guards)
+
+    def _makeEditorial(self, state_attr='editorial', permission_checker=None):
+        from repoze.workflow import Workflow
+        workflow = Workflow(state_attr, 'draft',
+                            permission_checker=permission_checker)
+        workflow.add_state('draft')
+        workflow.add_state('published')
+        workflow.add_transition('publish', 'draft', 'published')
+        workflow.add_transition('retract', 'published', 'draft')
+        return workflow
+
+    def _makeLegal(self):
+        from repoze.workflow import Workflow
+        workflow = Workflow('legal', 'unchecked')
+        workflow.add_state('unchecked')
+        workflow.add_state('cleared')
+        workflow.add_transition('clear', 'unchecked', 'cleared')
+        workflow.add_transition('retract', 'cleared', 'unchecked')
+        return workflow
+
+    def test_class_conforms_to_ICompositeWorkflow(self):
+        from zope.interface.verify import verifyClass
+        from repoze.workflow.interfaces import ICompositeWorkflow
+        verifyClass(ICompositeWorkflow, self._getTargetClass())
+
+    def test_ctor(self):
+        composite = self._makeOne()
+        self.assertEqual(list(composite.regions), ['editorial', 'legal'])
+        self.assertEqual(composite.name, 'doc')
+        self.assertEqual(composite.description, 'Document')
+        self.assertTrue(composite(None) is composite)
+
+    def test_ctor_no_regions(self):
+        from repoze.workflow import WorkflowError
+        self.assertRaises(WorkflowError, self._makeOne, [])
+
+    def test_ctor_shared_state_attr(self):
+        from repoze.workflow import WorkflowError
+        regions = [('a', self._makeEditorial()), ('b', self._makeEditorial())]
+        self.assertRaises(WorkflowError, self._makeOne, regions)
+
+    def test_check(self):
+        from repoze.workflow import WorkflowError
+        composite = self._makeOne()
+        composite.check()
+        composite.regions['legal'].initial_state = 'missing'
+        self.assertRaises(WorkflowError, composite.check)
+
+    def test_state_of_and_has_state(self):
+        composite = self._makeOne()
+        ob = DummyContent()
+        self.assertFalse(composite.has_state(ob))
+        self.assertEqual(dict(composite.state_of(ob, peek=True)),
+                         {'editorial': 'draft', 'legal': 'unchecked'})
+        self.assertFalse(composite.has_state(ob))
+        self.assertEqual(list(composite.state_of(ob).items()),
+                         [('editorial', 'draft'), ('legal', 'unchecked')])
+        self.assertTrue(composite.has_state(ob))
+
+    def test_initialize(self):
+        composite = self._makeOne()
+        ob = DummyContent()
+        states, messages = composite.initialize(ob)
+        self.assertEqual(dict(states),
+                         {'editorial': 'draft', 'legal': 'unchecked'})
+        self.assertEqual(dict(messages), {'editorial': None, 'legal': None})
+
+    def test_get_transitions(self):
+        def checker(permission, context, request):
+            return False
+        editorial = self._makeEditorial(permission_checker=checker)
+        editorial._transition_data['publish']['permission'] = 'publish'
+        composite = self._makeOne([('editorial', editorial),
+                                   ('legal', self._makeLegal())])
+        ob = DummyContent()
+        transitions = composite.get_transitions(ob, object(), peek=True)
+        self.assertEqual([(t['region'], t['name']) for t in transitions],
+                         [('legal', 'clear')])
+        self.assertFalse('region' in
+                         composite.regions['legal']._transition_data['clear'])
+
+    def test_state_info(self):
+        composite = self._makeOne()
+        ob = DummyContent()
+        info = composite.state_info(ob, None)
+        self.assertEqual([(state['region'], state['name'], state['current'])
+                          for state in info],
+                         [('editorial', 'draft', True),
+                          ('editorial', 'published', False),
+                          ('legal', 'unchecked', True),
+                          ('legal', 'cleared', False)])
+
+    def test_transition_finds_region(self):
+        composite = self._makeOne()
+        ob = DummyContent()
+        composite.transition(ob, None, 'clear')
+        self.assertEqual(ob.legal, 'cleared')
+        self.assertFalse(hasattr(ob, 'editorial'))
+
+    def test_transition_ambiguous_or_unknown(self):
+        from repoze.workflow import WorkflowError
+        composite = self._makeOne()
+        ob = DummyContent()
+        self.assertRaises(WorkflowError, composite.transition, ob, None,
+                          'retract')
+        self.assertRaises(WorkflowError, composite.transition, ob, None,
+                          'missing')
+        self.assertRaises(WorkflowError, composite.transition, ob, None,
+                          'retract', region='missing')
+
+    def test_transition_with_region(self):
+        composite = self._makeOne()
+        ob = DummyContent()
+        composite.transition(ob, None, 'clear')
+        composite.transition(ob, None, 'retract', region='legal',
+                             idempotency_key='k')
+        self.assertEqual(ob.legal, 'unchecked')
+        ob.legal = 'cleared'
+        composite.transition(ob, None, 'retract', region='legal',
+                             idempotency_key='k')
+        self.assertEqual(ob.legal, 'cleared')
+
+    def test_joint_guards(self):
+        from repoze.workflow import WorkflowError
+        calls = []
+        def cleared_before_publish(context, region, transition, states):
+            calls.append((context, region, transition['name'], dict(states)))
+            if (transition['name'] == 'publish' and
+                states['legal'] != 'cleared'):
+                raise WorkflowError('not cleared')
+        composite = self._makeOne(guards=[cleared_before_publish])
+        ob = DummyContent()
+        self.assertRaises(WorkflowError, composite.transition, ob, None,
+                          'publish')
+        self.assertEqual(ob.editorial, 'draft')
+        self.assertFalse(hasattr(ob, 'legal'))
+        composite.transition(ob, None, 'clear')
+        composite.transition(ob, None, 'publish',
+                             guards=[lambda context, info:
+                                     calls.append(context)])
+        self.assertEqual(ob.editorial, 'published')
+        self.assertEqual(calls[0], (ob, 'editorial', 'publish',
+                                    {'editorial': 'draft',
+                                     'legal': 'unchecked'}))
+        self.assertEqual(calls[1][1:3], ('legal', 'clear'))
+        self.assertEqual(calls[2][1:3], ('editorial', 'publish'))
+        self.assertEqual(calls[3], ob)
+
+    def test_joint_guards_order(self):
+        calls = []
+        def region_guard(context, info):
+            calls.append('region')
+        def joint(context, region, transition, states):
+            calls.append('joint')
+        def caller_guard(context, info):
+            calls.append('caller')
+        editorial = self._makeEditorial()
+        editorial.add_transition('review', 'draft', 'draft',
+                                 guards=[region_guard])
+        composite = self._makeOne([('editorial', editorial)], [joint])
+        composite.transition(DummyContent(), None, 'review',
+                             guards=[caller_guard])
+        self.assertEqual(calls, ['region', 'joint', 'caller'])
+
+    def test_transition_to_state(self):
+        from repoze.workflow import WorkflowError
+        def never(context, region, transition, states):
+            raise WorkflowError('never')
+        composite = self._makeOne()
+        ob = DummyContent()
+        composite.transition_to_state(ob, None, 'published', 'editorial')
+        self.assertEqual(ob.editorial, 'published')
+        composite.guards.append(never)
+        self.assertRaises(WorkflowError, composite.transition_to_state, ob,
+                          None, 'cleared', 'legal')
+        composite.transition_to_state(ob, None, 'published', 'editorial')
+
+    def test_single_lookup(self):
+        from repoze.workflow import get_workflow
+        from repoze.workflow.zcml import register_workflow
+        composite = self._makeOne()
+        register_workflow(composite, 'review', IDummyContent, None)
+        self.assertTrue(get_workflow(DummyContent(), 'review') is composite)
+
+from zope.interface import Interface
+from zope.interface import implementer
+
+class IDummyContent(Interface):
+    pass
+
+@implementer(IDummyContent)
+class DummyContent:
+    pass
@@ -0,0 +1,92 @@
+import unittest
+
+class TestDeferredCallbackQueue(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow.deferred import DeferredCallbackQueue
+        return DeferredCallbackQueue
+
+    def _makeOne(self):
+        return self._getTargetClass()()
+
+    def test_put_is_pending_until_commit(self):
+        called = []
+        queue = self._makeOne()
+        queue.put(lambda content, info: called.append(content), 'a', None)
+        self.assertEqual(queue.pending(), 1)
+        self.assertEqual(queue.drain(), [])
+        self.assertEqual(called, [])
+        queue.commit()
+        self.assertEqual(queue.pending(), 0)
+        self.assertEqual(queue.drain(), [])
+        self.assertEqual(called, ['a'])
+
+    def test_abort(self):
+        called = []
+        queue = self._makeOne()
+        queue.put(lambda content, info: called.append(content), 'a', None)
+        queue.abort()
+        queue.commit()
+        queue.drain()
+        self.assertEqual(called, [])
+
+    def test_pending_is_per_thread(self):
+        import threading
+        queue = self._makeOne()
+        queue.put(None, 'a', None)
+        counts = []
+        thread = threading.Thread(target=lambda: counts.append(
+            queue.pending()))
+        thread.start()
+        thread.join()
+        self.assertEqual(counts, [0])
+        self.assertEqual(queue.pending(), 1)
+
+    def test_drain_reports_failures_in_order(self):
+        called = []
+        def callback(content, info):
+            called.append((content, info))
+            if content == 'bad':
+                raise ValueError(content)
+        queue = self._makeOne()
+        for content in ('a', 'bad', 'c'):
+            queue.put(callback, content, 'info')
+        queue.commit()
+        failures = queue.drain()
+        self.assertEqual([c for c, i in called], ['a', 'bad', 'c'])
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(failures[0][:2], (callback, 'bad'))
+        self.assertEqual(failures[0][2].__class__, ValueError)
+        self.assertEqual(queue.failures, failures)
+
+    def test_worker(self):
+        import threading
+        done = threading.Event()
+        called = []
+        def callback(content, info):
+            called.append(content)
+            done.set()
+        queue = self._makeOne()
+        queue.start()
+        queue.start()
+        try:
+            queue.put(callback, 'a', None)
+            queue.commit()
+            self.assertTrue(done.wait(5))
+        finally:
+            queue.stop(5)
+        self.assertEqual(called, ['a'])
+        self.assertEqual(queue._worker, None)
+
+    def test_stop_runs_ready_callbacks(self):
+        called = []
+        queue = self._makeOne()
+        queue.start()
+        queue.put(lambda content, info: called.append(content), 'a', None)
+        queue.commit()
+        queue.stop(5)
+        self.assertEqual(called, ['a'])
+
+    def test_stop_not_started(self):
+        queue = self._makeOne()
+        queue.stop()
+        self.assertEqual(queue._worker, None)
@@ -0,0 +1,69 @@
+import unittest
+
+class Test_dotted_name(unittest.TestCase):
+    def _callFUT(self, ob):
+        from repoze.workflow._dotted import dotted_name
+        return dotted_name(ob)
+
+    def test_function(self):
+        self.assertEqual(self._callFUT(module_function),
+                         'repoze.workflow.tests.test_dotted.module_function')
+
+    def test_nested_attribute(self):
+        self.assertEqual(self._callFUT(Namespace.method),
+                         'repoze.workflow.tests.test_dotted.Namespace.method')
+
+    def test_lambda(self):
+        self.assertRaises(ValueError, self._callFUT, lambda: None)
+
+    def test_local_function(self):
+        def local():
+            pass
+        self.assertRaises(ValueError, self._callFUT, local)
+
+    def test_no_name(self):
+        self.assertRaises(ValueError, self._callFUT, object())
+
+    def test_rebound_name(self):
+        self.assertRaises(ValueError, self._callFUT, original_replaced)
+
+class Test_resolve(unittest.TestCase):
+    def _callFUT(self, dotted):
+        from repoze.workflow._dotted import resolve
+        return resolve(dotted)
+
+    def test_dotted(self):
+        self.assertTrue(self._callFUT(
+            'repoze.workflow.tests.test_dotted.Namespace.method')
+            is Namespace.method)
+
+    def test_colon(self):
+        self.assertTrue(self._callFUT(
+            'repoze.workflow.tests.test_dotted:Namespace.method')
+            is Namespace.method)
+
+    def test_module(self):
+        import repoze.workflow
+        self.assertTrue(self._callFUT('repoze.workflow') is repoze.workflow)
+
+    def test_missing_module(self):
+        self.assertRaises(ImportError, self._callFUT, 'nonexistent_module.x')
+
+    def test_missing_attribute(self):
+        self.assertRaises(AttributeError, self._callFUT,
+                          'repoze.workflow.tests.test_dotted.nonexistent')
+
+def module_function():
+    pass
+
+class Namespace:
+    def method(self):
+        pass
+
+def replaced(): # pragma: no cover
+    pass
+
+original_replaced = replaced
+
+def replaced(): # pragma: no cover
+    pass
@@ -0,0 +1,343 @@
+import unittest
+
+class TestExpressionGuard(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow.guards import ExpressionGuard
+        return ExpressionGuard
+
+    def _makeOne(self, expression):
+        return self._getTargetClass()(expression)
+
+    def test_passes(self):
+        guard = self._makeOne(
+            "context.locked == False and request.user in context.editors "
+            "and transition['name'] != 'delete' and workflow.name == 'wf'")
+        context = DummyContent(locked=False, editors=('bob',))
+        info = DummyInfo(request=DummyContent(user='bob'))
+        self.assertEqual(guard(context, info), None)
+        self.assertEqual(len(guard.conditions), 4)
+
+    def test_vetoes(self):
+        from repoze.workflow import WorkflowError
+        guard = self._makeOne('context.size >= 10 or not context.small')
+        self.assertEqual(len(guard.conditions), 1)
+        guard(DummyContent(size=10, small=True), DummyInfo())
+        self.assertRaises(WorkflowError, guard,
+                          DummyContent(size=-1, small=True), DummyInfo())
+
+    def test_literals(self):
+        guard = self._makeOne(
+            "context.tags[0] in ('a', 'b') and context.n != -1 "
+            "and context.none is None and context.none is not True "
+            "and context.x < 2 and context.x <= 1 and context.x > 0 "
+            "and 'z' not in ['x']")
+        guard(DummyContent(tags=['a'], n=1, none=None, x=1), DummyInfo())
+
+    def test_repr(self):
+        self.assertEqual(repr(self._makeOne('context.ready')),
+                         "<ExpressionGuard 'context.ready'>")
+
+    def test_pickle(self):
+        import pickle
+        guard = self._makeOne('context.ready')
+        copy = pickle.loads(pickle.dumps(guard))
+        self.assertEqual(copy.expression, 'context.ready')
+        self.assertEqual(copy.conditions, guard.conditions) # interned
+
+    def test_syntax_error(self):
+        from repoze.workflow import WorkflowError
+        self.assertRaises(WorkflowError, self._makeOne, 'context.ready ==')
+
+    def test_rejects_calls(self):
+        from repoze.workflow import WorkflowError
+        self.assertRaises(WorkflowError, self._makeOne, 'context.delete()')
+
+    def test_rejects_unknown_names(self):
+        from repoze.workflow import WorkflowError
+        self.assertRaises(WorkflowError, self._makeOne, 'open == 1')
+
+    def test_rejects_private_attributes(self):
+        from repoze.workflow import WorkflowError
+        self.assertRaises(WorkflowError, self._makeOne,
+                          'context.__class__ == 1')
+
+    def test_conditions_interned(self):
+        first = self._makeOne('context.ready and context.size > 1')
+        second = self._makeOne('context.size > 1 and  context.ok')
+        self.assertTrue(first.conditions[1] is second.conditions[0])
+
+    def test_conditions_bounded(self):
+        from repoze.workflow import guards
+        first = self._makeOne('context.ready')
+        for i in range(guards.CONDITIONS):
+            self._makeOne('context.size > %d' % i)
+        self.assertEqual(len(guards._conditions), guards.CONDITIONS)
+        second = self._makeOne('context.ready')
+        self.assertFalse(first.conditions[0] is second.conditions[0])
+        first(DummyContent(ready=True), DummyInfo())
+
+class Test_compile_guard(unittest.TestCase):
+    def _callFUT(self, guard):
+        from repoze.workflow.guards import compile_guard
+        return compile_guard(guard)
+
+    def test_string(self):
+        from repoze.workflow.guards import ExpressionGuard
+        self.assertTrue(isinstance(self._callFUT('context.ready'),
+                                   ExpressionGuard))
+
+    def test_callable(self):
+        self.assertTrue(self._callFUT(len) is len)
+
+class Test_shared_conditions(unittest.TestCase):
+    def _callFUT(self, memo=None):
+        from repoze.workflow.guards import shared_conditions
+        return shared_conditions(memo)
+
+    def test_memoizes_conditions_not_using_transition(self):
+        from repoze.workflow.guards import ExpressionGuard
+        guard = ExpressionGuard("context.count and transition['ok']")
+        context = CountingContent()
+        info = DummyInfo(transition={'ok': True})
+        with self._callFUT():
+            with self._callFUT():
+                guard(context, info)
+            guard(context, info)
+            guard(context, DummyInfo(request=object(),
+                                     transition={'ok': True}))
+        guard(context, info)
+        self.assertEqual(context.counted, 3)
+
+    def test_memo(self):
+        from repoze.workflow.guards import ExpressionGuard
+        guard = ExpressionGuard('context.count')
+        context = CountingContent()
+        info = DummyInfo()
+        memo = {}
+        with self._callFUT(memo):
+            guard(context, info)
+        with self._callFUT():
+            with self._callFUT(memo):
+                guard(context, info)
+            guard(context, info)
+        self.assertEqual(context.counted, 2)
+        self.assertEqual(len(memo), 1)
+
+    def test_transition_to_state_evaluates_shared_condition_once(self):
+        from repoze.workflow import Workflow
+        workflow = Workflow('state', 'private')
+        workflow.add_state('private')
+        workflow.add_state('public')
+        workflow.add_transition('first', 'private', 'public',
+                                guards=["context.count and "
+                                        "transition['name'] == 'second'"])
+        workflow.add_transition('second', 'private', 'public',
+                                guards=['context.count'])
+        context = CountingContent()
+        workflow.transition_to_state(context, None, 'public')
+        self.assertEqual(context.state, 'public')
+        self.assertEqual(context.counted, 1)
+
+    def test_transition_to_state_callbacks_not_memoized(self):
+        from repoze.workflow import Workflow
+        from repoze.workflow import WorkflowError
+        other = Workflow('other_state', 'closed')
+        other.add_state('closed')
+        other.add_state('open')
+        other.add_transition('go', 'closed', 'open',
+                             guards=['context.locked == False'])
+        def lock(content, info):
+            content.locked = True
+            other.transition(content, None, 'go')
+        workflow = Workflow('state', 'private')
+        workflow.add_state('private')
+        workflow.add_state('public')
+        workflow.add_transition('publish', 'private', 'public', lock,
+                                guards=['context.locked == False'])
+        context = DummyContent(locked=False)
+        self.assertRaises(WorkflowError, workflow.transition_to_state,
+                          context, None, 'public')
+        self.assertEqual(context.other_state, 'closed')
+
+    def test_transition_to_state_forgets_after_callbacks(self):
+        from repoze.workflow import Workflow
+        from repoze.workflow import WorkflowError
+        def fail(content, info):
+            raise WorkflowError('failed')
+        workflow = Workflow('state', 'private', deterministic=True)
+        workflow.add_state('private')
+        workflow.add_state('public')
+        workflow.add_transition('first', 'private', 'public', fail,
+                                guards=['context.count'])
+        workflow.add_transition('second', 'private', 'public',
+                                guards=['context.count'])
+        context = CountingContent()
+        workflow.transition_to_state(context, None, 'public')
+        self.assertEqual(context.state, 'public')
+        self.assertEqual(context.counted, 2)
+
+class Test_order_independent(unittest.TestCase):
+    def _callFUT(self, guard):
+        from repoze.workflow.guards import order_independent
+        return order_independent(guard)
+
+    def test_function_not_changed(self):
+        def guard(context, info): # pragma: no cover
+            pass
+        marked = self._callFUT(guard)
+        self.assertTrue(marked.guard is guard)
+        self.assertTrue(marked.order_independent)
+        self.assertFalse(hasattr(guard, 'order_independent'))
+        self.assertTrue(self._callFUT(marked) is marked)
+
+    def test_wraps(self):
+        recorder = Recorder()
+        marked = self._callFUT(recorder.record)
+        self.assertTrue(marked.order_independent)
+        marked('context', 'info')
+        self.assertEqual(recorder.calls, [('context', 'info')])
+        self.assertTrue(repr(marked).startswith('<order independent'))
+
+    def test_expression_guards_are_order_independent(self):
+        from repoze.workflow.guards import ExpressionGuard
+        self.assertTrue(ExpressionGuard('context.ready').order_independent)
+
+class TestGuardStats(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow.guards import GuardStats
+        return GuardStats
+
+    def _makeOne(self, maxsize=1024):
+        self.now = [0.0]
+        return self._getTargetClass()(maxsize, clock=lambda: self.now[0])
+
+    def _makeGuard(self, name, cost, veto, calls):
+        from repoze.workflow import WorkflowError
+        from repoze.workflow.guards import order_independent
+        def guard(context, info):
+            calls.append(name)
+            self.now[0] += cost
+            if veto(context):
+                raise WorkflowError(name)
+        guard.__name__ = name
+        return order_independent(guard)
+
+    def test_default_clock(self):
+        stats = self._getTargetClass()()
+        self.assertTrue(callable(stats.clock))
+
+    def test_reorders_cheap_frequent_vetoes_first(self):
+        from repoze.workflow import WorkflowError
+        calls = []
+        stats = self._makeOne()
+        slow = self._makeGuard('slow', 10.0, lambda context: False, calls)
+        cheap = self._makeGuard('cheap', 1.0, lambda context: context, calls)
+        def dependent(context, info):
+            calls.append('dependent')
+        guards = [dependent, slow, cheap]
+        stats.run(guards, False, None)
+        self.assertEqual(calls, ['slow', 'cheap', 'dependent'])
+        del calls[:]
+        self.assertRaises(WorkflowError, stats.run, guards, True, None)
+        self.assertEqual(calls, ['cheap'])
+        result = stats.stats()
+        self.assertEqual([item['guard'] for item in result], [cheap, slow])
+        self.assertEqual(result[0]['calls'], 2)
+        self.assertEqual(result[0]['vetoes'], 1)
+        self.assertEqual(result[0]['veto_rate'], 0.5)
+        self.assertEqual(result[0]['mean_time'], 1.0)
+        self.assertEqual(result[1]['score'], 10.0 / 0.5 * 1.5)
+
+    def test_unobserved_guards_first(self):
+        calls = []
+        stats = self._makeOne()
+        known = self._makeGuard('known', 1.0, lambda context: False, calls)
+        stats.run([known], None, None)
+        new = self._makeGuard('new', 5.0, lambda context: False, calls)
+        del calls[:]
+        stats.run([known, new], None, None)
+        self.assertEqual(calls, ['new', 'known'])
+
+    def test_freeze(self):
+        calls = []
+        stats = self._makeOne()
+        slow = self._makeGuard('slow', 10.0, lambda context: False, calls)
+        cheap = self._makeGuard('cheap', 1.0, lambda context: False, calls)
+        new = self._makeGuard('new', 5.0, lambda context: False, calls)
+        stats.run([slow, cheap], None, None)
+        before = stats.stats()
+        stats.freeze()
+        del calls[:]
+        stats.run([slow, new, cheap], None, None)
+        self.assertEqual(calls, ['new', 'cheap', 'slow'])
+        self.assertEqual(stats.stats(), before)
+
+    def test_stats_unobserved_and_reset(self):
+        stats = self._makeOne()
+        def guard(context, info): # pragma: no cover
+            pass
+        stats._entry(guard)
+        item, = stats.stats()
+        self.assertEqual((item['veto_rate'], item['mean_time']), (0.0, 0.0))
+        stats.reset()
+        self.assertEqual(stats.stats(), [])
+
+    def test_bounded(self):
+        calls = []
+        stats = self._makeOne(maxsize=1)
+        first = self._makeGuard('first', 1.0, lambda context: False, calls)
+        second = self._makeGuard('second', 1.0, lambda context: False, calls)
+        stats.run([first, second], None, None)
+        self.assertEqual(len(stats.stats()), 1)
+
+    def test_workflow_adaptive_guards(self):
+        from repoze.workflow import Workflow
+        from repoze.workflow import WorkflowError
+        from repoze.workflow.guards import GuardStats
+        self.now = [0.0]
+        workflow = Workflow('state', 'private', adaptive_guards=True)
+        self.assertTrue(isinstance(workflow.guard_stats, GuardStats))
+        calls = []
+        slow = self._makeGuard('slow', 0, lambda context: False, calls)
+        workflow.add_state('private')
+        workflow.add_state('public')
+        workflow.add_transition('publish', 'private', 'public',
+                                guards=[slow, 'context.ready'])
+        ob = DummyContent(ready=False)
+        self.assertRaises(WorkflowError, workflow.transition, ob, None,
+                          'publish')
+        ob.ready = True
+        workflow.transition(ob, None, 'publish', guards=[slow])
+        self.assertEqual(ob.state, 'public')
+        self.assertEqual(sum([item['calls']
+                              for item in workflow.guard_stats.stats()]), 5)
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+
+    def record(self, context, info):
+        self.calls.append((context, info))
+
+class CountingContent:
+    counted = 0
+
+    @property
+    def count(self):
+        self.counted += 1
+        return True
+
+class DummyContent:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class DummyWorkflow:
+    name = 'wf'
+
+class DummyInfo:
+    def __init__(self, request=None, transition=None):
+        self.request = request
+        if transition is None:
+            transition = {'name': 'publish'}
+        self.transition = transition
+        self.workflow = DummyWorkflow()
@@ -0,0 +1,134 @@
+import unittest
+
+class TestIdempotencyCache(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow.idempotency import IdempotencyCache
+        return IdempotencyCache
+
+    def _makeOne(self, maxsize=10000, ttl=None, backend=None, clock=None):
+        if clock is None:
+            return self._getTargetClass()(maxsize, ttl, backend)
+        return self._getTargetClass()(maxsize, ttl, backend, clock)
+
+    def _done(self, cache, key):
+        self.assertTrue(cache.claim(key))
+        cache.done(key)
+
+    def test_claim(self):
+        cache = self._makeOne()
+        self.assertTrue(cache.claim('a'))
+        self.assertFalse('a' in cache)
+        cache.done('a')
+        self.assertFalse(cache.claim('a'))
+        self.assertTrue('a' in cache)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.duplicates, 1)
+
+    def test_claim_under_way(self):
+        from repoze.workflow import TransitionInProgress
+        from repoze.workflow import WorkflowError
+        cache = self._makeOne()
+        cache.claim('a')
+        self.assertRaises(TransitionInProgress, cache.claim, 'a')
+        self.assertTrue(issubclass(TransitionInProgress, WorkflowError))
+        self.assertEqual(cache.duplicates, 0)
+        cache.done('a')
+        self.assertFalse(cache.claim('a'))
+
+    def test_release(self):
+        cache = self._makeOne()
+        cache.claim('a')
+        cache.release('a')
+        self.assertFalse('a' in cache)
+        self.assertTrue(cache.claim('a'))
+
+    def test_bounded(self):
+        cache = self._makeOne(maxsize=1)
+        self._done(cache, 'a')
+        self._done(cache, 'b')
+        self.assertTrue(cache.claim('a'))
+
+    def test_ttl(self):
+        now = [0]
+        cache = self._makeOne(ttl=10, clock=lambda: now[0])
+        self._done(cache, 'a')
+        now[0] = 10
+        self.assertTrue(cache.claim('a'))
+
+    def test_backend_detects_evicted_keys(self):
+        backend = DummyBackend()
+        cache = self._makeOne(maxsize=1, backend=backend)
+        self._done(cache, 'a')
+        self._done(cache, 'b')
+        self.assertTrue('a' in cache)
+        self.assertFalse(cache.claim('a'))
+        self.assertFalse(cache.claim('a'))
+        self.assertEqual(cache.duplicates, 2)
+        self.assertEqual(backend.keys, set(['a', 'b']))
+
+    def test_backend_release(self):
+        backend = DummyBackend()
+        cache = self._makeOne(backend=backend)
+        cache.claim('a')
+        cache.release('a')
+        self.assertEqual(backend.keys, set())
+
+class TestSQLiteIdempotencyBackend(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow.idempotency import SQLiteIdempotencyBackend
+        return SQLiteIdempotencyBackend
+
+    def _makeOne(self, connection=':memory:', table='workflow_idempotency'):
+        return self._getTargetClass()(connection, table)
+
+    def test_ctor_with_connection(self):
+        import sqlite3
+        connection = sqlite3.connect(':memory:')
+        backend = self._makeOne(connection, 'keys')
+        self.assertTrue(backend.connection is connection)
+        rows = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+        self.assertEqual(rows, [('keys',)])
+
+    def test_add_discard(self):
+        backend = self._makeOne()
+        self.assertTrue(backend.add('a'))
+        self.assertFalse(backend.add('a'))
+        self.assertTrue('a' in backend)
+        backend.discard('a')
+        self.assertFalse('a' in backend)
+
+    def test_shared_between_caches(self):
+        import os
+        import shutil
+        import tempfile
+        from repoze.workflow.idempotency import IdempotencyCache
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'keys.db')
+            first = IdempotencyCache(backend=self._makeOne(path))
+            second = IdempotencyCache(backend=self._makeOne(path))
+            self.assertTrue(first.claim('a'))
+            # written when done
+            self.assertTrue(second.claim('a'))
+            second.release('a')
+            first.done('a')
+            self.assertFalse(second.claim('a'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+class DummyBackend:
+    def __init__(self):
+        self.keys = set()
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def add(self, key):
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def discard(self, key):
+        self.keys.discard(key)
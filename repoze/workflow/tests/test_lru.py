@@ -0,0 +1,73 @@
+import unittest
+
+class TestLRUCache(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow._lru import LRUCache
+        return LRUCache
+
+    def _makeOne(self, maxsize=2, ttl=None, clock=None):
+        if clock is None:
+            return self._getTargetClass()(maxsize, ttl)
+        return self._getTargetClass()(maxsize, ttl, clock)
+
+    def test_ctor_bad_maxsize(self):
+        self.assertRaises(ValueError, self._makeOne, 0)
+
+    def test_get_missing(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('a', 1), 1)
+        self.assertFalse('a' in cache)
+
+    def test_set_get(self):
+        cache = self._makeOne()
+        cache.set('a', None)
+        self.assertTrue('a' in cache)
+        self.assertEqual(cache.get('a', 1), None)
+        self.assertEqual(len(cache), 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = self._makeOne()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl(self):
+        now = [100]
+        cache = self._makeOne(ttl=10, clock=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 109
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 110
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_pop(self):
+        cache = self._makeOne()
+        cache.set('a', 1)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertEqual(cache.pop('a', 2), 2)
+
+    def test_clear(self):
+        cache = self._makeOne()
+        cache.set('a', 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_items(self):
+        now = [100]
+        cache = self._makeOne(maxsize=3, ttl=10, clock=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 105
+        cache.set('b', 2)
+        cache.set('c', 3)
+        cache.get('b')
+        now[0] = 110
+        self.assertEqual(cache.items(), [('c', 3), ('b', 2)])
+        cache.set('d', 4)
+        self.assertEqual(cache.evictions, 1)
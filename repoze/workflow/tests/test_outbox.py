@@ -0,0 +1,332 @@
+import unittest
+
+class OutboxTestBase(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+        self.now = [1000.0]
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, name='outbox.db'):
+        import os
+        return os.path.join(self.tmpdir, name)
+
+    def _clock(self):
+        return self.now[0]
+
+class TestSQLiteOutbox(OutboxTestBase):
+    def _getTargetClass(self):
+        from repoze.workflow.outbox import SQLiteOutbox
+        return SQLiteOutbox
+
+    def _makeOne(self, key=None):
+        return self._getTargetClass()(self._path(), key, clock=self._clock)
+
+    def test_wal_mode(self):
+        outbox = self._makeOne()
+        mode = outbox.connection.execute('PRAGMA journal_mode').fetchone()
+        self.assertEqual(mode, ('wal',))
+
+    def test_put_from_workflow_transition(self):
+        from repoze.workflow import Workflow
+        outbox = self._makeOne(key=lambda content: content.id)
+        workflow = Workflow('state', 'private', name='wf',
+                            deferred_queue=outbox)
+        workflow.add_state('private')
+        workflow.add_state('public', notify, deferred=True)
+        workflow.add_transition('publish', 'private', 'public')
+        ob = DummyContent(id='doc1')
+        workflow.transition(ob, None, 'publish')
+        self.assertEqual(ob.state, 'public')
+        self.assertEqual(outbox.pending(), 1)
+        self.assertEqual(len(outbox), 0)
+        outbox.commit()
+        self.assertEqual(outbox.pending(), 0)
+        self.assertEqual(len(outbox), 1)
+        job, = outbox.claim('me', 10, 60)
+        self.assertEqual(job.workflow, 'wf')
+        self.assertEqual(job.transition, 'publish')
+        self.assertEqual(job.content_key, 'doc1')
+        self.assertEqual(job.callback,
+                         'repoze.workflow.tests.test_outbox.notify')
+        self.assertEqual(job.attempts, 1)
+
+    def test_put_unimportable_callback(self):
+        outbox = self._makeOne()
+        self.assertRaises(ValueError, outbox.put, lambda c, i: None, 'a',
+                          DummyInfo())
+        self.assertEqual(outbox.pending(), 0)
+
+    def test_transition_with_unimportable_callback(self):
+        from repoze.workflow import Workflow
+        called = []
+        def callback(content, info):
+            called.append(content)
+        outbox = self._makeOne(key=lambda content: content.id)
+        workflow = Workflow('state', 'private', deferred_queue=outbox)
+        workflow.add_state('private')
+        workflow.add_state('public', lambda content, info: None,
+                           deferred=True)
+        workflow.add_transition('publish', 'private', 'public', callback)
+        ob = DummyContent(id='doc1')
+        ob.state = 'private'
+        self.assertRaises(ValueError, workflow.transition, ob, None,
+                          'publish')
+        # rejected before any callback runs or the state is written
+        self.assertEqual(called, [])
+        self.assertEqual(ob.state, 'private')
+        self.assertEqual(outbox.pending(), 0)
+
+    def test_validate_caches_names(self):
+        outbox = self._makeOne()
+        self.assertEqual(outbox.validate(notify),
+                         'repoze.workflow.tests.test_outbox.notify')
+        self.assertEqual(outbox._names,
+                         {notify: 'repoze.workflow.tests.test_outbox.notify'})
+
+    def _rows(self, outbox):
+        return outbox.connection.execute(
+            'SELECT content_key, staged IS NOT NULL FROM workflow_outbox '
+            'ORDER BY id').fetchall()
+
+    def test_put_writes_staged_job(self):
+        outbox = self._makeOne()
+        outbox.put(notify, 'a', DummyInfo())
+        self.assertEqual(self._rows(outbox), [('a', 1)])
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(outbox.claim('me', 10, 60), [])
+        outbox.commit()
+        self.assertEqual(self._rows(outbox), [('a', 0)])
+        outbox.commit()
+        self.assertEqual(len(outbox), 1)
+
+    def test_abort(self):
+        outbox = self._makeOne()
+        outbox.put(notify, 'a', DummyInfo())
+        outbox.abort()
+        outbox.abort()
+        outbox.commit()
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(self._rows(outbox), [])
+        self.assertEqual(outbox.pending(), 0)
+
+    def test_recover(self):
+        outbox = self._makeOne()
+        outbox.put(notify, 'a', DummyInfo())
+        self.now[0] += 10
+        outbox.put(notify, 'b', DummyInfo())
+        # the process dies before committing: another one recovers
+        outbox = self._makeOne()
+        self.now[0] += 49
+        self.assertEqual(outbox.recover(60), 0)
+        self.now[0] += 1
+        self.assertEqual(outbox.recover(60), 1)
+        job, = outbox.claim('me', 10, 60)
+        self.assertEqual(job.content_key, 'a')
+        self.assertEqual(self._rows(outbox), [('a', 0), ('b', 1)])
+
+    def test_pending_per_thread(self):
+        import threading
+        outbox = self._makeOne()
+        outbox.put(notify, 'a', DummyInfo())
+        counts = []
+        def other():
+            counts.append(outbox.pending())
+            outbox.commit()
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        self.assertEqual(counts, [0])
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(outbox.pending(), 1)
+
+    def test_commit_error_keeps_jobs_staged(self):
+        outbox = self._makeOne()
+        outbox.put(notify, 'a', DummyInfo())
+        outbox.table = 'missing'
+        self.assertRaises(Exception, outbox.commit)
+        self.assertFalse(outbox.connection.in_transaction)
+        self.assertEqual(outbox.pending(), 1)
+        outbox.table = 'workflow_outbox'
+        outbox.commit()
+        self.assertEqual(len(outbox), 1)
+
+    def test_put_info_without_workflow(self):
+        outbox = self._makeOne()
+        outbox.put(notify, 'a', None)
+        outbox.commit()
+        job, = outbox.claim('me', 10, 60)
+        self.assertEqual((job.workflow, job.transition), (None, None))
+
+    def test_claim_leases(self):
+        outbox = self._makeOne()
+        for key in ('a', 'b', 'c'):
+            outbox.put(notify, key, DummyInfo())
+        outbox.commit()
+        first = outbox.claim('one', 2, 60)
+        self.assertEqual([job.content_key for job in first], ['a', 'b'])
+        second = outbox.claim('two', 2, 60)
+        self.assertEqual([job.content_key for job in second], ['c'])
+        self.assertEqual(outbox.claim('two', 2, 60), [])
+        self.now[0] += 60
+        again = outbox.claim('two', 5, 60)
+        self.assertEqual([job.content_key for job in again], ['a', 'b', 'c'])
+        self.assertEqual([job.attempts for job in again], [2, 2, 2])
+
+    def test_claim_rolls_back_on_error(self):
+        outbox = self._makeOne()
+        self.assertRaises(Exception, outbox.claim, 'one', 'bad', 60)
+        self.assertFalse(outbox.connection.in_transaction)
+
+    def test_complete(self):
+        outbox = self._makeOne()
+        outbox.put(notify, 'a', DummyInfo())
+        outbox.commit()
+        job, = outbox.claim('one', 1, 60)
+        outbox.complete('other', [job.id])
+        self.assertEqual(len(outbox), 1)
+        outbox.complete('one', [job.id])
+        self.assertEqual(len(outbox), 0)
+
+    def test_fail_retries_then_dies(self):
+        outbox = self._makeOne()
+        outbox.put(notify, 'a', DummyInfo())
+        outbox.commit()
+        job, = outbox.claim('one', 1, 60)
+        outbox.fail('one', job, 'oops', 10, 2)
+        self.assertEqual(outbox.claim('one', 1, 60), [])
+        self.now[0] += 10
+        job, = outbox.claim('one', 1, 60)
+        outbox.fail('one', job, 'oops again', 10, 2)
+        self.assertEqual(len(outbox), 0)
+        dead, = outbox.dead_jobs()
+        self.assertEqual(dead[0].content_key, 'a')
+        self.assertEqual(dead[1], 'oops again')
+
+class TestOutboxConsumer(OutboxTestBase):
+    def _getTargetClass(self):
+        from repoze.workflow.outbox import OutboxConsumer
+        return OutboxConsumer
+
+    def _makeOne(self, loader=None, workflows=None, **kw):
+        if loader is None:
+            loader = DummyContent
+        kw.setdefault('clock', self._clock)
+        return self._getTargetClass()(self._path(), loader, workflows, **kw)
+
+    def _makeOutbox(self):
+        from repoze.workflow.outbox import SQLiteOutbox
+        return SQLiteOutbox(self._path(), clock=self._clock)
+
+    def test_default_owner(self):
+        import os
+        consumer = self._makeOne()
+        self.assertTrue(consumer.owner.startswith('%s-' % os.getpid()))
+
+    def test_run_once(self):
+        from repoze.workflow import Workflow
+        workflow = Workflow('state', 'private', name='wf')
+        workflow.add_state('private')
+        workflow.add_transition('keep', 'private', 'private', title='Keep')
+        outbox = self._makeOutbox()
+        outbox.put(notify, 'a', DummyInfo(workflow, {'name': 'keep'}))
+        outbox.put(notify, 'b', DummyInfo(workflow, {'name': 'gone'}))
+        outbox.put(notify, 'c', DummyInfo())
+        outbox.commit()
+        del NOTIFIED[:]
+        consumer = self._makeOne(workflows={'wf': workflow}, batch_size=2)
+        self.assertEqual(consumer.run_once(), 2)
+        self.assertEqual(consumer.run_once(), 1)
+        self.assertEqual(consumer.run_once(), 0)
+        self.assertEqual(len(outbox), 0)
+        keys = [content.id for content, info in NOTIFIED]
+        self.assertEqual(keys, ['a', 'b', 'c'])
+        infos = [info for content, info in NOTIFIED]
+        self.assertTrue(infos[0].workflow is workflow)
+        self.assertEqual(infos[0].transition['title'], 'Keep')
+        self.assertEqual(infos[1].transition, {'name': 'gone'})
+        self.assertEqual(infos[2].workflow, None)
+        self.assertEqual(infos[2].request, None)
+
+    def test_run_once_failure_retried(self):
+        outbox = self._makeOutbox()
+        outbox.put(notify, 'bad', DummyInfo())
+        outbox.commit()
+        consumer = self._makeOne(retry_delay=5, max_attempts=2)
+        consumer.run_once()
+        self.assertEqual(len(outbox), 1)
+        self.assertEqual(consumer.run_once(), 0)
+        self.now[0] += 5
+        consumer.run_once()
+        self.assertEqual(len(outbox), 0)
+        (job, error), = outbox.dead_jobs()
+        self.assertTrue('ValueError' in error)
+
+    def test_run_until_empty(self):
+        outbox = self._makeOutbox()
+        for key in 'abc':
+            outbox.put(notify, key, DummyInfo())
+        outbox.commit()
+        consumer = self._makeOne(batch_size=1)
+        consumer.run()
+        self.assertEqual(len(outbox), 0)
+
+    def test_run_until_stopped(self):
+        import threading
+        stop = threading.Event()
+        calls = []
+        consumer = self._makeOne()
+        def run_once():
+            calls.append(1)
+            if len(calls) == 2:
+                stop.set()
+            return len(calls) == 1
+        consumer.run_once = run_once
+        consumer.run(stop, idle=0)
+        self.assertEqual(len(calls), 2)
+
+class TestRunConsumers(OutboxTestBase):
+    def test_jobs_run_once_across_processes(self):
+        import functools
+        from repoze.workflow.outbox import OutboxConsumer
+        from repoze.workflow.outbox import SQLiteOutbox
+        from repoze.workflow.outbox import run_consumers
+        log = self._path('log.txt')
+        outbox = SQLiteOutbox(self._path())
+        for i in range(40):
+            outbox.put(append_line, '%s:%d' % (log, i), DummyInfo())
+        outbox.commit()
+        factory = functools.partial(OutboxConsumer, self._path(), str,
+                                    batch_size=3)
+        self.assertEqual(run_consumers(factory, 3), [0, 0, 0])
+        self.assertEqual(len(outbox), 0)
+        with open(log) as f:
+            lines = sorted(f.read().split())
+        self.assertEqual(lines, sorted([str(i) for i in range(40)]))
+
+NOTIFIED = []
+
+def notify(content, info):
+    NOTIFIED.append((content, info))
+    if getattr(content, 'id', None) == 'bad':
+        raise ValueError(content.id)
+
+def append_line(key, info):
+    path, line = key.rsplit(':', 1)
+    with open(path, 'a') as f:
+        f.write(line + '\n')
+
+class DummyContent:
+    def __init__(self, id=None):
+        self.id = id
+
+class DummyWorkflow:
+    name = 'wf'
+
+class DummyInfo:
+    def __init__(self, workflow=None, transition=None):
+        self.workflow = workflow
+        self.transition = transition
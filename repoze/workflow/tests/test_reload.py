@@ -0,0 +1,198 @@
+import unittest
+
+from zope.testing.cleanup import cleanUp
+
+WORKFLOW = """\
+<workflow type="%(type)s" name="%(name)s" state_attr="state"
+   initial_state="draft"
+   content_types="repoze.workflow.tests.fixtures.dummy.IContent">
+  <state name="draft"/>
+  <state name="published"/>
+  <transition name="publish" from_state="draft" to_state="published"/>
+</workflow>
+"""
+
+ZCML = """\
+<configure xmlns="http://namespaces.repoze.org/bfg">
+<include package="repoze.workflow" file="meta.zcml"/>
+%s
+</configure>
+"""
+
+class TestWorkflowReloader(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        cleanUp()
+        self.directory = tempfile.mkdtemp()
+        self.mtime = 1000000000
+
+    def tearDown(self):
+        import shutil
+        cleanUp()
+        shutil.rmtree(self.directory)
+
+    def _getTargetClass(self):
+        from repoze.workflow.reload import WorkflowReloader
+        return WorkflowReloader
+
+    def _makeOne(self, **kw):
+        import os
+        return self._getTargetClass()(
+            os.path.join(self.directory, 'workflows.zcml'), **kw)
+
+    def _write(self, name='v1', type='publication', text=None, count=1):
+        import os
+        path = os.path.join(self.directory, 'workflows.zcml')
+        if text is None:
+            text = ZCML % (WORKFLOW % {'type': type, 'name': name} * count)
+        with open(path, 'w') as f:
+            f.write(text)
+        # a distinct modification time for each version
+        self.mtime += 10
+        os.utime(path, (self.mtime, self.mtime))
+
+    def _getWorkflow(self, type='publication'):
+        from repoze.workflow import get_workflow
+        from repoze.workflow.tests.fixtures.dummy import IContent
+        return get_workflow(IContent, type)
+
+    def _getList(self, registry=None, type='publication'):
+        from zope.component import getSiteManager
+        from repoze.workflow.interfaces import IWorkflowList
+        from repoze.workflow.tests.fixtures.dummy import IContent
+        if registry is None:
+            registry = getSiteManager()
+        return registry.adapters.registered((IContent,), IWorkflowList, type)
+
+    def test_load(self):
+        self._write()
+        reloader = self._makeOne()
+        self.assertTrue(reloader.changed())
+        self.assertTrue(reloader.load())
+        self.assertEqual(reloader.version, 1)
+        self.assertEqual(self._getWorkflow().name, 'v1')
+        self.assertFalse(reloader.changed())
+        self.assertFalse(reloader.check())
+
+    def test_reload_swaps_lists(self):
+        self._write()
+        reloader = self._makeOne()
+        reloader.load()
+        old_list = self._getList()
+        old = self._getWorkflow()
+        self._write('v2')
+        self.assertTrue(reloader.check())
+        self.assertEqual(reloader.version, 2)
+        new = self._getWorkflow()
+        self.assertEqual(new.name, 'v2')
+        self.assertFalse(self._getList() is old_list)
+        # what was published is never changed
+        self.assertEqual([wf_def['workflow'] for wf_def in old_list], [old])
+        self.assertEqual(old.name, 'v1')
+
+    def test_keeps_other_registrations(self):
+        from repoze.workflow.tests.fixtures.dummy import IContent
+        from repoze.workflow.zcml import register_workflows
+        other = object()
+        register_workflows(other, 'publication', [IContent], None)
+        self._write()
+        reloader = self._makeOne()
+        reloader.load()
+        self._write('v2')
+        reloader.check()
+        wf_list = self._getList()
+        self.assertEqual(len(wf_list), 2)
+        self.assertTrue(wf_list[0]['workflow'] is other)
+        self.assertEqual(wf_list[1]['workflow'].name, 'v2')
+
+    def test_removed_workflows_unregistered(self):
+        self._write()
+        reloader = self._makeOne()
+        reloader.load()
+        self._write(type='other')
+        reloader.check()
+        self.assertEqual(self._getList(), None)
+        self.assertEqual(self._getWorkflow('other').name, 'v1')
+
+    def test_failed_load_keeps_workflows(self):
+        errors = []
+        self._write()
+        reloader = self._makeOne(on_error=errors.append)
+        reloader.load()
+        self._write(text='<configure')
+        self.assertFalse(reloader.check())
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(reloader.error is errors[0])
+        self.assertEqual(self._getWorkflow().name, 'v1')
+        # not loaded again until it changes
+        self.assertFalse(reloader.check())
+        self.assertEqual(len(errors), 1)
+        self._write('v2')
+        self.assertTrue(reloader.check())
+        self.assertEqual(reloader.error, None)
+
+    def test_conflict_keeps_workflows(self):
+        from zope.configuration.config import ConfigurationConflictError
+        self._write()
+        reloader = self._makeOne()
+        reloader.load()
+        self._write('v2', count=2)
+        self.assertFalse(reloader.check())
+        self.assertTrue(isinstance(reloader.error,
+                                   ConfigurationConflictError))
+        self.assertEqual(reloader.version, 1)
+        self.assertEqual(self._getWorkflow().name, 'v1')
+
+    def test_inherits_cache_and_stats(self):
+        from repoze.workflow.tests.fixtures.dummy import Content
+        self._write()
+        reloader = self._makeOne()
+        reloader.load()
+        old = self._getWorkflow()
+        content = Content()
+        old.transition_to_state(content, None, 'published',
+                                idempotency_key='msg-1')
+        self._write('v2')
+        reloader.check()
+        new = self._getWorkflow()
+        self.assertEqual(new.name, 'v2')
+        self.assertTrue(new.idempotency_cache is old.idempotency_cache)
+        self.assertTrue(new.transition_stats is old.transition_stats)
+        content.state = 'draft'
+        new.transition(content, None, 'publish', idempotency_key='msg-1')
+        self.assertEqual(content.state, 'draft') # a duplicate
+
+    def test_failed_first_load(self):
+        self._write(text='<configure')
+        reloader = self._makeOne()
+        self.assertFalse(reloader.load())
+        self.assertFalse(reloader.changed())
+        self.assertEqual(reloader.version, 0)
+
+    def test_registry(self):
+        from zope.interface.registry import Components
+        registry = Components()
+        self._write()
+        reloader = self._makeOne(registry=registry)
+        reloader.load()
+        self.assertEqual(self._getList(), None)
+        self.assertEqual(self._getList(registry)[0]['workflow'].name, 'v1')
+
+    def test_start_stop(self):
+        import time
+        self._write()
+        reloader = self._makeOne(interval=0.01)
+        reloader.stop()
+        reloader.start()
+        try:
+            reloader.start()
+            deadline = time.time() + 10
+            while reloader.version < 1 and time.time() < deadline:
+                time.sleep(0.01)
+            self._write('v2')
+            while reloader.version < 2 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            reloader.stop()
+        self.assertEqual(reloader._worker, None)
+        self.assertEqual(self._getWorkflow().name, 'v2')
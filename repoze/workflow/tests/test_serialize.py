@@ -0,0 +1,162 @@
+import unittest
+
+class TestSerialize(unittest.TestCase):
+    def _dumps(self, workflow):
+        from repoze.workflow.serialize import dumps
+        return dumps(workflow)
+
+    def _loads(self, data, **kw):
+        from repoze.workflow.serialize import loads
+        return loads(data, **kw)
+
+    def _makeWorkflow(self, **kw):
+        from repoze.workflow.tests.test_codegen import TestGenerate
+        return TestGenerate('test_not_a_workflow')._makeWorkflow(**kw)
+
+    def test_round_trip(self):
+        from repoze.workflow.interfaces import IWorkflow
+        from repoze.workflow.tests.test_codegen import callback
+        from repoze.workflow.tests.test_codegen import checker
+        from repoze.workflow.tests.test_codegen import guard
+        from repoze.workflow.tests.test_codegen import independent_guard
+        from repoze.workflow.tests.test_codegen import other_guard
+        from zope.interface.verify import verifyObject
+        original = self._makeWorkflow()
+        data = self._dumps(original)
+        self.assertTrue(isinstance(data, bytes))
+        workflow = self._loads(data)
+        verifyObject(IWorkflow, workflow)
+        self.assertEqual(workflow.name, 'articles')
+        self.assertEqual(workflow.permission_checker, checker)
+        self.assertEqual(workflow._state_aliases, {'new': 'draft'})
+        self.assertEqual(workflow._state_parents, {'review.legal': 'review'})
+        self.assertEqual(workflow._descendants,
+                         {'review': set(['review.legal'])})
+        self.assertEqual(workflow._state_data, original._state_data)
+        self.assertEqual(list(workflow._transition_data),
+                         list(original._transition_data))
+        for state in original._state_data:
+            self.assertEqual(
+                [t['name'] for t in workflow._leaving(state)],
+                [t['name'] for t in original._leaving(state)])
+        submit = workflow._transition_data['submit']
+        self.assertEqual(submit['permission'], 'edit')
+        self.assertEqual(submit['guards'][0].expression, 'context.ready')
+        self.assertTrue(submit['guards'][1] is guard)
+        publish = workflow._transition_data['publish']
+        self.assertTrue(publish['deferred'])
+        self.assertEqual(publish['callback'], callback)
+        self.assertTrue(publish['guards'][0].guard is other_guard)
+        # one guard per expression
+        self.assertTrue(publish['guards'][1] is submit['guards'][0])
+        escalate = workflow._transition_data['escalate']
+        self.assertTrue(escalate['guards'][0].guard is independent_guard)
+        self.assertTrue(escalate['guards'][0].order_independent)
+
+    def test_parents_first(self):
+        original = self._makeWorkflow()
+        # the order of the states on CPython 2.7
+        data = original._state_data
+        original._state_data = dict([(name, data[name]) for name in
+                                     ('review.legal', 'published', 'review',
+                                      'draft')])
+        workflow = self._loads(self._dumps(original))
+        self.assertEqual(workflow._state_parents, {'review.legal': 'review'})
+        self.assertEqual(list(workflow._state_data),
+                         ['published', 'review', 'draft', 'review.legal'])
+
+    def test_loaded_workflow_transitions(self):
+        from repoze.workflow.tests.test_codegen import DummyContent
+        workflow = self._loads(self._dumps(self._makeWorkflow()))
+        content = DummyContent()
+        content.ready = True
+        workflow.transition(content, None, 'submit')
+        self.assertEqual(content.state, 'review')
+        self.assertEqual(content.guarded, 1)
+
+    def test_text(self):
+        data = self._dumps(self._makeWorkflow()).decode('utf-8')
+        self.assertEqual(self._loads(data).name, 'articles')
+
+    def test_options(self):
+        from repoze.workflow.tests.test_codegen import DummyStore
+        original = self._makeWorkflow(adaptive_guards=True,
+                                      deterministic=True,
+                                      deferred_queue=DummyStore)
+        workflow = self._loads(self._dumps(original))
+        self.assertTrue(workflow.guard_stats is not None)
+        self.assertTrue(workflow.deterministic)
+        self.assertEqual(workflow.deferred_queue, DummyStore)
+        # not shared: each workflow creates its own on first use
+        self.assertEqual(workflow.idempotency_cache, None)
+
+    def test_runtime_objects(self):
+        from repoze.workflow.storage import AttributeStateStore
+        from repoze.workflow.workflow import WorkflowError
+        data = self._dumps(self._makeWorkflow(
+            state_store=AttributeStateStore('other')))
+        self.assertRaises(WorkflowError, self._loads, data)
+        store = AttributeStateStore('other')
+        self.assertTrue(self._loads(data, state_store=store).state_store
+                        is store)
+
+    def test_keyword_overrides(self):
+        workflow = self._loads(self._dumps(self._makeWorkflow()),
+                               name='other')
+        self.assertEqual(workflow.name, 'other')
+
+    def test_tagged_values(self):
+        from repoze.workflow.workflow import Workflow
+        original = Workflow('state', 'a')
+        original.add_state('a', mapping={1: 'one', '$x': ('y',)},
+                           frozen=frozenset([1]), plain={'k': [1, 2.5]})
+        workflow = self._loads(self._dumps(original))
+        self.assertEqual(workflow._state_data['a'], original._state_data['a'])
+
+    def test_not_importable(self):
+        from repoze.workflow.workflow import WorkflowError
+        workflow = self._makeWorkflow()
+        workflow.add_transition('retract', 'review', 'draft',
+                                lambda content, info: None)
+        self.assertRaises(WorkflowError, self._dumps, workflow)
+
+    def test_not_a_workflow(self):
+        from repoze.workflow.workflow import WorkflowError
+        self.assertRaises(WorkflowError, self._dumps, object())
+
+    def test_invalid_json(self):
+        from repoze.workflow.workflow import WorkflowError
+        self.assertRaises(WorkflowError, self._loads, b'{')
+
+    def test_other_schema(self):
+        from repoze.workflow.workflow import WorkflowError
+        self.assertRaises(WorkflowError, self._loads, b'{"schema": 2}')
+
+    def test_unknown_tag(self):
+        import json
+        from repoze.workflow.workflow import WorkflowError
+        definition = json.loads(self._dumps(self._makeWorkflow()))
+        definition['states'][0][5] = {'tag': {'$unknown': 1}}
+        self.assertRaises(WorkflowError, self._loads,
+                          json.dumps(definition))
+
+    def test_unresolvable(self):
+        import json
+        from repoze.workflow.workflow import WorkflowError
+        definition = json.loads(self._dumps(self._makeWorkflow()))
+        definition['refs'][0] = 'repoze.workflow.nonesuch.f'
+        self.assertRaises(WorkflowError, self._loads,
+                          json.dumps(definition))
+
+    def test_invalid_reference(self):
+        import json
+        from repoze.workflow.workflow import WorkflowError
+        definition = json.loads(self._dumps(self._makeWorkflow()))
+        definition['states'][0][1] = {'$ref': len(definition['refs'])}
+        self.assertRaises(WorkflowError, self._loads,
+                          json.dumps(definition))
+
+    def test_callables_named_once(self):
+        import json
+        definition = json.loads(self._dumps(self._makeWorkflow()))
+        self.assertEqual(len(definition['refs']), len(set(definition['refs'])))
@@ -0,0 +1,60 @@
+import unittest
+
+class SQLiteTestBase(unittest.TestCase):
+    def setUp(self):
+        import os
+        import tempfile
+        from repoze.workflow._sqlite import connect
+        self.tmpdir = tempfile.mkdtemp()
+        self.connection = connect(os.path.join(self.tmpdir, 'test.db'))
+        self.connection.execute(
+            'CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT, '
+            'leased INTEGER NOT NULL DEFAULT 0)')
+        self.connection.executemany('INSERT INTO items (name) VALUES (?)',
+                                    [('a',), ('b',), ('c',)])
+
+    def tearDown(self):
+        import shutil
+        self.connection.close()
+        shutil.rmtree(self.tmpdir)
+
+class TestConnect(SQLiteTestBase):
+    def test_wal_autocommit(self):
+        mode = self.connection.execute('PRAGMA journal_mode').fetchone()
+        self.assertEqual(mode, ('wal',))
+        self.assertEqual(self.connection.isolation_level, None)
+        self.assertFalse(self.connection.in_transaction)
+
+class TestImmediate(SQLiteTestBase):
+    def test_commits(self):
+        from repoze.workflow._sqlite import immediate
+        with immediate(self.connection) as connection:
+            self.assertTrue(connection.in_transaction)
+            connection.execute("DELETE FROM items WHERE name = 'a'")
+        self.assertFalse(self.connection.in_transaction)
+        self.assertEqual(self.connection.execute(
+            'SELECT COUNT(*) FROM items').fetchone(), (2,))
+
+    def test_rolls_back(self):
+        from repoze.workflow._sqlite import immediate
+        def fail():
+            with immediate(self.connection) as connection:
+                connection.execute('DELETE FROM items')
+                raise ValueError
+        self.assertRaises(ValueError, fail)
+        self.assertFalse(self.connection.in_transaction)
+        self.assertEqual(self.connection.execute(
+            'SELECT COUNT(*) FROM items').fetchone(), (3,))
+
+class TestClaim(SQLiteTestBase):
+    def _callFUT(self, limit):
+        from repoze.workflow._sqlite import claim
+        return claim(self.connection, 'items', 'name', 'leased < ?', (1,),
+                     limit, 'leased = leased + ?', (1,))
+
+    def test_claim(self):
+        self.assertEqual(self._callFUT(2), [(1, 'a'), (2, 'b')])
+        self.assertEqual(self._callFUT(2), [(3, 'c')])
+        self.assertEqual(self._callFUT(2), [])
+        self.assertEqual(self.connection.execute(
+            'SELECT SUM(leased) FROM items').fetchone(), (3,))
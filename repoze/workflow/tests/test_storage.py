@@ -0,0 +1,349 @@
+import unittest
+
+class TestAttributeStateStore(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow.storage import AttributeStateStore
+        return AttributeStateStore
+
+    def _makeOne(self, state_attr='state'):
+        return self._getTargetClass()(state_attr)
+
+    def test_class_conforms_to_IStateStore(self):
+        from zope.interface.verify import verifyClass
+        from repoze.workflow.interfaces import IStateStore
+        verifyClass(IStateStore, self._getTargetClass())
+
+    def test_get_no_state(self):
+        store = self._makeOne()
+        self.assertEqual(store.get(DummyContent()), None)
+
+    def test_set_and_get(self):
+        store = self._makeOne()
+        ob = DummyContent()
+        store.set(ob, 'public')
+        self.assertEqual(ob.state, 'public')
+        self.assertEqual(store.get(ob), 'public')
+
+    def test_get_many_set_many(self):
+        store = self._makeOne('other')
+        ob1, ob2, ob3 = DummyContent(), DummyContent(), DummyContent()
+        store.set_many([(ob1, 'a'), (ob3, 'c')])
+        self.assertEqual(ob1.other, 'a')
+        self.assertEqual(store.get_many([ob1, ob2, ob3]), ['a', None, 'c'])
+
+class TestDictStateStore(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow.storage import DictStateStore
+        return DictStateStore
+
+    def _makeOne(self, data=None, key=None):
+        return self._getTargetClass()(data, key)
+
+    def test_class_conforms_to_IStateStore(self):
+        from zope.interface.verify import verifyClass
+        from repoze.workflow.interfaces import IStateStore
+        verifyClass(IStateStore, self._getTargetClass())
+
+    def test_defaults(self):
+        store = self._makeOne()
+        self.assertEqual(store.data, {})
+        self.assertEqual(store.key('abc'), 'abc')
+
+    def test_get_set(self):
+        data = {}
+        store = self._makeOne(data)
+        self.assertEqual(store.get('a'), None)
+        store.set('a', 'public')
+        self.assertEqual(data, {'a': 'public'})
+        self.assertEqual(store.get('a'), 'public')
+
+    def test_get_many_set_many_with_key(self):
+        store = self._makeOne(key=lambda content: content.id)
+        ob1, ob2 = DummyContent(id=1), DummyContent(id=2)
+        store.set_many([(ob1, 'private'), (ob2, 'public')])
+        self.assertEqual(store.data, {1: 'private', 2: 'public'})
+        self.assertEqual(store.get_many([ob2, DummyContent(id=3), ob1]),
+                         ['public', None, 'private'])
+
+class TestSQLiteStateStore(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow.storage import SQLiteStateStore
+        return SQLiteStateStore
+
+    def _makeOne(self, connection=':memory:', table='workflow_state',
+                 key=None):
+        return self._getTargetClass()(connection, table, key)
+
+    def test_class_conforms_to_IStateStore(self):
+        from zope.interface.verify import verifyClass
+        from repoze.workflow.interfaces import IStateStore
+        verifyClass(IStateStore, self._getTargetClass())
+
+    def test_ctor_with_connection(self):
+        import sqlite3
+        connection = sqlite3.connect(':memory:')
+        store = self._makeOne(connection, table='states')
+        self.assertTrue(store.connection is connection)
+        rows = connection.execute(
+            "SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+        self.assertEqual(rows, [('states',)])
+
+    def test_get_set(self):
+        store = self._makeOne()
+        self.assertEqual(store.get('a'), None)
+        store.set('a', 'public')
+        store.set('a', 'private')
+        self.assertEqual(store.get('a'), 'private')
+
+    def test_get_many_set_many_batched(self):
+        store = self._makeOne(key=lambda content: content.id)
+        store.batch_size = 2
+        obs = [DummyContent(id=i) for i in range(5)]
+        store.set_many([(ob, 'state%d' % ob.id) for ob in obs[:4]])
+        self.assertEqual(store.get_many(obs),
+                         ['state0', 'state1', 'state2', 'state3', None])
+
+    def test_threads_share_connection(self):
+        import threading
+        store = self._makeOne()
+        errors = []
+        def work(n):
+            try:
+                for i in range(50):
+                    store.set('%d.%d' % (n, i), 'state%d' % i)
+                    self.assertEqual(store.get('%d.%d' % (n, i)),
+                                     'state%d' % i)
+            except Exception as e: # pragma: no cover
+                errors.append(e)
+        threads = [threading.Thread(target=work, args=(n,))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_persists_across_connections(self):
+        import os
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'states.db')
+            self._makeOne(path).set('a', 'public')
+            self.assertEqual(self._makeOne(path).get('a'), 'public')
+        finally:
+            shutil.rmtree(tmpdir)
+
+class TestCachingStateStore(unittest.TestCase):
+    def _getTargetClass(self):
+        from repoze.workflow.storage import CachingStateStore
+        return CachingStateStore
+
+    def _makeOne(self, store=None, maxsize=1024, ttl=None, key=None,
+                 clock=None):
+        if store is None:
+            store = DummyStore()
+        if clock is None:
+            return self._getTargetClass()(store, maxsize, ttl, key)
+        return self._getTargetClass()(store, maxsize, ttl, key, clock)
+
+    def test_class_conforms_to_IStateStore(self):
+        from zope.interface.verify import verifyClass
+        from repoze.workflow.interfaces import IStateStore
+        verifyClass(IStateStore, self._getTargetClass())
+
+    def test_ctor_key_from_store(self):
+        store = DummyStore()
+        store.key = lambda content: content.id
+        cache = self._makeOne(store)
+        self.assertTrue(cache.key is store.key)
+
+    def test_ctor_key_default(self):
+        cache = self._makeOne()
+        self.assertEqual(cache.key('a'), 'a')
+
+    def test_get_reads_through_once(self):
+        store = DummyStore({'a': 'public'})
+        cache = self._makeOne(store)
+        self.assertEqual(cache.get('a'), 'public')
+        self.assertEqual(cache.get('a'), 'public')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(store.gets, ['a', 'b'])
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_set_writes_through(self):
+        store = DummyStore()
+        cache = self._makeOne(store)
+        cache.set('a', 'private')
+        self.assertEqual(store.data, {'a': 'private'})
+        self.assertEqual(cache.get('a'), 'private')
+        self.assertEqual(store.gets, [])
+
+    def test_get_many_fetches_only_missing(self):
+        store = DummyStore({'a': 'public', 'b': 'private'})
+        cache = self._makeOne(store)
+        cache.get('a')
+        states = cache.get_many(iter(['a', 'b', 'c']))
+        self.assertEqual(states, ['public', 'private', None])
+        self.assertEqual(store.get_manys, [['b', 'c']])
+        self.assertEqual(cache.get_many(['a', 'b', 'c']),
+                         ['public', 'private', None])
+        self.assertEqual(len(store.get_manys), 1)
+        self.assertEqual((cache.hits, cache.misses), (4, 3))
+
+    def test_set_many_writes_through(self):
+        store = DummyStore()
+        cache = self._makeOne(store)
+        cache.set_many(iter([('a', 'x'), ('b', 'y')]))
+        self.assertEqual(store.data, {'a': 'x', 'b': 'y'})
+        self.assertEqual(cache.get_many(['a', 'b']), ['x', 'y'])
+        self.assertEqual(store.get_manys, [])
+
+    def test_get_concurrent_set(self):
+        store = DummyStore({'a': 'public'})
+        cache = self._makeOne(store)
+        store.during_read = lambda: cache.set('a', 'private')
+        self.assertEqual(cache.get('a'), 'public')
+        store.during_read = None
+        # the stale state was not cached over the new one
+        self.assertEqual(cache.get('a'), 'private')
+        self.assertEqual(store.gets, ['a'])
+        self.assertEqual(cache._reads, {})
+
+    def test_get_many_concurrent_set_many(self):
+        store = DummyStore({'a': 'public', 'b': 'public'})
+        cache = self._makeOne(store)
+        store.during_read = lambda: cache.set_many([('a', 'private')])
+        self.assertEqual(cache.get_many(['a', 'b']), ['public', 'public'])
+        store.during_read = None
+        self.assertEqual(cache.get_many(['a', 'b']), ['private', 'public'])
+        self.assertEqual(store.get_manys, [['a', 'b']])
+
+    def test_get_concurrent_invalidate_and_clear(self):
+        store = DummyStore({'a': 'public'})
+        cache = self._makeOne(store)
+        store.during_read = lambda: cache.invalidate('a')
+        cache.get('a')
+        store.during_read = cache.clear
+        cache.get('a')
+        self.assertEqual(cache.stats()['size'], 0)
+        store.during_read = None
+        cache.get('a')
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_get_nested_reads(self):
+        store = DummyStore({'a': 'public'})
+        cache = self._makeOne(store)
+        def during_read():
+            store.during_read = None
+            cache.get('a')
+            self.assertEqual(cache._reads, {'a': [1, 0]})
+        store.during_read = during_read
+        cache.get('a')
+        self.assertEqual(cache._reads, {})
+        self.assertEqual(cache.stats()['size'], 1)
+
+    def test_get_fails(self):
+        store = DummyStore({'a': 'public'})
+        cache = self._makeOne(store)
+        def during_read():
+            raise KeyError('a')
+        store.during_read = during_read
+        self.assertRaises(KeyError, cache.get, 'a')
+        self.assertRaises(KeyError, cache.get_many, ['a'])
+        self.assertEqual(cache._reads, {})
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_prefetch(self):
+        store = DummyStore({'a': 'public'})
+        cache = self._makeOne(store)
+        cache.prefetch(['a', 'b'])
+        self.assertEqual(store.get_manys, [['a', 'b']])
+        self.assertEqual(cache.get('a'), 'public')
+        self.assertEqual(store.gets, [])
+
+    def test_invalidate(self):
+        store = DummyStore({'a': 'public'})
+        cache = self._makeOne(store)
+        cache.get('a')
+        store.data['a'] = 'private'
+        self.assertEqual(cache.get('a'), 'public')
+        cache.invalidate('a')
+        self.assertEqual(cache.get('a'), 'private')
+
+    def test_invalidate_many_and_clear(self):
+        store = DummyStore({'a': 'public', 'b': 'public'})
+        cache = self._makeOne(store)
+        cache.get_many(['a', 'b'])
+        cache.invalidate_many(['a'])
+        self.assertEqual(cache.stats()['size'], 1)
+        cache.clear()
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_ttl(self):
+        now = [0]
+        store = DummyStore({'a': 'public'})
+        cache = self._makeOne(store, ttl=5, clock=lambda: now[0])
+        cache.get('a')
+        now[0] = 5
+        cache.get('a')
+        self.assertEqual(store.gets, ['a', 'a'])
+
+    def test_stats(self):
+        cache = self._makeOne(maxsize=1)
+        self.assertEqual(cache.hit_ratio, 0.0)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        cache.get('b')
+        self.assertEqual(cache.stats(),
+                         {'hits': 2, 'misses': 2, 'hit_ratio': 0.5,
+                          'evictions': 1, 'size': 1, 'maxsize': 1})
+
+    def test_workflow_on_top(self):
+        from repoze.workflow import Workflow
+        store = DummyStore()
+        cache = self._makeOne(store)
+        workflow = Workflow('state', 'private', state_store=cache)
+        workflow.add_state('private')
+        workflow.add_state('public')
+        workflow.add_transition('publish', 'private', 'public')
+        self.assertEqual(workflow.state_of('a'), 'private')
+        workflow.transition('a', None, 'publish')
+        self.assertEqual(workflow.state_of('a'), 'public')
+        self.assertEqual(store.data, {'a': 'public'})
+        self.assertEqual(store.gets, ['a'])
+
+class DummyStore:
+    during_read = None # called between reading and returning states
+
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.gets = []
+        self.get_manys = []
+
+    def get(self, content):
+        self.gets.append(content)
+        state = self.data.get(content)
+        if self.during_read is not None:
+            self.during_read()
+        return state
+
+    def set(self, content, state):
+        self.data[content] = state
+
+    def get_many(self, contents):
+        self.get_manys.append(list(contents))
+        states = [self.data.get(content) for content in contents]
+        if self.during_read is not None:
+            self.during_read()
+        return states
+
+    def set_many(self, items):
+        self.data.update(items)
+
+class DummyContent:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
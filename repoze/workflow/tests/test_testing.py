@@ -43,6 +43,19 @@ class TestDummyWorkflow(unittest.TestCase):
             state = 'true'
         self.assertEqual(workflow.state_of(Dummy), 'true')
 
+    def test_states_of(self):
+        workflow = self._makeOne()
+        class Dummy:
+            state = 'true'
+        self.assertEqual(workflow.states_of([Dummy, None]), ['true', None])
+
+    def test_group_by_state(self):
+        workflow = self._makeOne()
+        class Dummy:
+            state = 'true'
+        self.assertEqual(workflow.group_by_state([Dummy, None]),
+                         {'true': [Dummy], None: [None]})
+
     def test_initialize(self):
         workflow = self._makeOne()
         state = workflow.initialize(None)
@@ -58,6 +71,11 @@ class TestDummyWorkflow(unittest.TestCase):
                                               'name':None,
                                               'guards':()}])
 
+    def test_transition_with_idempotency_key(self):
+        workflow = self._makeOne()
+        workflow.transition(None, None, None, idempotency_key='k')
+        self.assertEqual(workflow.executed[0]['idempotency_key'], 'k')
+
     def test_get_transitions(self):
         workflow = self._makeOne((), 'a')
         self.assertEqual(workflow.get_transitions(None, None), 'a')
@@ -77,6 +95,11 @@ class TestDummyWorkflow(unittest.TestCase):
                            'context': None,
                            'skip_same': True}])
 
+    def test_transition_to_state_with_idempotency_key(self):
+        workflow = self._makeOne()
+        workflow.transition_to_state(None, None, None, idempotency_key='k')
+        self.assertEqual(workflow.transitioned[0]['idempotency_key'], 'k')
+
     def test_reset(self):
         workflow = self._makeOne()
         state, msg = workflow.reset(None)
@@ -94,6 +117,13 @@ class TestDummyWorkflow(unittest.TestCase):
             state = 'hello'
         self.assertEqual(workflow.has_state(Dummy), True)
 
+    def test_in_state(self):
+        workflow = self._makeOne()
+        class Dummy:
+            state = 'hello'
+        self.assertEqual(workflow.in_state(Dummy, 'hello'), True)
+        self.assertEqual(workflow.in_state(Dummy, 'other'), False)
+
     def test_check(self):
         workflow = self._makeOne()
         self.assertEqual(workflow.check(), True)
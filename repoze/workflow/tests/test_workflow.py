@@ -1,6 +1,10 @@
 import unittest
+from zope.interface import Interface
+from zope.interface import implementer
 from zope.testing.cleanup import cleanUp
 
+from repoze.workflow.interfaces import IBatchPermissionChecker
+
 class WorkflowTests(unittest.TestCase):
 
     def _getTargetClass(self):
@@ -124,6 +128,28 @@ class WorkflowTests(unittest.TestCase):
         ob.state = 'abc'
         self.assertEqual(sm.has_state(ob), True)
 
+    def test_ctor_default_state_store(self):
+        from repoze.workflow.storage import AttributeStateStore
+        sm = self._makeOne(attr='thestate')
+        self.assertEqual(sm.state_store.__class__, AttributeStateStore)
+        self.assertEqual(sm.state_store.state_attr, 'thestate')
+
+    def test_state_store_used_for_reads_and_writes(self):
+        from repoze.workflow.storage import DictStateStore
+        klass = self._getTargetClass()
+        store = DictStateStore()
+        sm = klass('state', 'pending', state_store=store)
+        sm.add_state('pending')
+        sm.add_state('published')
+        sm.add_transition('publish', 'pending', 'published')
+        self.assertEqual(sm.has_state('key'), False)
+        self.assertEqual(sm.state_of('key'), 'pending')
+        self.assertEqual(store.data, {'key': 'pending'})
+        sm.transition('key', None, 'publish')
+        self.assertEqual(store.data, {'key': 'published'})
+        self.assertEqual(sm.reset('key'), ('published', None))
+        self.assertEqual(sm.has_state('key'), True)
+
     def test__state_of_uninitialized(self):
         sm = self._makeOne()
         ob = DummyContent()
@@ -142,6 +168,44 @@ class WorkflowTests(unittest.TestCase):
         self.assertEqual(sm.state_of(ob), 'pending')
         self.assertEqual(ob.state, 'pending')
 
+    def test_state_of_peek(self):
+        def callback(content, info): # pragma: no cover
+            content.called_back = True
+        sm = self._makeOne()
+        sm.add_state('pending', callback)
+        ob = DummyContent()
+        self.assertEqual(sm.state_of(ob, peek=True), 'pending')
+        self.assertFalse(hasattr(ob, 'state'))
+        self.assertFalse(hasattr(ob, 'called_back'))
+
+    def test_state_of_peek_has_state(self):
+        sm = self._makeOne()
+        ob = DummyContent()
+        ob.state = 'published'
+        self.assertEqual(sm.state_of(ob, peek=True), 'published')
+
+    def test_state_info_peek(self):
+        def callback(content, info): # pragma: no cover
+            content.called_back = True
+        sm = self._makePopulated(state_callback=callback)
+        ob = DummyContent()
+        result = sm.state_info(ob, None, peek=True)
+        current = [state['name'] for state in result if state['current']]
+        self.assertEqual(current, ['pending'])
+        self.assertFalse(hasattr(ob, 'state'))
+        self.assertFalse(hasattr(ob, 'called_back'))
+
+    def test_get_transitions_peek(self):
+        def callback(content, info): # pragma: no cover
+            content.called_back = True
+        sm = self._makePopulated(state_callback=callback)
+        ob = DummyContent()
+        result = sm.get_transitions(ob, None, peek=True)
+        self.assertEqual(sorted([t['name'] for t in result]),
+                         ['publish', 'reject'])
+        self.assertFalse(hasattr(ob, 'state'))
+        self.assertFalse(hasattr(ob, 'called_back'))
+
     def test_state_of_nondefault(self):
         sm = self._makeOne()
         ob = DummyContent()
@@ -159,6 +223,69 @@ class WorkflowTests(unittest.TestCase):
         sm = self._makeOne()
         self.assertEqual(sm.state_of(None), 'pending')
 
+    def test_states_of(self):
+        sm = self._makePopulated()
+        sm._state_aliases = {'supersecret': 'private'}
+        ob1, ob2 = DummyContent(), DummyContent()
+        ob1.state = 'published'
+        ob2.state = 'supersecret'
+        self.assertEqual(sm.states_of(iter([ob1, None, ob2])),
+                         ['published', 'pending', 'private'])
+
+    def test_states_of_initializes(self):
+        def callback(content, info):
+            content.called_back = info.request
+        sm = self._makeOne()
+        sm.add_state('pending', callback)
+        ob1, ob2 = DummyContent(), DummyContent()
+        ob2.state = 'pending'
+        request = object()
+        self.assertEqual(sm.states_of([ob1, ob2], request),
+                         ['pending', 'pending'])
+        self.assertEqual(ob1.state, 'pending')
+        self.assertEqual(ob1.called_back, request)
+        self.assertFalse(hasattr(ob2, 'called_back'))
+
+    def test_states_of_initialize_False(self):
+        def callback(content, info): # pragma: no cover
+            content.called_back = True
+        sm = self._makeOne()
+        sm.add_state('pending', callback)
+        ob = DummyContent()
+        self.assertEqual(sm.states_of([ob], initialize=False), [None])
+        self.assertFalse(hasattr(ob, 'state'))
+        self.assertFalse(hasattr(ob, 'called_back'))
+
+    def test_states_of_uses_get_many(self):
+        from repoze.workflow.storage import DictStateStore
+        class Store(DictStateStore):
+            def get(self, content): # pragma: no cover
+                raise AssertionError('not batched')
+        store = Store({'a': 'published'})
+        klass = self._getTargetClass()
+        sm = klass('state', 'pending', state_store=store)
+        sm.add_state('pending')
+        sm.add_state('published')
+        self.assertEqual(sm.states_of(['a', 'b']), ['published', 'pending'])
+        self.assertEqual(store.data, {'a': 'published', 'b': 'pending'})
+
+    def test_group_by_state(self):
+        sm = self._makePopulated()
+        ob1, ob2, ob3 = DummyContent(), DummyContent(), DummyContent()
+        ob1.state = 'published'
+        ob3.state = 'published'
+        groups = sm.group_by_state(iter([ob1, ob2, ob3]))
+        self.assertEqual(groups, {'published': [ob1, ob3],
+                                  'pending': [ob2]})
+        self.assertEqual(ob2.state, 'pending')
+
+    def test_group_by_state_initialize_False(self):
+        sm = self._makePopulated()
+        ob1, ob2 = DummyContent(), DummyContent()
+        ob1.state = 'private'
+        groups = sm.group_by_state([ob1, ob2], initialize=False)
+        self.assertEqual(groups, {'private': [ob1], None: [ob2]})
+
     def test_add_state_state_exists(self):
         from repoze.workflow import WorkflowError
         sm = self._makeOne()
@@ -422,6 +549,47 @@ class WorkflowTests(unittest.TestCase):
         self.assertEqual(info.transition['name'], 'publish')
         self.assertTrue(info.request is None)
 
+    def test__transition_deferred_callbacks(self):
+        from repoze.workflow.deferred import DeferredCallbackQueue
+        called = []
+        def transition_cb(content, info):
+            called.append(('transition', info.transition['name']))
+        def state_cb(content, info):
+            called.append(('state', info.transition['name']))
+        queue = DeferredCallbackQueue()
+        klass = self._getTargetClass()
+        sm = klass('state', 'private', deferred_queue=queue)
+        sm.add_state('private')
+        sm.add_state('public', state_cb, deferred=True)
+        sm.add_transition('publish', 'private', 'public', transition_cb)
+        sm.add_transition('retract', 'public', 'private', transition_cb,
+                          deferred=True)
+        ob = DummyContent()
+        sm._transition(ob, 'publish', None, None, ())
+        self.assertEqual(ob.state, 'public')
+        self.assertEqual(called, [('transition', 'publish')])
+        sm._transition(ob, 'retract', None, None, ())
+        self.assertEqual(ob.state, 'private')
+        self.assertEqual(called, [('transition', 'publish')])
+        self.assertEqual(queue.pending(), 2)
+        queue.commit()
+        queue.drain()
+        self.assertEqual(called, [('transition', 'publish'),
+                                  ('state', 'publish'),
+                                  ('transition', 'retract')])
+
+    def test__transition_deferred_without_queue(self):
+        called = []
+        def state_cb(content, info):
+            called.append(content)
+        sm = self._makeOne(initial_state='private')
+        sm.add_state('private')
+        sm.add_state('public', state_cb, deferred=True)
+        sm.add_transition('publish', 'private', 'public')
+        ob = DummyContent()
+        sm._transition(ob, 'publish', None, None, ())
+        self.assertEqual(called, [ob])
+
     def test__transition_error(self):
         sm = self._makeOne(initial_state='pending')
         sm.add_state('pending')
@@ -971,6 +1139,417 @@ class WorkflowTests(unittest.TestCase):
         self.assertEqual(args, [('view', request, 'whatever'),
                                 ('view', request, 'whatever')])
 
+    def test_get_transitions_batch_checker(self):
+        checker = DummyBatchChecker(['view'])
+        workflow = self._makeOne(permission_checker=checker)
+        workflow._get_transitions = lambda *arg, **kw: [
+            {'permission':'view'}, {'permission':'edit'},
+            {'permission':'view'}, {}]
+        request = object()
+        transitions = workflow.get_transitions(None, request, 'context')
+        self.assertEqual(transitions, [{'permission':'view'},
+                                       {'permission':'view'}, {}])
+        self.assertEqual(checker.batches,
+                         [(set(['view', 'edit']), 'context', request)])
+        self.assertEqual(checker.calls, [])
+
+    def test_get_transitions_batch_checker_no_permissions(self):
+        checker = DummyBatchChecker([])
+        workflow = self._makeOne(permission_checker=checker)
+        workflow._get_transitions = lambda *arg, **kw: [{}]
+        transitions = workflow.get_transitions(None, None)
+        self.assertEqual(transitions, [{}])
+        self.assertEqual(checker.batches, [])
+
+    def test_state_info_batch_checker(self):
+        checker = DummyBatchChecker(['view'])
+        state_info = []
+        state_info.append({'transitions':[{'permission':'view'}, {}]})
+        state_info.append({'transitions':[{'permission':'edit'}, {}]})
+        workflow = self._makeOne(permission_checker=checker)
+        workflow._state_info = lambda *arg, **kw: state_info
+        request = object()
+        result = workflow.state_info(None, request, 'context')
+        self.assertEqual(result, [{'transitions':[{'permission':'view'}, {}]},
+                                  {'transitions':[{}]}])
+        self.assertEqual(checker.batches,
+                         [(set(['view', 'edit']), 'context', request)])
+        self.assertEqual(checker.calls, [])
+
+    def test_transition_to_state_batch_checker(self):
+        args = []
+        def dummy(content, info):
+            args.append((content, info))
+        checker = DummyBatchChecker(['allowed'])
+        sm = self._makePopulatedOverlappingTransitions(
+            transition_callback=dummy,
+            permission_checker=checker,
+            )
+        sm._transition_data['submit']['permission'] = 'forbidden'
+        sm._transition_data['submit2']['permission'] = 'allowed'
+        ob = DummyContent()
+        ob.state = 'private'
+        request = object()
+        sm.transition_to_state(ob, request, 'pending')
+        self.assertEqual(len(args), 1)
+        self.assertEqual(args[0][1].transition['name'], 'submit2')
+        self.assertEqual(checker.batches,
+                         [(set(['forbidden', 'allowed']), ob, request)])
+        self.assertEqual(checker.calls, [])
+
+    def test_transition_batch_checker_not_batched(self):
+        checker = DummyBatchChecker(['allowed'])
+        sm = self._makePopulated()
+        sm.permission_checker = checker
+        sm._transition_data['publish']['permission'] = 'allowed'
+        ob = DummyContent()
+        request = object()
+        sm.transition(ob, request, 'publish')
+        self.assertEqual(ob.state, 'published')
+        self.assertEqual(checker.calls, [('allowed', ob, request)])
+        self.assertEqual(checker.batches, [])
+
+    def test_get_transitions_executor(self):
+        args = []
+        def checker(*arg):
+            args.append(arg)
+            return arg[0] == 'view'
+        executor = DummyExecutor()
+        workflow = self._makeOne(permission_checker=checker)
+        workflow._get_transitions = lambda *arg, **kw: [
+            {'permission':'view'}, {'permission':'edit'},
+            {'permission':'view'}, {}]
+        request = object()
+        transitions = workflow.get_transitions(None, request, 'context',
+                                               executor=executor)
+        self.assertEqual(transitions, [{'permission':'view'},
+                                       {'permission':'view'}, {}])
+        self.assertEqual(executor.submitted, ['view', 'edit'])
+        self.assertEqual(args, [('view', 'context', request),
+                                ('edit', 'context', request)])
+
+    def test_get_transitions_executor_no_checker(self):
+        executor = DummyExecutor()
+        workflow = self._makeOne()
+        workflow._get_transitions = lambda *arg, **kw: [{}]
+        transitions = workflow.get_transitions(None, None, executor=executor)
+        self.assertEqual(transitions, [{}])
+        self.assertEqual(executor.submitted, [])
+
+    def test_get_transitions_executor_batch_checker_wins(self):
+        checker = DummyBatchChecker(['view'])
+        executor = DummyExecutor()
+        workflow = self._makeOne(permission_checker=checker)
+        workflow._get_transitions = lambda *arg, **kw: [{'permission':'view'}]
+        transitions = workflow.get_transitions(None, None, executor=executor)
+        self.assertEqual(transitions, [{'permission':'view'}])
+        self.assertEqual(executor.submitted, [])
+        self.assertEqual(len(checker.batches), 1)
+
+    def test_state_info_executor_runs_concurrently(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        barrier = threading.Barrier(2, timeout=5)
+        def checker(permission, context, request):
+            barrier.wait()
+            return permission == 'view'
+        sm = self._makePopulated()
+        sm.permission_checker = checker
+        sm._transition_data['publish']['permission'] = 'view'
+        sm._transition_data['reject']['permission'] = 'edit'
+        ob = DummyContent()
+        ob.state = 'pending'
+        with ThreadPoolExecutor(2) as executor:
+            result = sm.state_info(ob, None, executor=executor)
+        names = sorted([t['name'] for state in result
+                        for t in state['transitions']])
+        self.assertEqual(names, ['publish'])
+
+    def test_ctor_default_idempotency_cache(self):
+        from repoze.workflow.idempotency import IdempotencyCache
+        sm = self._makePopulated()
+        self.assertEqual(sm.idempotency_cache, None)
+        ob = DummyContent()
+        ob.state = 'published'
+        sm.transition(ob, None, 'retract', idempotency_key='msg-1')
+        cache = sm.idempotency_cache
+        self.assertTrue(isinstance(cache, IdempotencyCache))
+        self.assertTrue('msg-1' in cache)
+        sm.transition(ob, None, 'publish', idempotency_key='msg-2')
+        self.assertTrue(sm.idempotency_cache is cache)
+
+    def test_pickle_and_copy(self):
+        import copy
+        import pickle
+        from repoze.workflow.guards import ExpressionGuard
+        sm = self._makePopulated()
+        sm._transition_data['publish']['guards'] = [
+            ExpressionGuard('context.ready')]
+        sm = pickle.loads(pickle.dumps(sm))
+        self.assertEqual(sorted(sm._state_data),
+                         ['pending', 'private', 'published'])
+        self.assertEqual(sm._transition_data['publish']['guards'][0]
+                         .expression, 'context.ready')
+        sm = copy.deepcopy(sm)
+        ob = DummyContent()
+        ob.state = 'published'
+        sm.transition(ob, None, 'retract')
+        self.assertEqual(ob.state, 'pending')
+
+    def test_transition_idempotency_key_duplicate(self):
+        guarded = []
+        def guard(context, info):
+            guarded.append(context)
+        callbacks = []
+        def transition_callback(content, info):
+            callbacks.append(content)
+        sm = self._makePopulated()
+        sm._transition_data['retract']['callback'] = transition_callback
+        ob = DummyContent()
+        ob.state = 'published'
+        sm.transition(ob, None, 'retract', guards=(guard,),
+                      idempotency_key='msg-1')
+        self.assertEqual(ob.state, 'pending')
+        ob.state = 'published'
+        sm.transition(ob, None, 'retract', guards=(guard,),
+                      idempotency_key='msg-1')
+        self.assertEqual(ob.state, 'published')
+        self.assertEqual(guarded, [ob])
+        self.assertEqual(callbacks, [ob])
+        self.assertEqual(sm.idempotency_cache.duplicates, 1)
+
+    def test_transition_idempotency_key_released_on_failure(self):
+        from repoze.workflow import WorkflowError
+        sm = self._makePopulated()
+        ob = DummyContent()
+        ob.state = 'published'
+        self.assertRaises(WorkflowError, sm.transition, ob, None, 'publish',
+                          idempotency_key='msg-1')
+        self.assertFalse('msg-1' in sm.idempotency_cache)
+        sm.transition(ob, None, 'retract', idempotency_key='msg-1')
+        self.assertEqual(ob.state, 'pending')
+
+    def test_transition_idempotency_key_under_way(self):
+        from repoze.workflow import TransitionInProgress
+        errors = []
+        def transition_callback(content, info):
+            self.assertFalse('msg-1' in sm.idempotency_cache)
+            try:
+                sm.transition(content, None, 'retract',
+                              idempotency_key='msg-1')
+            except TransitionInProgress as e:
+                errors.append(e)
+        sm = self._makePopulated(transition_callback=transition_callback)
+        ob = DummyContent()
+        ob.state = 'published'
+        sm.transition(ob, None, 'retract', idempotency_key='msg-1')
+        self.assertEqual(ob.state, 'pending')
+        self.assertEqual(len(errors), 1)
+        self.assertTrue('msg-1' in sm.idempotency_cache)
+
+    def test_transition_to_state_idempotency_key(self):
+        sm = self._makePopulated()
+        ob = DummyContent()
+        ob.state = 'pending'
+        sm.transition_to_state(ob, None, 'published', idempotency_key='m')
+        self.assertEqual(ob.state, 'published')
+        ob.state = 'pending'
+        sm.transition_to_state(ob, None, 'published', idempotency_key='m')
+        self.assertEqual(ob.state, 'pending')
+
+    def test_transition_to_state_idempotency_key_permission(self):
+        from repoze.workflow import WorkflowError
+        allowed = []
+        def checker(permission, context, request):
+            return bool(allowed)
+        sm = self._makePopulated()
+        sm.permission_checker = checker
+        sm._transition_data['publish']['permission'] = 'publish'
+        ob = DummyContent()
+        ob.state = 'pending'
+        request = object()
+        self.assertRaises(WorkflowError, sm.transition_to_state, ob,
+                          request, 'published', idempotency_key='m')
+        allowed.append(True)
+        sm.transition_to_state(ob, request, 'published', idempotency_key='m')
+        self.assertEqual(ob.state, 'published')
+
+    def _makeNested(self):
+        sm = self._makeOne(initial_state='draft')
+        sm.add_state('draft')
+        sm.add_state('review')
+        sm.add_state('review.legal', parent='review')
+        sm.add_state('review.legal.external', parent='review.legal')
+        sm.add_state('review.editorial', parent='review')
+        sm.add_state('published')
+        sm.add_transition('submit', 'draft', 'review.legal')
+        sm.add_transition('reject', 'review', 'draft')
+        sm.add_transition('escalate', 'review.legal', 'review.legal.external')
+        sm.add_transition('approve', 'review.editorial', 'published')
+        return sm
+
+    def test_add_state_no_such_parent(self):
+        from repoze.workflow import WorkflowError
+        sm = self._makeOne()
+        self.assertRaises(WorkflowError, sm.add_state, 'child',
+                          parent='missing')
+
+    def test_add_state_parent_not_in_state_data(self):
+        sm = self._makeNested()
+        self.assertEqual(sm._state_data['review.legal'],
+                         {'callback': None, 'title': 'review.legal'})
+
+    def test_ancestor_and_descendant_tables(self):
+        sm = self._makeNested()
+        self.assertEqual(sm._ancestors['review.legal.external'],
+                         ('review.legal.external', 'review.legal', 'review'))
+        self.assertEqual(sm.substates_of('review'),
+                         set(['review.legal', 'review.legal.external',
+                              'review.editorial']))
+        self.assertEqual(sm.substates_of('draft'), set())
+        self.assertEqual(sm.parent_of('review.legal.external'),
+                         'review.legal')
+        self.assertEqual(sm.parent_of('review'), None)
+
+    def test_get_transitions_inherited_nearest_first(self):
+        sm = self._makeNested()
+        ob = DummyContent()
+        ob.state = 'review.legal.external'
+        names = [t['name'] for t in sm.get_transitions(ob, None)]
+        self.assertEqual(names, ['escalate', 'reject'])
+        ob.state = 'review.editorial'
+        names = [t['name'] for t in sm.get_transitions(ob, None)]
+        self.assertEqual(names, ['approve', 'reject'])
+        ob.state = 'review'
+        names = [t['name'] for t in sm.get_transitions(ob, None)]
+        self.assertEqual(names, ['reject'])
+
+    def test_transition_inherited_from_ancestor(self):
+        from repoze.workflow import WorkflowError
+        sm = self._makeNested()
+        ob = DummyContent()
+        ob.state = 'review.legal.external'
+        sm.transition(ob, None, 'reject')
+        self.assertEqual(ob.state, 'draft')
+        ob.state = 'review'
+        self.assertRaises(WorkflowError, sm.transition, ob, None, 'escalate')
+        self.assertRaises(WorkflowError, sm.transition, ob, None, 'missing')
+
+    def test_transition_to_state_inherited(self):
+        sm = self._makeNested()
+        ob = DummyContent()
+        ob.state = 'review.editorial'
+        sm.transition_to_state(ob, None, 'draft')
+        self.assertEqual(ob.state, 'draft')
+
+    def test_state_info_inherited(self):
+        sm = self._makeNested()
+        ob = DummyContent()
+        ob.state = 'review.editorial'
+        info = dict([(state['name'], [t['name'] for t in state['transitions']])
+                     for state in sm.state_info(ob, None)])
+        self.assertEqual(info['draft'], ['reject'])
+        self.assertEqual(info['published'], ['approve'])
+        self.assertEqual(info['review.legal'], [])
+
+    def test_in_state(self):
+        sm = self._makeNested()
+        ob = DummyContent()
+        ob.state = 'review.legal.external'
+        self.assertTrue(sm.in_state(ob, 'review'))
+        self.assertTrue(sm.in_state(ob, 'review.legal'))
+        self.assertTrue(sm.in_state(ob, 'review.legal.external'))
+        self.assertFalse(sm.in_state(ob, 'review.editorial'))
+        self.assertFalse(sm.in_state(DummyContent(), 'review', peek=True))
+
+    def test_transition_index_rebuilt_after_direct_write(self):
+        sm = self._makePopulated()
+        ob = DummyContent()
+        ob.state = 'pending'
+        self.assertEqual(len(sm.get_transitions(ob, None)), 2)
+        sm._transition_data['publish2'] = dict(
+            name='publish2', from_state='pending', to_state='published',
+            callback=None)
+        self.assertEqual(len(sm.get_transitions(ob, None)), 3)
+
+    def _makeCandidates(self, deterministic=False):
+        def checker(permission, context, request):
+            return permission in context.allowed
+        sm = self._makePopulatedOverlappingTransitions(
+            permission_checker=checker)
+        sm.deterministic = deterministic
+        sm._transition_data['submit']['permission'] = 'submit'
+        sm._transition_data['submit2']['permission'] = 'submit2'
+        return sm
+
+    def test_transition_to_state_most_likely_first(self):
+        sm = self._makeCandidates()
+        ob = DummyContent()
+        ob.allowed = ('submit2',)
+        ob.state = 'private'
+        sm.transition_to_state(ob, object(), 'pending')
+        self.assertEqual(sm.transition_stats,
+                         {'submit': [0, 1], 'submit2': [1, 0]})
+        ob.state = 'private'
+        sm.transition_to_state(ob, object(), 'pending')
+        self.assertEqual(sm.transition_stats,
+                         {'submit': [0, 1], 'submit2': [2, 0]})
+
+    def test_transition_to_state_deterministic(self):
+        sm = self._makeCandidates(deterministic=True)
+        ob = DummyContent()
+        ob.allowed = ('submit2',)
+        for i in range(2):
+            ob.state = 'private'
+            sm.transition_to_state(ob, object(), 'pending')
+        self.assertEqual(sm.transition_stats,
+                         {'submit': [0, 2], 'submit2': [2, 0]})
+
+    def test_freeze(self):
+        sm = self._makePopulated()
+        sm.freeze()
+        self.assertTrue(sm.frozen)
+        count, by_state, leaving = sm._index
+        self.assertEqual(sorted(leaving), sorted(sm._state_data))
+        self.assertEqual([t['name'] for t in leaving['pending']],
+                         [t['name'] for t in sm._leaving('pending')])
+        self.assertTrue(isinstance(leaving['pending'], tuple))
+        self.assertFalse(sm.idempotency_cache is None)
+        from repoze.workflow import WorkflowError
+        self.assertRaises(WorkflowError, sm.add_state, 'other')
+        self.assertRaises(WorkflowError, sm.add_transition, 'other',
+                          'private', 'public')
+
+    def test_freeze_stops_transition_stats(self):
+        sm = self._makeCandidates()
+        ob = DummyContent()
+        ob.allowed = ('submit2',)
+        ob.state = 'private'
+        sm.transition_to_state(ob, object(), 'pending')
+        sm.freeze()
+        ob.state = 'private'
+        sm.transition_to_state(ob, object(), 'pending')
+        self.assertEqual(ob.state, 'pending')
+        self.assertEqual(sm.transition_stats,
+                         {'submit': [0, 1], 'submit2': [1, 0]})
+
+    def test_freeze_adaptive_guards(self):
+        from repoze.workflow.workflow import Workflow
+        sm = Workflow('state', 'private', adaptive_guards=True)
+        sm.add_state('private')
+        sm.freeze()
+        self.assertTrue(sm.guard_stats._frozen is not None)
+
+    def test_transition_to_state_does_not_build_state_info(self):
+        sm = self._makePopulated()
+        def state_info(*arg, **kw): # pragma: no cover
+            raise AssertionError('state info built')
+        sm._state_info = state_info
+        ob = DummyContent()
+        ob.state = 'pending'
+        sm.transition_to_state(ob, None, 'published')
+        self.assertEqual(ob.state, 'published')
+
     def test_callbackinfo_has_request(self):
         def transition_cb(content, info):
             self.assertEqual(info.request, request)
@@ -1113,6 +1692,185 @@ class TestGetWorkflow(unittest.TestCase):
             self._callFUT(IContent2, '', [specific_workflow]),
             specific_workflow)
 
+class TestGetWorkflows(unittest.TestCase):
+    def setUp(self):
+        cleanUp()
+
+    def tearDown(self):
+        cleanUp()
+
+    def _callFUT(self, contents, type, contexts=None, process_wf_list=None):
+        from repoze.workflow import get_workflows
+        if process_wf_list is None:
+            return get_workflows(contents, type, contexts)
+        return get_workflows(contents, type, contexts, process_wf_list)
+
+    def _register(self, workflow, content_type=None, elector=None):
+        from repoze.workflow.zcml import register_workflow
+        register_workflow(workflow, 'security', content_type, elector)
+
+    def test_no_workflows(self):
+        self.assertEqual(self._callFUT([DummyContent(), None], 'security'),
+                         [None, None])
+
+    def test_matches_get_workflow(self):
+        from zope.interface import Interface
+        from zope.interface import implementer
+        from repoze.workflow import get_workflow
+        from repoze.workflow.interfaces import IDefaultWorkflow
+        class IFoo(Interface):
+            pass
+        @implementer(IFoo)
+        class Foo(object):
+            pass
+        class Bar(object):
+            pass
+        default, foo = object(), object()
+        self._register(default)
+        self._register(foo, IFoo)
+        contents = [Foo(), Bar(), IFoo, Foo, IDefaultWorkflow, Bar()]
+        expected = [get_workflow(c, 'security') for c in contents]
+        self.assertEqual(expected, [foo, default, foo, default, default,
+                                    default])
+        self.assertEqual(self._callFUT(contents, 'security'), expected)
+
+    def test_resolves_once_per_spec(self):
+        from repoze.workflow.workflow import process_wf_list
+        calls = []
+        def process(wf_list, context):
+            calls.append(context)
+            return process_wf_list(wf_list, context)
+        workflow = object()
+        self._register(workflow, IDummyContent)
+        contents = [DummyContent() for i in range(5)]
+        result = self._callFUT(contents, 'security', contents, process)
+        self.assertEqual(result, [workflow] * 5)
+        self.assertEqual(calls, [None])
+
+    def test_electors(self):
+        from repoze.workflow.workflow import process_wf_list
+        calls = []
+        def process(wf_list, context):
+            calls.append(context)
+            return process_wf_list(wf_list, context)
+        elected, fallback = object(), object()
+        self._register(elected, IDummyContent,
+                       elector=lambda context: context == 'yes')
+        self._register(fallback, IDummyContent)
+        contents = [DummyContent() for i in range(3)]
+        result = self._callFUT(contents, 'security', ['yes', 'no', None],
+                               process)
+        self.assertEqual(result, [elected, fallback, fallback])
+        self.assertEqual(calls, [None, 'yes', 'no'])
+        self.assertEqual(self._callFUT(contents, 'security'),
+                         [fallback] * 3)
+
+    def test_default_elector(self):
+        elected, fallback = object(), object()
+        self._register(elected, elector=lambda context: context == 'yes')
+        self._register(fallback)
+        result = self._callFUT([DummyContent(), DummyContent()], 'security',
+                               ['yes', 'no'])
+        self.assertEqual(result, [elected, fallback])
+
+class TestGetTransitionsMany(unittest.TestCase):
+    def setUp(self):
+        cleanUp()
+
+    def tearDown(self):
+        cleanUp()
+
+    def _callFUT(self, contents, type, request, context_key=None,
+                 peek=False):
+        from repoze.workflow import get_transitions_many
+        return get_transitions_many(contents, type, request, context_key,
+                                    peek)
+
+    def _makeWorkflow(self, checker=None):
+        from repoze.workflow import Workflow
+        if checker is None:
+            checker = lambda permission, context, request: True
+        workflow = Workflow('state', 'private', checker)
+        workflow.add_state('private')
+        workflow.add_state('public')
+        workflow.add_transition('publish', 'private', 'public',
+                                permission='edit')
+        workflow.add_transition('hide', 'public', 'private',
+                                permission='admin')
+        workflow.add_transition('show', 'public', 'public')
+        return workflow
+
+    def _register(self, workflow, content_type=None, elector=None):
+        from repoze.workflow.zcml import register_workflow
+        register_workflow(workflow, 'security', content_type, elector)
+
+    def test_no_workflows(self):
+        self.assertEqual(self._callFUT([DummyContent()], 'security', None),
+                         [None])
+
+    def test_groups_by_state_and_context_key(self):
+        calls = []
+        def checker(permission, context, request):
+            calls.append((permission, context.acl))
+            return permission in context.acl
+        self._register(self._makeWorkflow(checker))
+        contents = []
+        for state, acl in [('private', ('edit',)), ('private', ('edit',)),
+                           ('public', ('edit',)), ('private', ()),
+                           ('public', ('admin',))]:
+            content = DummyContent()
+            content.state = state
+            content.acl = acl
+            contents.append(content)
+        result = self._callFUT(iter(contents), 'security', None,
+                               context_key=lambda content: content.acl)
+        names = [[t['name'] for t in transitions] for transitions in result]
+        self.assertEqual(names, [['publish'], ['publish'], ['show'], [],
+                                 ['hide', 'show']])
+        self.assertEqual(calls, [('edit', ('edit',)), ('admin', ('edit',)),
+                                 ('edit', ()), ('admin', ('admin',))])
+        result[0].append('mutated')
+        self.assertEqual(len(result[1]), 1)
+
+    def test_default_context_key_is_per_content(self):
+        calls = []
+        def checker(permission, context, request):
+            calls.append(permission)
+            return True
+        self._register(self._makeWorkflow(checker))
+        contents = [DummyContent(), DummyContent()]
+        for content in contents:
+            content.state = 'private'
+        result = self._callFUT(contents, 'security', None)
+        self.assertEqual(len(result[0]), 1)
+        self.assertEqual(calls, ['edit', 'edit'])
+
+    def test_initializes_unless_peek(self):
+        self._register(self._makeWorkflow())
+        ob1, ob2 = DummyContent(), DummyContent()
+        result = self._callFUT([ob1], 'security', None, peek=True)
+        self.assertEqual([t['name'] for t in result[0]], ['publish'])
+        self.assertFalse(hasattr(ob1, 'state'))
+        result = self._callFUT([ob2], 'security', None)
+        self.assertEqual([t['name'] for t in result[0]], ['publish'])
+        self.assertEqual(ob2.state, 'private')
+
+    def test_mixed_workflows(self):
+        from zope.interface import Interface
+        from zope.interface import alsoProvides
+        from repoze.workflow.testing import DummyWorkflow
+        class IOther(Interface):
+            pass
+        self._register(self._makeWorkflow())
+        dummy = DummyWorkflow(transitions=['dummy'])
+        self._register(dummy, IOther)
+        ob1, ob2 = DummyContent(), DummyContent()
+        alsoProvides(ob2, IOther)
+        ob1.state = 'public'
+        result = self._callFUT([ob1, ob2], 'security', None)
+        self.assertEqual([t['name'] for t in result[0]], ['hide', 'show'])
+        self.assertEqual(result[1], ['dummy'])
+
 class TestProcessWFList(unittest.TestCase):
     def _callFUT(self, wf_list, context):
         from repoze.workflow.workflow import process_wf_list
@@ -1189,9 +1947,156 @@ class TestProcessWFList(unittest.TestCase):
         result = self._callFUT(wflist, context)
         self.assertEqual(result, default1)
 
+    def test_materializes_lazy_workflow_returned(self):
+        from repoze.workflow.workflow import LazyWorkflow
+        workflow = object()
+        default = object()
+        built = []
+        def factory():
+            built.append(True)
+            return workflow
+        unused = LazyWorkflow(factory)
+        def elector(context):
+            return True
+        wflist = [
+            {'elector':elector, 'workflow':LazyWorkflow(lambda: default)},
+            {'elector':None, 'workflow':LazyWorkflow(factory)},
+            {'elector':None, 'workflow':unused},
+            ]
+        self.assertEqual(self._callFUT(wflist, None), workflow)
+        self.assertEqual(self._callFUT(wflist, None), workflow)
+        self.assertEqual(built, [True])
+        self.assertTrue(wflist[1]['workflow'] is workflow)
+        self.assertTrue(isinstance(wflist[0]['workflow'], LazyWorkflow))
+        self.assertTrue(wflist[2]['workflow'] is unused)
+        self.assertEqual(self._callFUT(wflist, object()), default)
+        self.assertTrue(wflist[0]['workflow'] is default)
+
+class TestLazyWorkflow(unittest.TestCase):
+    def _makeOne(self, factory):
+        from repoze.workflow.workflow import LazyWorkflow
+        return LazyWorkflow(factory)
+
+    def test_materialize_once(self):
+        workflow = object()
+        calls = []
+        def factory():
+            calls.append(True)
+            return workflow
+        lazy = self._makeOne(factory)
+        self.assertTrue(lazy.materialize() is workflow)
+        self.assertTrue(lazy.materialize() is workflow)
+        self.assertEqual(calls, [True])
+        self.assertEqual(lazy.factory, None)
+
+    def test_materialize_threads(self):
+        import threading
+        import time
+        calls = []
+        def factory():
+            calls.append(True)
+            time.sleep(0.01)
+            return object()
+        lazy = self._makeOne(factory)
+        results = []
+        def resolve():
+            results.append(lazy.materialize())
+        threads = [threading.Thread(target=resolve) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(map(id, results))), 1)
+
+class TestPrepareForFork(unittest.TestCase):
+    def setUp(self):
+        cleanUp()
+
+    def tearDown(self):
+        import gc
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+        cleanUp()
+
+    def _callFUT(self, registry=None):
+        from repoze.workflow import prepare_for_fork
+        return prepare_for_fork(registry)
+
+    def _makeWorkflow(self):
+        from repoze.workflow.workflow import Workflow
+        workflow = Workflow('state', 'private')
+        workflow.add_state('private')
+        return workflow
+
+    def test_freezes_registered_workflows(self):
+        from repoze.workflow.composite import CompositeWorkflow
+        from repoze.workflow.workflow import LazyWorkflow
+        from repoze.workflow.zcml import register_workflows
+        workflow = self._makeWorkflow()
+        lazy = LazyWorkflow(self._makeWorkflow)
+        composite = CompositeWorkflow([('region', self._makeWorkflow())])
+        register_workflows(workflow, 'security', [IDummyContent, None], None)
+        register_workflows(lazy, 'lazy', [IDummyContent], None)
+        register_workflows(composite, 'composite', [IDummyContent],
+                           None)
+        register_workflows(DummyWorkflowObject(), 'other', [IDummyContent],
+                           None)
+        prepared = self._callFUT()
+        self.assertEqual(len(prepared), 3)
+        self.assertTrue(workflow.frozen)
+        self.assertTrue(lazy.workflow.frozen)
+        self.assertTrue(lazy.workflow in prepared)
+        self.assertTrue(composite.regions['region'].frozen)
+
+    def test_registry(self):
+        from zope.interface.registry import Components
+        from repoze.workflow.interfaces import IWorkflowList
+        registry = Components()
+        workflow = self._makeWorkflow()
+        registry.registerAdapter([{'workflow': workflow, 'elector': None}],
+                                 (IDummyContent,), IWorkflowList, 'security')
+        self.assertEqual(self._callFUT(registry), [workflow])
+class IDummyContent(Interface):
+    pass
+
+class DummyWorkflowObject:
+    pass
+
+@implementer(IDummyContent)
 class DummyContent:
     pass
 
+@implementer(IBatchPermissionChecker)
+class DummyBatchChecker:
+    def __init__(self, allowed):
+        self._allowed = set(allowed)
+        self.calls = []
+        self.batches = []
+
+    def __call__(self, permission, context, request):
+        self.calls.append((permission, context, request))
+        return permission in self._allowed
+
+    def allowed(self, permissions, context, request):
+        self.batches.append((permissions, context, request))
+        return permissions & self._allowed
+
+class DummyFuture:
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+class DummyExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args[0])
+        return DummyFuture(fn(*args))
+
 class DummyCallbackInfo:
     def __init__(self, workflow=None, transition=None):
         self.workflow = workflow
@@ -19,6 +19,10 @@ class TestWorkflowDirective(unittest.TestCase):
         return self._getTargetClass()(context, type, name, state_attr,
                                       initial_state, content_types)
 
+    def _execute(self, directive):
+        for action in directive.context.actions:
+            action['callable'](*action['args'], **action['kw'])
+
     def test_ctor_with_state_attr(self):
         workflow = self._makeOne(name='public', state_attr='public2')
         self.assertEqual(workflow.state_attr, 'public2')
@@ -49,19 +53,28 @@ class TestWorkflowDirective(unittest.TestCase):
                                 ]
         directive.after()
         actions = directive.context.actions
-        self.assertEqual(len(actions), 2)
-
-        action = actions[0]
-        self.assertEqual(action['info'], None)
-        self.assertEqual(action['kw'], {})
-        self.assertEqual(action['args'], (IDummy,))
-        self.assertEqual(action['includepath'], ())
+        self.assertEqual(len(actions), 3)
+
+        # one action per content type, for conflict detection
+        for action, content_type in zip(actions, (IDummy, IDummy2)):
+            self.assertEqual(action['info'], None)
+            self.assertEqual(action['kw'], {})
+            self.assertEqual(action['args'], (content_type,))
+            self.assertEqual(action['includepath'], ())
+            self.assertEqual(action['order'], 0)
+            self.assertEqual(action['discriminator'],
+                             (IWorkflow, content_type, None, 'security',
+                              None))
+            callback = action['callable']
+            self.assertEqual(type(callback), types.FunctionType)
+
+        # then a single action which registers them all
+        action = actions[2]
+        self.assertEqual(action['args'], ())
         self.assertEqual(action['order'], 0)
-        self.assertEqual(action['discriminator'],
-                         (IWorkflow, IDummy, None, 'security', None))
-        callback = action['callable']
-        self.assertEqual(type(callback), types.FunctionType)
-        callback(IDummy)
+        self.assertEqual(action['discriminator'], None)
+        self.assertEqual(type(action['callable']), types.FunctionType)
+        self._execute(directive)
         sm = getSiteManager()
         wflist = sm.adapters.lookup((IDummy,), IWorkflowList, name='security')
         self.assertEqual(len(wflist), 1)
@@ -91,46 +104,124 @@ class TestWorkflowDirective(unittest.TestCase):
              })
         self.assertEqual(workflow.initial_state, 'public')
 
-        action = actions[1]
-        self.assertEqual(action['info'], None)
-        self.assertEqual(action['kw'], {})
-        self.assertEqual(action['args'], (IDummy2,))
-        self.assertEqual(action['includepath'], ())
-        self.assertEqual(action['order'], 0)
-        self.assertEqual(action['discriminator'],
-                                (IWorkflow, IDummy2, None, 'security', None))
-        callback = action['callable']
-        self.assertEqual(type(callback), types.FunctionType)
-        callback(IDummy2)
-        sm = getSiteManager()
         wflist = sm.adapters.lookup((IDummy2,), IWorkflowList, name='security')
         self.assertEqual(len(wflist), 1)
         wf_dict = wflist[0]
         self.assertEqual(wf_dict['elector'], None)
-        self.assertEqual(wf_dict['workflow'].__class__, Workflow)
-        workflow = wf_dict['workflow']
-        self.assertEqual(
-            workflow._state_data,
-            {'public':
-                {'callback': None, 'title': 'public', 'b': 2},
-             'private':
-                {'callback': None, 'title': 'Private', 'a': 1},
-             })
-        self.assertEqual(
-            workflow._transition_data,
-            {'make_public':
-             {'from_state': 'private', 'callback': None,
-              'guards': [], 'name': 'make_public', 
-              'to_state': 'public', 'permission':None, 
-              'title': 'make_public'},
-             'make_private':
-             {'from_state': 'private', 'callback': None,
-              'guards': [], 'name': 'make_private', 
-              'to_state': 'public', 'permission':None, 
-              'title': 'Retract'},
-             }
-            )
-        self.assertEqual(workflow.initial_state, 'public')
+        self.assertTrue(wf_dict['workflow'] is workflow)
+
+    def test_after_registers_surviving_content_types(self):
+        from zope.interface import Interface
+        from zope.component import getSiteManager
+        from repoze.workflow.workflow import IWorkflowList
+        class IDummy(Interface):
+            pass
+        class IDummy2(Interface):
+            pass
+        directive = self._makeOne(initial_state='public', type='security',
+                                  content_types=(IDummy, IDummy2))
+        directive.states = [DummyState('public')]
+        directive.after()
+        # the action for IDummy lost a conflict (e.g. to an override)
+        del directive.context.actions[0]
+        self._execute(directive)
+        sm = getSiteManager()
+        self.assertEqual(sm.adapters.lookup((IDummy,), IWorkflowList,
+                                            name='security'), None)
+        wflist = sm.adapters.lookup((IDummy2,), IWorkflowList,
+                                    name='security')
+        self.assertEqual(len(wflist), 1)
+
+    def test_after_with_state_store_and_deferred_queue(self):
+        from zope.interface import Interface
+        from zope.component import getSiteManager
+        from repoze.workflow.workflow import IWorkflowList
+        class IDummy(Interface):
+            pass
+        store = object()
+        directive = self._makeOne(initial_state='public', type='security',
+                                  content_types=(IDummy,))
+        queue = object()
+        directive.state_store = store
+        directive.deferred_queue = queue
+        directive.states = [DummyState('public')]
+        directive.after()
+        self._execute(directive)
+        sm = getSiteManager()
+        wflist = sm.adapters.lookup((IDummy,), IWorkflowList, name='security')
+        self.assertTrue(wflist[0]['workflow'].state_store is store)
+        self.assertTrue(wflist[0]['workflow'].deferred_queue is queue)
+
+    def test_after_with_workflow_options(self):
+        from zope.interface import Interface
+        from zope.component import getSiteManager
+        from repoze.workflow.workflow import IWorkflowList
+        class IDummy(Interface):
+            pass
+        cache = object()
+        directive = self._makeOne(initial_state='public', type='security',
+                                  content_types=(IDummy,))
+        directive.idempotency_cache = cache
+        directive.adaptive_guards = True
+        directive.deterministic = True
+        directive.states = [DummyState('public')]
+        directive.after()
+        self._execute(directive)
+        sm = getSiteManager()
+        wflist = sm.adapters.lookup((IDummy,), IWorkflowList, name='security')
+        workflow = wflist[0]['workflow']
+        self.assertTrue(workflow.idempotency_cache is cache)
+        self.assertTrue(workflow.guard_stats is not None)
+        self.assertTrue(workflow.deterministic)
+
+    def test_after_lazy(self):
+        from zope.interface import Interface
+        from zope.interface import directlyProvides
+        from zope.component import getSiteManager
+        from repoze.workflow.guards import ExpressionGuard
+        from repoze.workflow.workflow import IWorkflowList
+        from repoze.workflow.workflow import LazyWorkflow
+        from repoze.workflow.workflow import Workflow
+        from repoze.workflow.workflow import get_workflow
+        class IDummy(Interface):
+            pass
+        directive = self._makeOne(initial_state='private', type='security',
+                                  content_types=(IDummy,))
+        directive.lazy = True
+        directive.states = [DummyState('private'), DummyState('public')]
+        transition = DummyTransition('publish')
+        transition.guards = ['context.ok']
+        directive.transitions = [transition]
+        directive.after()
+        self.assertEqual(transition.guards, ['context.ok'])
+        self._execute(directive)
+        sm = getSiteManager()
+        wflist = sm.adapters.lookup((IDummy,), IWorkflowList, name='security')
+        self.assertTrue(isinstance(wflist[0]['workflow'], LazyWorkflow))
+        content = DummyContext()
+        directlyProvides(content, IDummy)
+        workflow = get_workflow(IDummy, 'security', content)
+        self.assertEqual(workflow.__class__, Workflow)
+        self.assertTrue(wflist[0]['workflow'] is workflow)
+        self.assertTrue(get_workflow(IDummy, 'security') is workflow)
+        guard, = workflow._transition_data['publish']['guards']
+        self.assertTrue(isinstance(guard, ExpressionGuard))
+
+    def test_after_lazy_invalid(self):
+        from zope.configuration.exceptions import ConfigurationError
+        from zope.interface import Interface
+        from repoze.workflow.workflow import get_workflow
+        class IDummy(Interface):
+            pass
+        directive = self._makeOne(initial_state='private', type='security',
+                                  content_types=(IDummy,))
+        directive.lazy = True
+        directive.states = [DummyState('private')]
+        directive.transitions = [DummyTransition('publish')]
+        directive.after()
+        self._execute(directive)
+        self.assertRaises(ConfigurationError, get_workflow, IDummy,
+                          'security')
 
     def test_after_warns_if_no_content_types(self):
         import warnings
@@ -157,10 +248,41 @@ class TestWorkflowDirective(unittest.TestCase):
                                   DummyTransition('make_public'),
                                   ]
         directive.after()
-        actions = directive.context.actions
-        action = actions[0]
-        callback = action['callable']
-        self.assertRaises(ConfigurationError, callback, IDummy)
+        self.assertRaises(ConfigurationError, self._execute, directive)
+
+    def test_after_compiles_guard_expressions(self):
+        from zope.interface import Interface
+        from zope.component import getSiteManager
+        from repoze.workflow.guards import ExpressionGuard
+        from repoze.workflow.workflow import IWorkflowList
+        class IDummy(Interface):
+            pass
+        def function(context, info): # pragma: no cover
+            pass
+        directive = self._makeOne(initial_state='private', type='security',
+                                  content_types=(IDummy,))
+        directive.states = [DummyState('private'), DummyState('public')]
+        transition = DummyTransition('make_public')
+        transition.guards = ['context.ready', function]
+        directive.transitions = [transition]
+        directive.after()
+        guard, other = transition.guards
+        self.assertTrue(isinstance(guard, ExpressionGuard))
+        self.assertTrue(other is function)
+        self._execute(directive)
+        sm = getSiteManager()
+        wflist = sm.adapters.lookup((IDummy,), IWorkflowList, name='security')
+        workflow = wflist[0]['workflow']
+        self.assertEqual(workflow._transition_data['make_public']['guards'],
+                         [guard, function])
+
+    def test_after_raises_error_for_bad_guard_expression(self):
+        from zope.configuration.exceptions import ConfigurationError
+        directive = self._makeOne(initial_state='private')
+        transition = DummyTransition('make_public')
+        transition.guards = ['context.ready(']
+        directive.transitions = [transition]
+        self.assertRaises(ConfigurationError, directive.after)
 
     def test_after_raises_error_during_state_add(self):
         from zope.interface import Interface
@@ -172,10 +294,7 @@ class TestWorkflowDirective(unittest.TestCase):
         directive.states = [ DummyState('public', a=1),
                              DummyState('public', b=2) ]
         directive.after()
-        actions = directive.context.actions
-        action = actions[0]
-        callback = action['callable']
-        self.assertRaises(ConfigurationError, callback, IDummy)
+        self.assertRaises(ConfigurationError, self._execute, directive)
 
     def test_after_raises_error_during_check(self):
         from zope.interface import Interface
@@ -186,10 +305,7 @@ class TestWorkflowDirective(unittest.TestCase):
                                   content_types=(IDummy,))
         directive.states = [ DummyState('only', a=1)]
         directive.after()
-        actions = directive.context.actions
-        action = actions[0]
-        callback = action['callable']
-        self.assertRaises(ConfigurationError, callback, IDummy)
+        self.assertRaises(ConfigurationError, self._execute, directive)
 
 class TestTransitionDirective(unittest.TestCase):
     def setUp(self):
@@ -218,6 +334,11 @@ class TestTransitionDirective(unittest.TestCase):
         self.assertEqual(directive.permission, 'permission')
         self.assertEqual(directive.extras, {})
 
+    def test_ctor_deferred(self):
+        directive = self._getTargetClass()('context', 'name', 'from_state',
+                                           'to_state', deferred=True)
+        self.assertEqual(directive.extras, {'deferred': True})
+
     def test_after(self):
         context = DummyContext(transitions=[])
         directive = self._makeOne(context)
@@ -243,6 +364,14 @@ class TestStateDirective(unittest.TestCase):
         self.assertEqual(directive.context, 'context')
         self.assertEqual(directive.name, 'name')
 
+    def test_ctor_deferred(self):
+        directive = self._getTargetClass()('context', 'name', deferred=True)
+        self.assertEqual(directive.extras, {'deferred': True})
+
+    def test_ctor_parent(self):
+        directive = self._getTargetClass()('context', 'name', parent='review')
+        self.assertEqual(directive.extras, {'parent': 'review'})
+
     def test_after(self):
         context = DummyContext(states=[])
         directive = self._makeOne(context)
@@ -272,6 +401,31 @@ class TestGuard(unittest.TestCase):
         self._callFUT(context, example)
         self.assertEqual(context.guards, [example])
 
+    def test_expression(self):
+        from repoze.workflow.zcml import guard_function
+        context = DummyTransition('dummy')
+        guard_function(context, expression='context.ready == True')
+        self.assertEqual(context.guards, ['context.ready == True'])
+
+    def test_order_independent(self):
+        from repoze.workflow.zcml import guard_function
+        context = DummyTransition('dummy')
+        def example(context, transition):  # pragma: NO COVER
+            return None
+        guard_function(context, example, order_independent=True)
+        marked, = context.guards
+        self.assertTrue(marked.guard is example)
+        self.assertTrue(marked.order_independent)
+        self.assertFalse(hasattr(example, 'order_independent'))
+
+    def test_neither_or_both(self):
+        from zope.configuration.exceptions import ConfigurationError
+        from repoze.workflow.zcml import guard_function
+        context = DummyTransition('dummy')
+        self.assertRaises(ConfigurationError, guard_function, context)
+        self.assertRaises(ConfigurationError, guard_function, context,
+                          object(), 'context.ready')
+
 class TestAlias(unittest.TestCase):
     def _callFUT(self, context, name):
         from repoze.workflow.zcml import alias
@@ -362,6 +516,27 @@ class TestFixtureApp(unittest.TestCase):
               'title': 'public_to_private'}
             )
 
+    def test_conflicting_content_types(self):
+        from zope.configuration import xmlconfig
+        from zope.configuration.config import ConfigurationConflictError
+        text = """
+        <configure xmlns="http://namespaces.repoze.org/bfg">
+          <include package="repoze.workflow" file="meta.zcml"/>
+          <workflow type="security" name="one" state_attr="state"
+             initial_state="private"
+             content_types="repoze.workflow.tests.fixtures.dummy.IContent">
+            <state name="private"/>
+          </workflow>
+          <workflow type="security" name="two" state_attr="state"
+             initial_state="private"
+             content_types="repoze.workflow.tests.fixtures.dummy.IContent2
+                            repoze.workflow.tests.fixtures.dummy.IContent">
+            <state name="private"/>
+          </workflow>
+        </configure>
+        """
+        self.assertRaises(ConfigurationConflictError, xmlconfig.string, text)
+
 class TestRegisterWorkflow(unittest.TestCase):
     def setUp(self):
         cleanUp()
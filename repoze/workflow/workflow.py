@@ -1,8 +1,13 @@
+import gc
+import threading
+
 from repoze.workflow.interfaces import IWorkflow
 from repoze.workflow.interfaces import IWorkflowFactory
 from repoze.workflow.interfaces import IWorkflowList
 from repoze.workflow.interfaces import IDefaultWorkflow
 from repoze.workflow.interfaces import ICallbackInfo
+from repoze.workflow.interfaces import IBatchPermissionChecker
+from repoze.workflow.storage import AttributeStateStore
 
 from zope.interface import implementer
 from zope.interface import providedBy
@@ -11,10 +16,16 @@ from zope.interface.interfaces import IInterface
 from zope.component import getSiteManager
 
 _marker = object()
+_cache_lock = threading.Lock() # see Workflow._idempotency
 
 class WorkflowError(Exception):
     pass
 
+class TransitionInProgress(WorkflowError):
+    """ Raised when the idempotency key of a transition is held by a
+    transition still under way: the transition may be retried later.
+    """
+
 @provider(IWorkflowFactory)
 @implementer(IWorkflow)
 class Workflow(object):
@@ -22,33 +33,93 @@ class Workflow(object):
     """
 
     def __init__(self, state_attr, initial_state, permission_checker=None,
-                 name='', description=''):
+                 name='', description='', state_store=None,
+                 deferred_queue=None, idempotency_cache=None,
+                 adaptive_guards=False, deterministic=False):
         """
         o state_attr - attribute name where a given object's current
                        state will be stored (object is responsible for
                        persisting)
 
+        o state_store - an ``IStateStore`` used to read and write
+                        states; defaults to an ``AttributeStateStore``
+                        using ``state_attr``
+
+        o deferred_queue - a queue (such as a ``DeferredCallbackQueue``)
+                           to which the callbacks of states and
+                           transitions marked ``deferred`` are handed
+                           instead of being called during a transition;
+                           if it has a ``validate`` method, each
+                           deferred callback is passed to it before any
+                           callback of the transition is called
+
+        o idempotency_cache - an ``IdempotencyCache`` holding the
+                              idempotency keys of the transitions
+                              executed; defaults to an in-memory
+                              ``IdempotencyCache`` created on first
+                              use
+
+        o adaptive_guards - if true, guards marked order-independent
+                            are called in the order of their observed
+                            cost and veto rate (see ``guard_stats``)
+
+        o deterministic - if true, ``transition_to_state`` tries the
+                          candidate transitions in the order in which
+                          they were added rather than most likely to
+                          succeed first (see ``transition_stats``)
+
         """
         self._transition_data = {}
         self._state_data = {}
         self._state_aliases = {}
+        self._state_parents = {}
+        self._ancestors = {} # state -> (state, parent, grandparent, ...)
+        self._descendants = {} # state -> set of all its sub-states
+        self._index = None # see _leaving
         self.state_attr = state_attr
         self.initial_state = initial_state
         self.permission_checker = permission_checker
         self.name = name
         self.description = description
+        if state_store is None:
+            state_store = AttributeStateStore(state_attr)
+        self.state_store = state_store
+        self.deferred_queue = deferred_queue
+        self.idempotency_cache = idempotency_cache
+        self.deterministic = deterministic
+        self.transition_stats = {} # name -> [successes, failures]
+        self.guard_stats = None
+        if adaptive_guards:
+            from repoze.workflow.guards import GuardStats
+            self.guard_stats = GuardStats()
+        self.frozen = False # see freeze
 
     def __call__(self, context):
         return self # allow ourselves to act as an adapter
 
     def add_state(self, state_name, callback=None, aliases=(),
-                  title=None, **kw):
+                  title=None, parent=None, **kw):
         """ Add a state to the FSM.  ``**kw`` must not contain the key
-        ``callback``.  This name is reserved for internal use."""
+        ``callback``.  This name is reserved for internal use.
+
+        If ``parent`` is not None, the new state is a sub-state of the
+        (already defined) state named ``parent``: the transitions
+        leaving ``parent`` or any of its ancestors also leave the new
+        state."""
+        self._check_frozen()
         if state_name in self._state_data:
             raise WorkflowError('State %s already defined' % state_name)
         if state_name in self._state_aliases:
             raise WorkflowError('State %s already aliased' % state_name)
+        if parent is not None:
+            if parent not in self._state_data:
+                raise WorkflowError('No such parent state %r' % parent)
+            lineage = self._ancestors.get(parent, (parent,))
+            self._state_parents[state_name] = parent
+            self._ancestors[state_name] = (state_name,) + lineage
+            for ancestor in lineage:
+                self._descendants.setdefault(ancestor, set()).add(state_name)
+            self._index = None
         kw['callback'] = callback
         if title is None:
             title = state_name
@@ -61,7 +132,10 @@ class Workflow(object):
                        callback=None, permission=None, title=None, **kw):
         """ Add a transition to the FSM.  ``**kw`` must not contain
         any of the keys ``from_state``, ``name``, ``to_state``, or
-        ``callback``; these are reserved for internal use."""
+        ``callback``; these are reserved for internal use.  Guards
+        passed as ``guards`` may be guard expression strings (see
+        ``repoze.workflow.guards``), which are compiled here."""
+        self._check_frozen()
         if transition_name in self._transition_data:
             raise WorkflowError('Duplicate transition name %s' %
                                     transition_name)
@@ -73,6 +147,9 @@ class Workflow(object):
             raise WorkflowError(
                 'Permission %r defined without permission checker on '
                 'workflow' % permission)
+        if kw.get('guards'):
+            from repoze.workflow.guards import compile_guard
+            kw['guards'] = [compile_guard(guard) for guard in kw['guards']]
         transition = kw
         transition['name'] = transition_name
         transition['from_state'] = from_state
@@ -83,6 +160,62 @@ class Workflow(object):
             title = transition_name
         transition['title'] = title
         self._transition_data[transition_name] = transition
+        self._index = None
+
+    def _check_frozen(self):
+        if self.frozen:
+            raise WorkflowError('Workflow %r is frozen' % self.name)
+
+    def freeze(self):
+        """ Prepare the workflow to be shared by forked processes: build
+        the index of the transitions leaving each state and the default
+        idempotency cache now rather than on first use, and stop
+        updating ``transition_stats`` and the statistics of adaptive
+        guards (keeping the order they have established), so that using
+        the workflow no longer writes to the objects it is made of.  A
+        frozen workflow cannot be changed: ``add_state`` and
+        ``add_transition`` raise a ``WorkflowError``.
+        """
+        self._leaving(self.initial_state)
+        count, by_state, leaving = self._index
+        for state in self._state_data:
+            leaving[state] = tuple(self._leaving(state))
+        if self.guard_stats is not None:
+            self.guard_stats.freeze()
+        self._idempotency()
+        self.frozen = True
+
+    def _leaving(self, state):
+        # Return the transitions leaving ``state``: those leaving the
+        # state itself, then those leaving each of its ancestors, nearest
+        # first.  The index is rebuilt when transitions are added,
+        # including by writing to ``_transition_data`` directly.
+        transition_data = self._transition_data
+        index = self._index
+        if index is None or index[0] != len(transition_data):
+            by_state = {}
+            for transition in transition_data.values():
+                by_state.setdefault(transition['from_state'],
+                                    []).append(transition)
+            index = self._index = (len(transition_data), by_state, {})
+        count, by_state, leaving = index
+        transitions = leaving.get(state)
+        if transitions is None:
+            transitions = []
+            for ancestor in self._ancestors.get(state, (state,)):
+                transitions.extend(by_state.get(ancestor, ()))
+            leaving[state] = transitions
+        return transitions
+
+    def parent_of(self, state_name):
+        """ Return the name of the parent of the state named
+        ``state_name``, or None if it is not a sub-state. """
+        return self._state_parents.get(state_name)
+
+    def substates_of(self, state_name):
+        """ Return the set of the names of all the sub-states of the
+        state named ``state_name`` (at any depth). """
+        return set(self._descendants.get(state_name, ()))
 
     def check(self):
         if self.initial_state not in self._state_data:
@@ -90,69 +223,147 @@ class Workflow(object):
                                 % self.initial_state)
 
     def _state_of(self, content):
-        state = getattr(content, self.state_attr, None)
+        state = self.state_store.get(content)
         state_name = self._state_aliases.get(state, state)
         return state_name
 
-    def state_of(self, content):
+    def state_of(self, content, peek=False):
         if content is None: # for add forms
             return self.initial_state
         state = self._state_of(content)
         if state is None:
+            if peek:
+                return self.initial_state
             state, msg = self.initialize(content)
         return state
 
     def has_state(self, content):
         return self._state_of(content) is not None
 
-    def _state_info(self, content, from_state=None):
-        content_state = self.state_of(content)
+    def in_state(self, content, state_name, peek=False):
+        state = self.state_of(content, peek)
+        return (state == state_name or
+                state in self._descendants.get(state_name, ()))
+
+    def states_of(self, contents, request=None, initialize=True):
+        contents = list(contents)
+        aliases = self._state_aliases
+        initial_state = self.initial_state
+        raw = iter(self.state_store.get_many(
+            [content for content in contents if content is not None]))
+        states = []
+        uninitialized = []
+        for content in contents:
+            if content is None: # for add forms
+                states.append(initial_state)
+                continue
+            state = next(raw)
+            state = aliases.get(state, state)
+            if state is None and initialize:
+                uninitialized.append(content)
+                state = initial_state
+            states.append(state)
+        if uninitialized:
+            self._initialize_many(uninitialized, request)
+        return states
+
+    def group_by_state(self, contents, request=None, initialize=True):
+        contents = list(contents)
+        groups = {}
+        for content, state in zip(
+            contents, self.states_of(contents, request, initialize)):
+            groups.setdefault(state, []).append(content)
+        return groups
+
+    def _state_info(self, content, from_state=None, peek=False):
+        content_state = self.state_of(content, peek)
         if from_state is None:
             from_state = content_state
 
+        by_target = {}
+        for transition in self._leaving(from_state):
+            by_target.setdefault(transition['to_state'], []).append(transition)
+
         L = []
 
         for state_name, state in self._state_data.items():
             state = self._state_data[state_name]
-            D = {'name': state_name, 'transitions': []}
+            D = {'name': state_name}
+            D['transitions'] = by_target.get(state_name, [])
             D['data'] = state
             D['initial'] = state_name == self.initial_state
             D['current'] = state_name == content_state
             D['title'] = state.get('title', state_name)
-            for tname, transition in self._transition_data.items():
-                if (transition['from_state'] == from_state and
-                    transition['to_state'] == state_name):
-                    transitions = D['transitions']
-                    transitions.append(transition)
             L.append(D)
 
         return L
 
-    def state_info(self, content, request, context=None, from_state=None):
+    def state_info(self, content, request, context=None, from_state=None,
+                   peek=False, executor=None):
         if context is None:
             context = content
-        states = self._state_info(content, from_state)
+        states = self._state_info(content, from_state, peek)
+        allowed = self._allowed(
+            [t for state in states for t in state['transitions']],
+            context, request, executor)
         for state in states:
             L = []
             for transition in state['transitions']:
                 permission = transition.get('permission')
                 if permission is not None:
-                    if not self.permission_checker(permission, context,
-                                                   request):
+                    if allowed is not None:
+                        if permission not in allowed:
+                            continue
+                    elif not self.permission_checker(permission, context,
+                                                     request):
                         continue
                 L.append(transition)
             state['transitions'] = L
         return states
 
+    def _allowed(self, transitions, context, request, executor=None):
+        # Return the set of permissions allowed among those required
+        # by ``transitions`` using a single call to a batch permission
+        # checker, or by checking each distinct permission concurrently
+        # on ``executor``; return None if neither is possible.
+        checker = self.permission_checker
+        batch = IBatchPermissionChecker.providedBy(checker)
+        if checker is None or not (batch or executor is not None):
+            return None
+        permissions = []
+        for transition in transitions:
+            permission = transition.get('permission')
+            if permission is not None and permission not in permissions:
+                permissions.append(permission)
+        if not permissions:
+            return set()
+        if batch:
+            return set(checker.allowed(set(permissions), context, request))
+        futures = [(permission,
+                    executor.submit(checker, permission, context, request))
+                   for permission in permissions]
+        return set([permission for permission, future in futures
+                    if future.result()])
+
     def initialize(self, content, request=None):
         callback = self._state_data[self.initial_state]['callback']
         msg = None
         if callback is not None:
             info = CallbackInfo(self, {}, request)
             msg = callback(content, info)
-        setattr(content, self.state_attr, self.initial_state)
+        self.state_store.set(content, self.initial_state)
         return self.initial_state, msg
 
+    def _initialize_many(self, contents, request=None):
+        callback = self._state_data[self.initial_state]['callback']
+        if callback is not None:
+            for content in contents:
+                info = CallbackInfo(self, {}, request)
+                callback(content, info)
+        initial_state = self.initial_state
+        self.state_store.set_many(
+            [(content, initial_state) for content in contents])
+
     def reset(self, content, request=None):
         state = self._state_of(content)
         if state is None:
@@ -168,10 +379,23 @@ class Workflow(object):
         if callback is not None:
             info = CallbackInfo(self, {}, request)
             msg = callback(content, info)
-        setattr(content, self.state_attr, state)
+        self.state_store.set(content, state)
         return state, msg
 
-    def _transition(self, content, transition_name, context, request, guards):
+    def _find_transition(self, state, transition_name):
+        # transition names are unique: the named transition applies if
+        # it leaves the state itself or one of its ancestors
+        candidate = self._transition_data.get(transition_name)
+        if (candidate is not None and
+            candidate['from_state'] in self._ancestors.get(state, (state,))):
+            return candidate
+
+        raise WorkflowError(
+            'No transition from %r using transition name %r'
+            % (state, transition_name))
+
+    def _transition(self, content, transition_name, context, request, guards,
+                    memo=None):
         """ Execute a transition via a transition name
 
         ``content`` is the object being managed.
@@ -185,6 +409,10 @@ class Workflow(object):
         ``guards`` is a sequence of callables taking ``(context, info)``;
         a guard vetoes the transition by raising ``WorkflowError``.
 
+        ``memo`` is a dictionary in which the values of guard conditions
+        are shared with the other candidates of ``transition_to_state``,
+        or None.
+
         .. note:: guards defined on the transition itself will always be
                   called, in addition to any guards passed in.
         """
@@ -193,21 +421,33 @@ class Workflow(object):
 
         state = self.state_of(content)
 
-        si = (state, transition_name)
+        transition = self._find_transition(state, transition_name)
+
+        info = CallbackInfo(self, transition, request=request)
 
-        transition = None
-        for tname, candidate in self._transition_data.items():
-            match = (candidate['from_state'], candidate['name'])
-            if si == match:
-                transition = candidate
-                break
+        if memo is None:
+            self._check_guards(transition, guards, context, info)
+        else:
+            from repoze.workflow.guards import shared_conditions
+            with shared_conditions(memo):
+                self._check_guards(transition, guards, context, info)
+            # the callbacks may change the content
+            memo.clear()
 
-        if transition is None:
-            raise WorkflowError(
-                'No transition from %r using transition name %r'
-                % (state, transition_name))
+        deferred = self._run_callbacks(transition, content, info)
 
-        info = CallbackInfo(self, transition, request=request)
+        self.state_store.set(content, transition['to_state'])
+
+        for callback in deferred:
+            self.deferred_queue.put(callback, content, info)
+
+    def _check_guards(self, transition, guards, context, info):
+        # call the guards of the transition, then ``guards``; with
+        # adaptive guards, let ``guard_stats`` order them
+        if self.guard_stats is not None:
+            guards = list(transition.get('guards', ())) + list(guards)
+            self.guard_stats.run(guards, context, info)
+            return
 
         for guard in transition.get('guards', ()):
             guard(context, info)
@@ -215,21 +455,68 @@ class Workflow(object):
         for guard in guards:
             guard(context, info)
 
-        from_state = transition['from_state']
-        to_state = transition['to_state']
-
-        transition_callback = transition['callback']
-        if transition_callback is not None:
-            transition_callback(content, info)
-
-        state_callback = self._state_data[to_state]['callback']
-        if state_callback is not None:
-            state_callback(content, info)
-
-        setattr(content, self.state_attr, to_state)
+    def _callbacks(self, transition):
+        # the callbacks of ``transition`` and of the state it leads to,
+        # as ``(callback, deferred)`` pairs: a callback is deferred if
+        # its transition or state asks for it and we have a queue, which
+        # may reject it (e.g. an outbox, a callback it cannot record)
+        callbacks = []
+        queue = self.deferred_queue
+        validate = getattr(queue, 'validate', None)
+        for data in (transition, self._state_data[transition['to_state']]):
+            callback = data['callback']
+            if callback is not None:
+                defer = queue is not None and bool(data.get('deferred'))
+                if defer and validate is not None:
+                    validate(callback)
+                callbacks.append((callback, defer))
+        return callbacks
+
+    def _run_callbacks(self, transition, content, info):
+        # call the callbacks of ``transition`` which are not deferred and
+        # return those which are, to be queued once the state is written
+        deferred = []
+        for callback, defer in self._callbacks(transition):
+            if defer:
+                deferred.append(callback)
+            else:
+                callback(content, info)
+        return deferred
+
+    def _idempotency(self):
+        # the idempotency cache, created on first use: a cache holds a
+        # lock, so that a workflow which never uses one can be pickled
+        # and copied
+        cache = self.idempotency_cache
+        if cache is None:
+            with _cache_lock:
+                cache = self.idempotency_cache
+                if cache is None:
+                    from repoze.workflow.idempotency import IdempotencyCache
+                    cache = self.idempotency_cache = IdempotencyCache()
+        return cache
+
+    def _once(self, idempotency_key, func, *arg, **kw):
+        # call ``func`` unless a transition with ``idempotency_key`` was
+        # already executed; the key is recorded only once ``func`` has
+        # written the new state, and released if ``func`` fails so that
+        # it may be retried
+        cache = self._idempotency()
+        if not cache.claim(idempotency_key):
+            return
+        try:
+            result = func(*arg, **kw)
+        except:
+            cache.release(idempotency_key)
+            raise
+        cache.done(idempotency_key)
+        return result
 
     def transition(self, content, request, transition_name, context=None,
-                   guards=()):
+                   guards=(), idempotency_key=None):
+        if idempotency_key is not None:
+            return self._once(idempotency_key, self.transition, content,
+                              request, transition_name, context, guards)
         if self.permission_checker:
             guards = list(guards)
             permission_guard = PermissionGuard(request, transition_name,
@@ -242,52 +529,78 @@ class Workflow(object):
         from_state = self.state_of(content)
         if (from_state == to_state) and skip_same:
             return
-        state_info = self._state_info(content)
-        for info in state_info:
-            if info['name'] == to_state:
-                transitions = info['transitions']
-                if transitions:
-                    for transition in transitions:
-                        try:
-                            return self._transition(
-                                content, transition['name'], context,
-                                    request, guards)
-                        except WorkflowError as e:
-                            exc = e
-                    raise exc
-        raise WorkflowError('No transition from state %r to state %r'
-                % (from_state, to_state))
+        transitions = [transition for transition in self._leaving(from_state)
+                       if transition['to_state'] == to_state]
+        if not transitions:
+            raise WorkflowError('No transition from state %r to state %r'
+                    % (from_state, to_state))
+        if not self.deterministic and len(transitions) > 1:
+            transitions.sort(key=self._likelihood, reverse=True)
+        stats = self.transition_stats
+        if self.frozen:
+            stats = {} # record nothing
+        memo = {} # see shared_conditions
+        for transition in transitions:
+            name = transition['name']
+            counts = stats.get(name)
+            if counts is None:
+                counts = stats.setdefault(name, [0, 0])
+            try:
+                result = self._transition(content, name, context, request,
+                                          guards, memo)
+            except WorkflowError as e:
+                counts[1] += 1
+                exc = e
+            else:
+                counts[0] += 1
+                return result
+        raise exc
+
+    def _likelihood(self, transition):
+        # the (smoothed) observed success rate of ``transition``
+        successes, failures = self.transition_stats.get(transition['name'],
+                                                        (0, 0))
+        return (successes + 1.0) / (successes + failures + 2.0)
 
     def transition_to_state(self, content, request, to_state, context=None,
-                            guards=(), skip_same=True):
+                            guards=(), skip_same=True, idempotency_key=None):
+        if idempotency_key is not None:
+            return self._once(idempotency_key, self.transition_to_state,
+                              content, request, to_state, context, guards,
+                              skip_same)
         if self.permission_checker:
             guards = list(guards)
             permission_guard = PermissionGuard(request, to_state,
-                                               self.permission_checker)
+                                               self.permission_checker,
+                                               batch=True)
             guards.append(permission_guard)
-        self._transition_to_state(content, to_state, context, guards=guards,
-                                  request=request, skip_same=skip_same)
+        self._transition_to_state(content, to_state, context,
+                                  guards=guards, request=request,
+                                  skip_same=skip_same)
 
-    def _get_transitions(self, content, from_state=None):
+    def _get_transitions(self, content, from_state=None, peek=False):
         if from_state is None:
-            from_state = self.state_of(content)
+            from_state = self.state_of(content, peek)
 
-        transitions = []
-        for tname, transition in self._transition_data.items():
-            if from_state == transition['from_state']:
-                transitions.append(transition)
+        return list(self._leaving(from_state))
 
-        return transitions
-
-    def get_transitions(self, content, request, context=None, from_state=None):
+    def get_transitions(self, content, request, context=None, from_state=None,
+                        peek=False, executor=None):
         if context is None:
             context = content
-        transitions = self._get_transitions(content, from_state)
+        transitions = self._get_transitions(content, from_state, peek)
+        return self._permitted(transitions, context, request, executor)
+
+    def _permitted(self, transitions, context, request, executor=None):
+        allowed = self._allowed(transitions, context, request, executor)
         L = []
         for transition in transitions:
             permission = transition.get('permission')
             if permission is not None:
-                if self.permission_checker:
+                if allowed is not None:
+                    if permission not in allowed:
+                        continue
+                elif self.permission_checker:
                     if not self.permission_checker(permission, context, 
                                                    request):
                         continue
@@ -303,38 +616,100 @@ class CallbackInfo(object):
         self.request = request
 
 class PermissionGuard:
-    def __init__(self, request, name, checker):
+    """ Guard which checks the permission of the transition underway.
+
+    If ``batch`` is true and ``checker`` provides
+    ``IBatchPermissionChecker``, the permissions of all the transitions
+    between the same pair of states are checked in a single call the
+    first time the guard is called, and reused for the other candidate
+    transitions tried by ``transition_to_state``.
+    """
+    def __init__(self, request, name, checker, batch=False):
         self.request = request
         self.name = name
         self.checker = checker
+        self.batch = batch and IBatchPermissionChecker.providedBy(checker)
+        self._allowed = {}
+
+    def _permitted(self, permission, context, info):
+        if not self.batch:
+            return self.checker(permission, context, self.request)
+        transition = info.transition
+        key = (id(context), transition['from_state'], transition['to_state'])
+        allowed = self._allowed.get(key)
+        if allowed is None:
+            permissions = set([
+                t.get('permission')
+                for t in info.workflow._transition_data.values()
+                if t['from_state'] == transition['from_state']
+                and t['to_state'] == transition['to_state']])
+            permissions.discard(None)
+            allowed = set(self.checker.allowed(permissions, context,
+                                               self.request))
+            self._allowed[key] = allowed
+        return permission in allowed
 
     def __call__(self, context, info):
         permission = info.transition.get('permission')
         if self.request is not None and permission is not None:
-            if not self.checker(permission, context, self.request):
+            if not self._permitted(permission, context, info):
                 raise WorkflowError(
                     '%s permission required for transition using %r' % (
                     permission, self.name)
                     )
 
+class LazyWorkflow(object):
+    """ A placeholder for a workflow registered before it is built.
+
+    ``factory`` is called, without arguments, to build the workflow the
+    first time the placeholder is resolved by ``get_workflow`` (or
+    ``get_workflows``), which then replaces it with the workflow in its
+    workflow list.  The workflow is built once even if several threads
+    resolve the placeholder at the same time.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.workflow = None
+        self._lock = threading.Lock()
+
+    def materialize(self):
+        """ Return the workflow, building it if necessary. """
+        workflow = self.workflow
+        if workflow is None:
+            with self._lock:
+                workflow = self.workflow
+                if workflow is None:
+                    workflow = self.workflow = self.factory()
+                    self.factory = None # drop the definition
+        return workflow
+
+def _materialized(wf_def):
+    # return the workflow of ``wf_def``, replacing a lazy workflow by
+    # the workflow it builds
+    workflow = wf_def['workflow']
+    if isinstance(workflow, LazyWorkflow):
+        workflow = wf_def['workflow'] = workflow.materialize()
+    return workflow
+
 def process_wf_list(wf_list, context):
     # Try all workflows that have an elector first in ZCML order; if
     # one of those electors returns true, return the workflow
     # associated with the elector.  If no workflow with an elector has
     # an elector that returns true, or no workflows have any electors,
     # or there is no context provided, return the first workflow
-    # *without* an elector in the ZCML ordering.
+    # *without* an elector in the ZCML ordering.  Only the workflow
+    # returned is materialized if it was registered lazily.
     fallback = None
     for wf_def in wf_list:
         elector = wf_def['elector']
-        workflow = wf_def['workflow']
         if elector is None:
             if fallback is None:
-                fallback = workflow
+                fallback = wf_def
         elif context is not None:
             if elector(context):
-                return workflow
-    return fallback
+                return _materialized(wf_def)
+    if fallback is not None:
+        return _materialized(fallback)
 
 def get_workflow(content_type, type, context=None,
                  process_wf_list=process_wf_list): # process_wf_list is for test
@@ -358,3 +733,149 @@ def get_workflow(content_type, type, context=None,
     if wf_list is not None:
         return process_wf_list(wf_list, context)
 
+def _has_elector(wf_list):
+    if wf_list is not None:
+        for wf_def in wf_list:
+            if wf_def['elector'] is not None:
+                return True
+    return False
+
+def get_workflows(contents, type, contexts=None,
+                  process_wf_list=process_wf_list): # process_wf_list is for test
+    """ Return a list containing the workflow of the workflow type
+    ``type`` for each of the content types (classes, interfaces or
+    content objects) in ``contents``, in the same order; this is
+    equivalent to calling ``get_workflow`` for each of them.
+    ``contexts``, if supplied, is a sequence of the same length as
+    ``contents`` holding the context passed to electors for each
+    content type.
+
+    Workflow lists are looked up once per distinct provided
+    interface specification, and electors are only called for the
+    content types which have any and a context which is not None."""
+    sm = getSiteManager()
+    look = sm.adapters.lookup
+    default_list = look((IDefaultWorkflow,), IWorkflowList, name=type,
+                        default=None)
+    default_elects = _has_elector(default_list)
+
+    def resolve(wf_list, context):
+        if wf_list is not None:
+            wf = process_wf_list(wf_list, context)
+            if wf is not None:
+                return wf
+        if default_list is not None:
+            return process_wf_list(default_list, context)
+
+    resolved = {}
+    results = []
+    for i, content_type in enumerate(contents):
+        if not IInterface.providedBy(content_type):
+            content_type = providedBy(content_type)
+        entry = resolved.get(content_type)
+        if entry is None:
+            wf_list = None
+            if content_type not in (None, IDefaultWorkflow):
+                wf_list = look((content_type,), IWorkflowList, name=type,
+                               default=None)
+            elects = default_elects or _has_elector(wf_list)
+            entry = resolved[content_type] = (wf_list, elects,
+                                              resolve(wf_list, None))
+        wf_list, elects, workflow = entry
+        if elects and contexts is not None:
+            context = contexts[i]
+            if context is not None:
+                workflow = resolve(wf_list, context)
+        results.append(workflow)
+    return results
+
+
+def get_transitions_many(contents, type, request, context_key=None,
+                         peek=False, executor=None):
+    """ Return a list containing the transitions permitted for each of
+    the content objects in ``contents`` (see
+    ``IWorkflow.get_transitions``), in the same order, or None for
+    content objects which have no workflow of the workflow type
+    ``type``.  Each content object is used as the context passed to
+    electors and to the permission checker.
+
+    Work is shared between content objects which have the same
+    workflow and state: the transitions leaving a state are computed
+    once per workflow and state.  If ``context_key`` is supplied, it is
+    called with each content object and must return a hashable key
+    such that content objects with the same key are subject to the
+    same permissions (for example, the key of the object which holds
+    their ACL); permissions are then checked once per workflow, state
+    and key.  If ``peek`` is true, content objects are never
+    initialized (see ``IWorkflow.state_of``).  ``executor`` is passed
+    along to ``IWorkflow.get_transitions``."""
+    contents = list(contents)
+    results = [None] * len(contents)
+    groups = {}
+    workflows = get_workflows(contents, type, contents)
+    for i, workflow in enumerate(workflows):
+        if workflow is not None:
+            groups.setdefault(workflow, []).append(i)
+    for workflow, indices in groups.items():
+        if not isinstance(workflow, Workflow):
+            for i in indices:
+                results[i] = workflow.get_transitions(contents[i], request,
+                                                      peek=peek,
+                                                      executor=executor)
+            continue
+        group = [contents[i] for i in indices]
+        states = workflow.states_of(group, initialize=not peek)
+        leaving = {}
+        permitted = {}
+        for i, content, state in zip(indices, group, states):
+            if state is None:
+                state = workflow.initial_state
+            if context_key is None:
+                key = (state, id(content))
+            else:
+                key = (state, context_key(content))
+            transitions = permitted.get(key)
+            if transitions is None:
+                candidates = leaving.get(state)
+                if candidates is None:
+                    candidates = workflow._get_transitions(None, state)
+                    leaving[state] = candidates
+                transitions = workflow._permitted(candidates, content,
+                                                  request, executor)
+                permitted[key] = transitions
+            results[i] = list(transitions)
+    return results
+
+def prepare_for_fork(registry=None):
+    """ Prepare the workflows registered in ``registry`` (by default the
+    current site manager) to be shared by the processes forked from this
+    one, and return the list of the workflows prepared.  Call it once,
+    after configuration and just before forking.
+
+    Workflows registered lazily are built, each workflow (or composite
+    workflow) is frozen (see ``Workflow.freeze``), the workflow lookup
+    of each registered content type is cached by the registry, and the
+    objects then alive are moved to the permanent generation of the
+    garbage collector (``gc.freeze``, on Python 3.7 and later), so that
+    garbage collections in forked processes do not write to the memory
+    pages they share with this one."""
+    if registry is None:
+        registry = getSiteManager()
+    prepared = []
+    seen = set()
+    for registration in registry.registeredAdapters():
+        if registration.provided is not IWorkflowList:
+            continue
+        for wf_def in registration.factory:
+            workflow = _materialized(wf_def)
+            freeze = getattr(workflow, 'freeze', None)
+            if freeze is not None and id(workflow) not in seen:
+                seen.add(id(workflow))
+                freeze()
+                prepared.append(workflow)
+        registry.adapters.lookup(registration.required, IWorkflowList,
+                                 name=registration.name)
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    return prepared
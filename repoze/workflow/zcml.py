@@ -1,9 +1,11 @@
 import warnings
+from functools import partial
 
 from zope.component import getSiteManager
 from zope.configuration.config import GroupingContextDecorator
 from zope.configuration.config import IConfigurationContext
 from zope.configuration.exceptions import ConfigurationError
+from zope.configuration.fields import Bool
 from zope.configuration.fields import GlobalObject
 from zope.configuration.fields import Tokens
 from zope.interface import Interface
@@ -15,8 +17,11 @@ from zope.schema import TextLine
 from repoze.workflow.interfaces import IWorkflow
 from repoze.workflow.interfaces import IWorkflowList
 from repoze.workflow.interfaces import IDefaultWorkflow
+from repoze.workflow.workflow import LazyWorkflow
 from repoze.workflow.workflow import Workflow
 from repoze.workflow.workflow import WorkflowError
+from repoze.workflow.guards import compile_guard
+from repoze.workflow.guards import order_independent as _order_independent
 from repoze.workflow._compat import text_ as _u
 
 def handler(methodName, *args, **kwargs): # pragma: no cover
@@ -24,8 +29,11 @@ def handler(methodName, *args, **kwargs): # pragma: no cover
     method(*args, **kwargs)
 
 class IGuardDirective(Interface):
-    """ A directive for a guard on a transition. """
-    function = GlobalObject(title=_u('enter guard function'), required=True)
+    """ A directive for a guard on a transition: either a guard
+    function or a guard expression. """
+    function = GlobalObject(title=_u('enter guard function'), required=False)
+    expression = TextLine(title=_u('guard expression'), required=False)
+    order_independent = Bool(title=_u('order independent'), required=False)
 
 class IKeyValueDirective(Interface):
     """ The interface for a key/value pair subdirective """
@@ -44,12 +52,15 @@ class ITransitionDirective(Interface):
     permission = TextLine(title=_u('permission'), required=False)
     title = TextLine(title=_u('title'), required=False)
     callback = GlobalObject(title=_u('callback'), required=False)
+    deferred = Bool(title=_u('defer callback'), required=False)
 
 class IStateDirective(Interface):
     """ The interface for a state directive """
     name = TextLine(title=_u('name'), required=True)
     title = TextLine(title=_u('title'), required=False)
     callback = GlobalObject(title=_u('enter state callback'), required=False)
+    deferred = Bool(title=_u('defer callback'), required=False)
+    parent = TextLine(title=_u('parent state'), required=False)
 
 class IWorkflowDirective(Interface):
     type = TextLine(title=_u('type'), required=True)
@@ -61,12 +72,25 @@ class IWorkflowDirective(Interface):
     elector = GlobalObject(title=_u('elector'), required=False)
     permission_checker = GlobalObject(title=_u('checker'), required=False)
     description = TextLine(title=_u('description'), required=False)
+    state_store = GlobalObject(title=_u('state store'), required=False)
+    deferred_queue = GlobalObject(title=_u('deferred callback queue'),
+                                  required=False)
+    idempotency_cache = GlobalObject(title=_u('idempotency cache'),
+                                     required=False)
+    adaptive_guards = Bool(title=_u('adaptive guard ordering'),
+                           required=False)
+    deterministic = Bool(title=_u('deterministic transition order'),
+                         required=False)
+    lazy = Bool(title=_u('build the workflow on first use'),
+                required=False)
 
 @implementer(IConfigurationContext, IWorkflowDirective)
 class WorkflowDirective(GroupingContextDecorator):
     def __init__(self, context, type, name, state_attr, initial_state,
                  content_types=(), elector=None, permission_checker=None,
-                 description=''):
+                 description='', state_store=None, deferred_queue=None,
+                 idempotency_cache=None, adaptive_guards=False,
+                 deterministic=False, lazy=False):
         self.context = context
         self.type = type
         self.name = name
@@ -78,44 +102,44 @@ class WorkflowDirective(GroupingContextDecorator):
         self.elector = elector
         self.permission_checker = permission_checker
         self.description = description
+        self.state_store = state_store
+        self.deferred_queue = deferred_queue
+        self.idempotency_cache = idempotency_cache
+        self.adaptive_guards = adaptive_guards
+        self.deterministic = deterministic
+        self.lazy = lazy
         self.transitions = [] # mutated by subdirectives
         self.states = [] # mutated by subdirectives
 
     def after(self):
-        def register(content_type):
-            workflow = Workflow(self.state_attr, self.initial_state,
-                                self.permission_checker, self.name,
-                                self.description)
-            for state in self.states:
-                try:
-                    workflow.add_state(state.name,
-                                       state.callback,
-                                       aliases=state.aliases,
-                                       title=state.title,
-                                       **state.extras)
-                except WorkflowError as why:
-                    raise ConfigurationError(str(why))
-
+        if self.lazy:
+            # guard expressions are compiled with the workflow
+            definition = self.definition()
+            def make_workflow():
+                return LazyWorkflow(partial(build_workflow, definition))
+        else:
             for transition in self.transitions:
                 try:
-                    workflow.add_transition(transition.name,
-                                            transition.from_state,
-                                            transition.to_state,
-                                            transition.callback,
-                                            transition.permission,
-                                            transition.title,
-                                            guards=transition.guards,
-                                            **transition.extras)
+                    transition.guards = [compile_guard(guard)
+                                         for guard in transition.guards]
                 except WorkflowError as why:
                     raise ConfigurationError(str(why))
+            make_workflow = self.make_workflow
 
-            try:
-                workflow.check()
-            except WorkflowError as why:
-                raise ConfigurationError(str(why))
+        # One action per content type carries the discriminator used to
+        # detect conflicts, and merely records its content type when it
+        # survives conflict resolution; the last action builds the
+        # workflow once and registers it for all the recorded types.
+        content_types = []
+
+        def register(content_type):
+            content_types.append(content_type)
+        register.directive = self # see repoze.workflow.codegen
 
-            register_workflow(workflow, self.type, content_type,
-                              self.elector, self.info)
+        def register_all():
+            if content_types:
+                register_workflows(make_workflow(), self.type,
+                                   content_types, self.elector, self.info)
 
         if self.elector is not None:
             elector_id = id(self.elector)
@@ -124,6 +148,7 @@ class WorkflowDirective(GroupingContextDecorator):
 
         if len(self.content_types) == 0:
             warnings.warn('No content_types specified:  workflow inactive.')
+            return
         for content_type in self.content_types:
             self.action(
                 discriminator = (IWorkflow, content_type, elector_id,
@@ -131,6 +156,62 @@ class WorkflowDirective(GroupingContextDecorator):
                 callable = register,
                 args = (content_type,),
                 )
+        self.action(discriminator = None, callable = register_all)
+
+    def definition(self):
+        """ Return the workflow declared by this directive as plain data:
+        a ``(options, states, transitions)`` tuple, where ``options``
+        are the arguments of ``Workflow`` and ``states`` and
+        ``transitions`` are lists of ``(args, kw)`` pairs of arguments
+        of ``add_state`` and ``add_transition``. """
+        options = (self.state_attr, self.initial_state,
+                   self.permission_checker, self.name, self.description,
+                   self.state_store, self.deferred_queue,
+                   self.idempotency_cache, self.adaptive_guards,
+                   self.deterministic)
+        states = []
+        for state in self.states:
+            kw = dict(state.extras)
+            kw['aliases'] = list(state.aliases)
+            kw['title'] = state.title
+            states.append(((state.name, state.callback), kw))
+        transitions = []
+        for transition in self.transitions:
+            kw = dict(transition.extras)
+            kw['guards'] = list(transition.guards)
+            transitions.append(((transition.name, transition.from_state,
+                                 transition.to_state, transition.callback,
+                                 transition.permission, transition.title),
+                                kw))
+        return options, states, transitions
+
+    def make_workflow(self):
+        """ Return a new workflow as declared by this directive. """
+        return build_workflow(self.definition())
+
+def build_workflow(definition):
+    """ Return a new workflow built from ``definition`` (see
+    ``WorkflowDirective.definition``); raise ``ConfigurationError`` if
+    it is invalid. """
+    options, states, transitions = definition
+    workflow = Workflow(*options)
+    for args, kw in states:
+        try:
+            workflow.add_state(*args, **kw)
+        except WorkflowError as why:
+            raise ConfigurationError(str(why))
+
+    for args, kw in transitions:
+        try:
+            workflow.add_transition(*args, **kw)
+        except WorkflowError as why:
+            raise ConfigurationError(str(why))
+
+    try:
+        workflow.check()
+    except WorkflowError as why:
+        raise ConfigurationError(str(why))
+    return workflow
 
 @implementer(IConfigurationContext, ITransitionDirective)
 class TransitionDirective(GroupingContextDecorator):
@@ -138,7 +219,8 @@ class TransitionDirective(GroupingContextDecorator):
     """
 
     def __init__(self, context, name, from_state, to_state,
-                 callback=None, permission=None, title=None):
+                 callback=None, permission=None, title=None,
+                 deferred=False):
         self.context = context
         self.name = name
         if not from_state:
@@ -150,24 +232,40 @@ class TransitionDirective(GroupingContextDecorator):
         self.title = title
         self.guards = []
         self.extras = {} # mutated by subdirectives
+        if deferred:
+            self.extras['deferred'] = True
 
     def after(self):
         self.context.transitions.append(self)
 
 @implementer(IConfigurationContext, IStateDirective)
 class StateDirective(GroupingContextDecorator):
-    def __init__(self, context, name, callback=None, title=None):
+    def __init__(self, context, name, callback=None, title=None,
+                 deferred=False, parent=None):
         self.context = context
         self.name = name
         self.callback = callback
         self.title = title
         self.extras = {} # mutated by subdirectives
+        if deferred:
+            self.extras['deferred'] = True
+        if parent:
+            self.extras['parent'] = parent
         self.aliases = []
 
     def after(self):
         self.context.states.append(self)
 
-def guard_function(context, function):
+def guard_function(context, function=None, expression=None,
+                   order_independent=False):
+    if (function is None) == (expression is None):
+        raise ConfigurationError(
+            'A guard needs either a function or an expression')
+    if expression is not None:
+        # compiled by WorkflowDirective.after
+        function = expression
+    elif order_independent:
+        function = _order_independent(function)
     context.guards.append(function)
 
 def key_value_pair(context, name, value):
@@ -183,20 +281,28 @@ def alias(context, name):
     ob.aliases.append(name)
 
 def register_workflow(workflow, type, content_type, elector, info=None):
-    if content_type is None:
-        content_type = IDefaultWorkflow
-
-    if not IInterface.providedBy(content_type):
-        content_type = providedBy(content_type)
+    register_workflows(workflow, type, (content_type,), elector, info)
 
+def register_workflows(workflow, type, content_types, elector, info=None):
+    """ Register ``workflow`` as the workflow of the type ``type`` of
+    each of the ``content_types``. """
     sm = getSiteManager()
+    lookup = sm.adapters.lookup
+
+    for content_type in content_types:
+        if content_type is None:
+            content_type = IDefaultWorkflow
+
+        if not IInterface.providedBy(content_type):
+            content_type = providedBy(content_type)
 
-    wf_list = sm.adapters.lookup((content_type,), IWorkflowList, name=type,
-                                 default=None)
+        wf_list = lookup((content_type,), IWorkflowList, name=type,
+                         default=None)
 
-    if wf_list is None:
-        wf_list = []
-        sm.registerAdapter(wf_list, (content_type,), IWorkflowList, type, info)
+        if wf_list is None:
+            wf_list = []
+            sm.registerAdapter(wf_list, (content_type,), IWorkflowList,
+                               type, info)
 
-    wf_list.append({'workflow':workflow, 'elector':elector})
+        wf_list.append({'workflow':workflow, 'elector':elector})
 